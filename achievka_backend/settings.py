@@ -240,6 +240,37 @@ ASSISTANT_MOTIVATION_CREATE_ID = "asst_ZAlTGgL7ZJ2EWYLdGo6or6CK"
 AWS_S3_BUCKET         = os.getenv("AWS_S3_BUCKET")
 AWS_REGION            = os.getenv("AWS_REGION")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+# Компактизация истории для analyse
+HISTORY_TOKEN_BUDGET         = int(os.getenv("HISTORY_TOKEN_BUDGET", 6000))
+HISTORY_KEEP_RECENT_MESSAGES = int(os.getenv("HISTORY_KEEP_RECENT_MESSAGES", 4))
+HISTORY_SUMMARY_MODEL        = os.getenv("HISTORY_SUMMARY_MODEL", "gpt-4o-mini")
+HISTORY_SUMMARY_MAX_TOKENS   = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", 600))
+
+# Параллельная генерация разделов черновика
+DRAFT_SECTION_MODEL       = os.getenv("DRAFT_SECTION_MODEL", "gpt-4o-mini")
+DRAFT_SECTION_MAX_TOKENS  = int(os.getenv("DRAFT_SECTION_MAX_TOKENS", 700))
+DRAFT_SECTION_MAX_WORKERS = int(os.getenv("DRAFT_SECTION_MAX_WORKERS", 6))
+
+# Фоновая переоценка писем
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", 300))
+REANALYSIS_CONCURRENCY     = int(os.getenv("REANALYSIS_CONCURRENCY", 4))
+REANALYSIS_MAX_ATTEMPTS    = int(os.getenv("REANALYSIS_MAX_ATTEMPTS", 3))
+REANALYSIS_STALE_SECONDS   = int(os.getenv("REANALYSIS_STALE_SECONDS", 600))
+
+# Примеры эссе и критерии из векторного индекса в analyse (0 — не добавлять)
+ANALYSE_CONTEXT_K             = int(os.getenv("ANALYSE_CONTEXT_K", 3))
+ANALYSE_CONTEXT_MAX_TOKENS    = int(os.getenv("ANALYSE_CONTEXT_MAX_TOKENS", 1500))
+ANALYSE_CONTEXT_CACHE_SECONDS = int(os.getenv("ANALYSE_CONTEXT_CACHE_SECONDS", 7 * 24 * 3600))
+LETTER_EMBEDDING_WORKERS      = int(os.getenv("LETTER_EMBEDDING_WORKERS", 2))
+# Документы с косинусной близостью ниже порога в analyse не попадают (-1 — без порога)
+ANALYSE_CONTEXT_MIN_SIMILARITY = float(os.getenv("ANALYSE_CONTEXT_MIN_SIMILARITY", 0.3))
+
+# Рекомендации программ по избранному (/programs/recommended/)
+PROGRAM_RECOMMENDATIONS_K = int(os.getenv("PROGRAM_RECOMMENDATIONS_K", 50))
+
+# Токен для /api/metrics/ (пусто — эндпоинт закрыт)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
 ROOT_URLCONF = 'achievka_backend.urls'
 TEMPLATES = [
     {
@@ -280,6 +311,22 @@ DATABASES = {
     }
 }
 
+# Кэш общий для всех воркеров, если задан REDIS_URL (бюджеты запросов к OpenAI и т.п.)
+REDIS_URL = os.getenv("REDIS_URL")
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
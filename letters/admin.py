@@ -1,12 +1,48 @@
-from django.contrib import admin
-from .models import Letter, LetterVersion
+from django.contrib import admin, messages
+from django.db.models import Count, Q
+from .models import Letter, LetterVersion, AnalysisResult, ReanalysisJob
+from .reanalysis import create_job
 
 @admin.register(Letter)
 class LetterAdmin(admin.ModelAdmin):
     list_display = ('name', 'type', 'user', 'updated_at')
     list_filter = ('type',)
+    actions = ['reanalyse']
+
+    @admin.action(description='Переоценить последнюю версию текущим ассистентом')
+    def reanalyse(self, request, queryset):
+        # выполняет задачу не веб-воркер, а reanalyse_letters (--pending по cron или --resume)
+        job = create_job(letter_ids=queryset.values_list('id', flat=True))
+        self.message_user(
+            request,
+            f'Создана задача переоценки #{job.pk} ({job.total} версий). Её выполнит '
+            f'manage.py reanalyse_letters --pending или --resume {job.pk}.',
+            level=messages.SUCCESS
+        )
 
 @admin.register(LetterVersion)
 class LetterVersionAdmin(admin.ModelAdmin):
     list_display = ('letter', 'version_num', 'created_at', 'checked_at')
     list_filter = ('letter__type',)
+
+@admin.register(AnalysisResult)
+class AnalysisResultAdmin(admin.ModelAdmin):
+    list_display = ('version', 'overall_score', 'created_at')
+    list_filter = ('letter__type',)
+    readonly_fields = ('letter', 'version', 'message', 'payload', 'overall_score', 'created_at')
+
+@admin.register(ReanalysisJob)
+class ReanalysisJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'letter_type', 'status', 'progress', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    readonly_fields = ('letter_type', 'status', 'total', 'started_at', 'finished_at', 'heartbeat_at')
+
+    def get_queryset(self, request):
+        # счётчики одним запросом на всю страницу, а не по запросу на строку
+        return super().get_queryset(request).annotate(
+            done_count=Count('items', filter=Q(items__status='done')),
+            failed_count=Count('items', filter=Q(items__status='failed')),
+        )
+
+    def progress(self, obj):
+        return f"{obj.done_count}/{obj.total} (failed {obj.failed_count})"
@@ -0,0 +1,254 @@
+import json
+import logging
+import re
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import openai
+from django.conf import settings
+from django.db import transaction
+
+from .history import build_history
+from .models import AnalysisResult, AnalysisCriterionScore, VersionMessage
+from .retrieval import format_context, retrieve_context
+from .timing import PhaseTimer
+
+# Ключи, под которыми ассистенты кладут итоговую оценку
+OVERALL_KEYS = ("overall_score", "total_score", "overall", "score")
+# Ключи со словарём/списком оценок по критериям
+CRITERIA_KEYS = ("criteria", "scores", "criteria_scores")
+CRITERION_NAME_KEYS = ("criterion", "name", "key", "title")
+
+_NUMBER_RE = re.compile(r"-?\d+(?:[.,]\d+)?")
+
+
+def _to_number(value: Any) -> Optional[float]:
+    """
+    7, 7.5, "7.5", "7/10" → float; всё остальное → None.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, dict):
+        return _to_number(value.get("score"))
+    if isinstance(value, str):
+        match = _NUMBER_RE.search(value)
+        if match:
+            return float(match.group().replace(",", "."))
+    return None
+
+
+def extract_scores(payload: Any) -> Tuple[Optional[float], Dict[str, float]]:
+    """
+    Достаёт из JSON ассистента итоговую оценку и оценки по критериям.
+    Поддерживает критерии как словарь {name: score | {score: ..}}
+    и как список [{criterion|name|key: .., score: ..}].
+    """
+    if not isinstance(payload, dict):
+        return None, {}
+
+    overall = None
+    for key in OVERALL_KEYS:
+        if key in payload:
+            overall = _to_number(payload[key])
+            if overall is not None:
+                break
+
+    criteria: Dict[str, float] = {}
+    for key in CRITERIA_KEYS:
+        raw = payload.get(key)
+        if isinstance(raw, dict):
+            items = raw.items()
+        elif isinstance(raw, list):
+            items = []
+            for item in raw:
+                if not isinstance(item, dict):
+                    continue
+                name = next((item[k] for k in CRITERION_NAME_KEYS if item.get(k)), None)
+                if name is not None:
+                    items.append((name, item))
+        else:
+            continue
+        for name, value in items:
+            score = _to_number(value)
+            if score is not None:
+                criteria[str(name)[:100]] = score
+        if criteria:
+            break
+
+    return overall, criteria
+
+
+def build_analysis_result(message, payload) -> Tuple[AnalysisResult, list]:
+    """
+    Несохранённые AnalysisResult и оценки по критериям для assistant-сообщения.
+    """
+    overall, criteria = extract_scores(payload)
+    result = AnalysisResult(
+        letter_id=message.version.letter_id,
+        version_id=message.version_id,
+        message=message,
+        payload=payload,
+        overall_score=overall,
+        created_at=message.created_at,
+    )
+    scores = [
+        AnalysisCriterionScore(result=result, criterion=name, score=score)
+        for name, score in criteria.items()
+    ]
+    return result, scores
+
+
+def record_analysis(message, payload) -> AnalysisResult:
+    result, scores = build_analysis_result(message, payload)
+    result.save()
+    AnalysisCriterionScore.objects.bulk_create(scores)
+    return result
+
+
+class AnalysisError(Exception):
+    """
+    Ошибка на одном из шагов analyse; detail/error/raw уходят в ответ API.
+    """
+    def __init__(self, detail: str, error: str = None, raw: str = None):
+        super().__init__(detail)
+        self.detail = detail
+        self.error = error
+        self.raw = raw
+
+    def as_response_data(self) -> Dict[str, str]:
+        data = {"detail": self.detail}
+        if self.error is not None:
+            data["error"] = self.error
+        if self.raw is not None:
+            data["raw"] = self.raw
+        return data
+
+
+def get_assistant_id(letter_type: str) -> Optional[str]:
+    assistant_map = {
+        "common_app": settings.ASSISTANT_COMMON_APP_ID,
+        "ucas":       settings.ASSISTANT_UCAS_ID,
+        "motivation": settings.ASSISTANT_MOTIVATION_ID,
+    }
+    return assistant_map.get(letter_type)
+
+
+def call_openai(detail: str, throttle: Optional[Callable[[], None]], fn, *args, **kwargs):
+    """
+    Запрос к OpenAI через throttle; любая ошибка — AnalysisError(detail).
+    """
+    if throttle is not None:
+        throttle()
+    try:
+        return fn(*args, **kwargs)
+    except Exception as e:
+        logging.exception(detail)
+        raise AnalysisError(detail, error=str(e))
+
+
+def wait_for_run(thread_id: str, run, timer: PhaseTimer):
+    """
+    Поллинг run до завершения; время между опросами делится
+    на фазы run_queued / run_in_progress по статусу до опроса.
+    Опросы не проходят через throttle: иначе долгий run съедал бы
+    бюджет OPENAI_REQUESTS_PER_MINUTE по единице в секунду.
+    """
+    last = time.perf_counter()
+    while run.status in ("queued", "in_progress"):
+        phase = f"run_{run.status}"
+        time.sleep(1)
+        run = call_openai(
+            "Run polling failed", None,
+            openai.beta.threads.runs.retrieve,
+            thread_id=thread_id, run_id=run.id
+        )
+        now = time.perf_counter()
+        timer.add(phase, now - last)
+        last = now
+    return run
+
+
+def analyse_version(
+    version,
+    letter_text: str,
+    assistant_id: str,
+    throttle: Optional[Callable[[], None]] = None,
+    timer: Optional[PhaseTimer] = None,
+) -> Dict:
+    """
+    Проверка версии письма через Assistants API:
+      1) создаёт новый thread
+      2) добавляет в него историю (с саммари), примеры из векторного индекса
+         того же типа письма + текущее письмо
+      3) запускает run у assistant_id и ждёт завершения
+      4) сохраняет user/assistant сообщения и AnalysisResult
+    throttle вызывается перед каждым запросом к OpenAI (и за саммари истории), кроме опросов run
+    (бюджет для фоновых задач), длительности шагов пишутся в timer и
+    сохраняются в assistant-сообщении.
+    Возвращает распарсенный JSON ассистента, при ошибке бросает AnalysisError.
+    """
+    timer = timer or PhaseTimer()
+    prev_messages = build_history(version, timer=timer, throttle=throttle)
+    with timer.span("retrieval"):
+        context = format_context(retrieve_context(version, letter_text))
+    if context:
+        # в БД не сохраняется: история версии — только письмо и ответы
+        prev_messages.append({"role": "user", "content": context})
+
+    with timer.span("thread_create"):
+        thread = call_openai("OpenAI thread creation failed", throttle, openai.beta.threads.create)
+
+    with timer.span("message_post"):
+        for m in prev_messages + [{"role": "user", "content": letter_text}]:
+            call_openai(
+                "Thread messaging failed", throttle,
+                openai.beta.threads.messages.create,
+                thread_id=thread.id,
+                role=m["role"],
+                content=m["content"]
+            )
+
+    # сохраняем user-сообщение в БД
+    with timer.span("db"):
+        VersionMessage.objects.create(
+            version=version, role="user", content=letter_text
+        )
+
+    with timer.span("run_queued"):
+        run = call_openai(
+            "Run creation failed", throttle,
+            openai.beta.threads.runs.create,
+            thread_id=thread.id,
+            assistant_id=assistant_id
+        )
+    run = wait_for_run(thread.id, run, timer)
+
+    with timer.span("message_list"):
+        msgs = call_openai(
+            "Listing thread messages failed", throttle,
+            openai.beta.threads.messages.list,
+            thread_id=thread.id
+        )
+    if not msgs.data:
+        raise AnalysisError("No assistant response")
+
+    # извлекаем текст первого сообщения ассистента
+    assistant_reply = msgs.data[0].content[0].text.value
+
+    with timer.span("parse"):
+        try:
+            data = json.loads(assistant_reply)
+        except json.JSONDecodeError:
+            logging.error("Invalid JSON from assistant: %s", assistant_reply)
+            raise AnalysisError("Non-JSON from OpenAI", raw=assistant_reply)
+
+    # сохраняем ответ ассистента и его структурированную версию — вместе или никак
+    with timer.span("db"), transaction.atomic():
+        reply_message = VersionMessage.objects.create(
+            version=version, role="assistant", content=assistant_reply,
+            timings=timer.finish()
+        )
+        record_analysis(reply_message, data)
+    return data
@@ -0,0 +1,239 @@
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .vector_keys import KeyTable, hash64
+
+# Okapi BM25 parameters: term frequency saturation and document length normalisation
+K1 = 1.2
+B = 0.75
+
+# one record per distinct term of a document
+TERM_DTYPE = np.dtype([("term", "<u8"), ("tf", "<u4")])
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased word tokens; digits count, so "2025" or "MSc" stay searchable."""
+    return _TOKEN.findall(text.lower())
+
+
+@lru_cache(maxsize=1 << 20)
+def term_hash(token: str) -> int:
+    return hash64(token)
+
+
+class TermTable:
+    """
+    Per-slot term frequencies, the forward half of a BM25 index.
+
+    <path>.terms   — TERM_DTYPE records, the distinct terms of each document in turn
+    <path>.termidx — uint64 end offsets (in records), entry i closes slot i
+
+    Like the docstore, records go in before their offset, and records past
+    the last offset (an interrupted append) are ignored and overwritten.
+    Postings are built from this file in memory, per range of slots.
+    """
+
+    def __init__(self, path: str):
+        self.terms_path = path + ".terms"
+        self.idx_path = path + ".termidx"
+
+    def __len__(self) -> int:
+        if not os.path.exists(self.idx_path):
+            return 0
+        return os.path.getsize(self.idx_path) // 8
+
+    def _offsets(self, count: int) -> np.ndarray:
+        if not count:
+            return np.zeros(0, dtype="<u8")
+        return np.fromfile(self.idx_path, dtype="<u8", count=count)
+
+    def append(self, texts: List[str], first_slot: int) -> bool:
+        count = len(self)
+        if count != first_slot:
+            return False
+        counts = [Counter(tokenize(text)) for text in texts]
+        records = np.array([(term_hash(token), tf) for c in counts for token, tf in c.items()],
+                           dtype=TERM_DTYPE)
+        end = int(self._offsets(count)[-1]) if count else 0
+        offsets = end + np.cumsum([len(c) for c in counts], dtype="<u8")
+        KeyTable._append(self.terms_path, records.tobytes(), end * TERM_DTYPE.itemsize)
+        KeyTable._append(self.idx_path, offsets.astype("<u8").tobytes(), count * 8)
+        return True
+
+    def read(self, start: int, end: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(records, distinct terms per slot) for slots start..end that have records."""
+        end = min(end, len(self))
+        if end <= start:
+            return np.zeros(0, dtype=TERM_DTYPE), np.zeros(0, dtype="int64")
+        offsets = self._offsets(end)
+        first = int(offsets[start - 1]) if start else 0
+        records = np.fromfile(self.terms_path, dtype=TERM_DTYPE, count=int(offsets[-1]) - first,
+                              offset=first * TERM_DTYPE.itemsize)
+        return records, np.diff(offsets[start:].astype("int64"), prepend=first)
+
+    def truncate(self, count: int):
+        """Drops records for slots >= count (used when recovering from a crash)."""
+        if len(self) > count:
+            with open(self.idx_path, "ab") as f:
+                f.truncate(count * 8)
+
+
+class Postings:
+    """
+    Inverted index over slots start..start + count, immutable once built:
+    sorted distinct term hashes, and per term a run of (slot, tf) pairs.
+    """
+
+    def __init__(self, table: TermTable, start: int, end: int):
+        records, counts = table.read(start, end)
+        self.start = start
+        self.count = end - start
+        docs = np.repeat(np.arange(len(counts), dtype="int32"), counts)
+        tfs = records["tf"].astype("float32")
+        self.lengths = np.zeros(self.count, dtype="float32")
+        self.lengths[:len(counts)] = np.bincount(docs, weights=tfs, minlength=len(counts))
+        order = np.argsort(records["term"], kind="stable")
+        terms = records["term"][order]
+        self.vocab, first = np.unique(terms, return_index=True)
+        self.bounds = np.append(first, len(terms))
+        self.docs = docs[order]
+        self.tfs = tfs[order]
+
+    @property
+    def end(self) -> int:
+        return self.start + self.count
+
+    def run(self, term: int) -> Optional[slice]:
+        i = int(np.searchsorted(self.vocab, term))
+        if i < len(self.vocab) and self.vocab[i] == term:
+            return slice(int(self.bounds[i]), int(self.bounds[i + 1]))
+        return None
+
+
+def _live_stats(segments: Tuple[Postings, ...], live: Optional[np.ndarray]) -> Tuple[int, float]:
+    """
+    (number of documents, their average length) over the slots of segments;
+    with live given, only over the slots it sets (slots past it are not live).
+    """
+    if live is None:
+        total = sum(s.count for s in segments)
+        length = sum(float(s.lengths.sum()) for s in segments)
+    else:
+        total, length = 0, 0.0
+        for s in segments:
+            mask = live[s.start:s.end]
+            total += int(np.count_nonzero(mask))
+            length += float(s.lengths[:len(mask)][mask].sum())
+    return total, max(length / total, 1.0) if total else 1.0
+
+
+def _df(segments: Tuple[Postings, ...], runs: List[Optional[slice]],
+        live: Optional[np.ndarray]) -> int:
+    """Documents holding a term, given its run in each segment; live as in _live_stats."""
+    if live is None:
+        return sum(r.stop - r.start for r in runs if r is not None)
+    df = 0
+    for s, r in zip(segments, runs):
+        if r is not None:
+            slots = s.docs[r] + s.start
+            df += int(np.count_nonzero(live[slots[slots < len(live)]]))
+    return df
+
+
+def idf(segments: Tuple[Postings, ...], query: str,
+        live: Optional[np.ndarray] = None) -> Dict[str, float]:
+    """
+    BM25 inverse document frequency of each distinct query token. Postings
+    keep tombstoned slots: pass the mask of live ones so they do not count.
+    """
+    total, _ = _live_stats(segments, live)
+    weights = {}
+    for token in set(tokenize(query)):
+        df = _df(segments, [s.run(term_hash(token)) for s in segments], live)
+        weights[token] = float(np.log(1 + (total - df + 0.5) / (df + 0.5)))
+    return weights
+
+
+def match_bonus(query: str, text: str, weights: Dict[str, float]) -> float:
+    """
+    Share of the query's weight (idf) carried by terms found in text, plus 1
+    if the query (two or more terms) occurs in it as a phrase: rewards
+    documents naming exactly the program or university asked about.
+    """
+    query_tokens = tokenize(query)
+    total = sum(weights.get(token, 0.0) for token in set(query_tokens))
+    if not total:
+        return 0.0
+    tokens = tokenize(text)
+    bonus = sum(weights.get(token, 0.0) for token in set(query_tokens) & set(tokens)) / total
+    if len(query_tokens) > 1 and f" {' '.join(query_tokens)} " in f" {' '.join(tokens)} ":
+        bonus += 1.0
+    return bonus
+
+
+def add_segment(segments: Tuple[Postings, ...], table: TermTable, end: int) -> Tuple[Postings, ...]:
+    """
+    Extends segments to slot end with one for the new slots, merging the last
+    two while the newer is no smaller (as the vector tail does): O(log n)
+    segments per query, each slot re-indexed O(log n) times.
+    """
+    start = segments[-1].end if segments else 0
+    if end <= start:
+        return segments
+    segments = list(segments) + [Postings(table, start, end)]
+    while len(segments) > 1 and segments[-1].count >= segments[-2].count:
+        newer, older = segments.pop(), segments.pop()
+        segments.append(Postings(table, older.start, newer.end))
+    return tuple(segments)
+
+
+def search(segments: Tuple[Postings, ...], query: str, allowed: np.ndarray,
+           k: int, live: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    BM25 top-k among slots where allowed is set: (scores, slots), best first.
+    Slots past len(allowed) are ignored. Document frequencies and the average
+    length count the slots live sets (all by default) rather than allowed:
+    tombstones do not skew them and filters do not change them.
+    """
+    terms = [term_hash(token) for token in set(tokenize(query))]
+    total, avg_length = _live_stats(segments, live)
+    if not terms or not total:
+        return np.zeros(0, dtype="float32"), np.zeros(0, dtype="int64")
+
+    runs = [[s.run(term) for s in segments] for term in terms]
+    idfs = []
+    for term_runs in runs:
+        df = _df(segments, term_runs, live)
+        idfs.append(np.log(1 + (total - df + 0.5) / (df + 0.5)))
+    scores_out, slots_out = [], []
+    for j, segment in enumerate(segments):
+        if segment.start >= len(allowed):
+            break
+        scores = np.zeros(segment.count, dtype="float32")
+        norm = K1 * (1 - B + B * segment.lengths / avg_length)
+        for term_runs, term_idf in zip(runs, idfs):
+            run = term_runs[j]
+            if run is None:
+                continue
+            docs, tfs = segment.docs[run], segment.tfs[run]
+            scores[docs] += term_idf * tfs * (K1 + 1) / (tfs + norm[docs])
+        scores[len(allowed) - segment.start:] = 0
+        scores[:len(allowed) - segment.start][~allowed[segment.start:segment.end]] = 0
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        scores_out.append(scores[hits])
+        slots_out.append(hits + segment.start)
+
+    if not scores_out:
+        return np.zeros(0, dtype="float32"), np.zeros(0, dtype="int64")
+    scores, slots = np.concatenate(scores_out), np.concatenate(slots_out)
+    order = np.argsort(-scores, kind="stable")[:k]
+    return scores[order], slots[order]
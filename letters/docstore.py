@@ -0,0 +1,102 @@
+import json
+import mmap
+import os
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+class DocStore:
+    """
+    Append-only document store addressed by vector id.
+
+    <path>.idx — uint64 end offsets, entry i closes document i in <path>.bin
+    <path>.bin — JSON-encoded documents back to back
+
+    Both files are memory-mapped for reads, so get() touches only the
+    requested documents, and workers share page-cache pages. Bytes past the
+    last offset (an interrupted append) are ignored and overwritten.
+    """
+
+    def __init__(self, path: str):
+        self.idx_path = path + ".idx"
+        self.bin_path = path + ".bin"
+        self._lock = threading.Lock()
+        # (offsets, blob) replaced as a whole, so readers never see a half-updated pair
+        self._view = None
+
+    def _remap(self):
+        with self._lock:
+            offsets = np.zeros(0, dtype="<u8")
+            if os.path.exists(self.idx_path):
+                # a torn trailing entry (crash mid-write) is not a document
+                count = os.path.getsize(self.idx_path) // 8
+                if count:
+                    offsets = np.memmap(self.idx_path, dtype="<u8", mode="r", shape=(count,))
+            blob = None
+            if len(offsets) and offsets[-1] > 0:
+                with open(self.bin_path, "rb") as f:
+                    blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = (offsets, blob)
+            return self._view
+
+    def _mapping(self, min_count: int = 0):
+        view = self._view
+        if view is None or len(view[0]) < min_count:
+            view = self._remap()
+        return view
+
+    def __len__(self) -> int:
+        # always re-read: other processes may have appended
+        return len(self._remap()[0])
+
+    def get(self, ids: Sequence[int]) -> List[Optional[Dict]]:
+        ids = [int(i) for i in ids]
+        offsets, blob = self._mapping(max(ids, default=-1) + 1)
+        docs = []
+        for i in ids:
+            if i < 0 or i >= len(offsets):
+                docs.append(None)
+                continue
+            start = int(offsets[i - 1]) if i else 0
+            docs.append(json.loads(blob[start:int(offsets[i])]))
+        return docs
+
+    def append(self, docs: List[Dict]) -> int:
+        """
+        Appends documents, returns the id of the first one.
+        Text goes in before its offsets, so a reader never sees an offset
+        pointing past written bytes.
+        """
+        encoded = [json.dumps(d, ensure_ascii=False).encode("utf-8") for d in docs]
+        with self._lock:
+            count = os.path.getsize(self.idx_path) // 8 if os.path.exists(self.idx_path) else 0
+            end = 0
+            if count:
+                with open(self.idx_path, "rb") as f:
+                    f.seek((count - 1) * 8)
+                    end = int(np.frombuffer(f.read(8), dtype="<u8")[0])
+
+            ends = end + np.cumsum([len(e) for e in encoded], dtype=np.uint64)
+            with open(self.bin_path, "ab") as f:
+                f.truncate(end)
+                f.write(b"".join(encoded))
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.idx_path, "ab") as f:
+                f.truncate(count * 8)
+                f.write(ends.astype("<u8").tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._view = None
+            return count
+
+    def truncate(self, count: int):
+        """Drops documents with id >= count (used when recovering from a crash)."""
+        with self._lock:
+            if os.path.exists(self.idx_path) and os.path.getsize(self.idx_path) > count * 8:
+                with open(self.idx_path, "ab") as f:
+                    f.truncate(count * 8)
+            self._view = None
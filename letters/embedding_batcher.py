@@ -0,0 +1,96 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+from .timing import incr_counter
+
+
+class EmbeddingBatcher:
+    """
+    Merges concurrent single-text embedding requests into batched calls.
+
+    The first request of a batch waits at most max_wait seconds for others to
+    join, or until max_batch texts are queued; the batch then goes to embed()
+    on a pool, so a slow API call never holds up collecting the next batch.
+    Only when max_concurrency calls are already in flight does a batch wait
+    longer, and it keeps growing meanwhile instead of queueing behind them.
+    Each caller gets its own row back, or the batch's exception. Threads
+    start on first use, so a batcher created before a fork works in every
+    child.
+    """
+
+    def __init__(self, embed: Callable[[List[str]], np.ndarray], max_batch: int = 256,
+                 max_wait: float = 0.005, max_concurrency: int = 16):
+        self._embed = embed
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_concurrency = max_concurrency
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue: Optional[queue.Queue] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def _start(self) -> queue.Queue:
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    self._pool = ThreadPoolExecutor(self.max_concurrency,
+                                                    thread_name_prefix="embedding-batch")
+                    slots = threading.BoundedSemaphore(self.max_concurrency)
+                    threading.Thread(target=self._collect, args=(self._queue, self._pool, slots),
+                                     name="embedding-batcher", daemon=True).start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def submit(self, text: str) -> "Future[np.ndarray]":
+        future: Future = Future()
+        self._start().put((text, future))
+        return future
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.submit(text).result()
+
+    def embed_many(self, texts: Sequence[str]) -> np.ndarray:
+        """Each text joins whatever batch is forming, like separate callers would."""
+        futures = [self.submit(text) for text in texts]
+        return np.array([future.result() for future in futures], dtype="float32")
+
+    def _collect(self, requests: queue.Queue, pool: ThreadPoolExecutor,
+                 slots: threading.BoundedSemaphore):
+        while True:
+            batch = [requests.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    if slots.acquire(blocking=False):
+                        break
+                    # every call is in flight: keep collecting until one returns
+                    timeout = self.max_wait
+                try:
+                    batch.append(requests.get(timeout=timeout))
+                except queue.Empty:
+                    pass
+            else:
+                slots.acquire()
+            pool.submit(self._run, batch, slots)
+
+    def _run(self, batch, slots: threading.BoundedSemaphore):
+        try:
+            vectors = self._embed([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        finally:
+            slots.release()
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
+        incr_counter("embedding_batches", 1)
+        incr_counter("embedding_batched_texts", len(batch))
@@ -0,0 +1,166 @@
+import fcntl
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Tuple
+
+import numpy as np
+
+# Entries per set: a key can live only in its set, the least recently used one is evicted
+WAYS = 16
+# sha256 of (model, text) as 4 x uint64; all zeros marks an empty slot
+SLOT_DTYPE = np.dtype([("key", "<u8", (4,)), ("used", "<u4")])
+
+
+def cache_key(model: str, text: str) -> np.ndarray:
+    digest = hashlib.sha256(model.encode("utf-8") + b"\0" + text.encode("utf-8")).digest()
+    return np.frombuffer(digest, dtype="<u8")
+
+
+class EmbeddingCache:
+    """
+    Size-bounded, disk-backed cache of embeddings keyed by (model, sha256(text)).
+
+    <path>.<capacity>x<d>.vec  — float32 matrix (capacity, d)
+    <path>.<capacity>x<d>.keys — SLOT_DTYPE per row: the key and its last-use time
+    <path>.<capacity>x<d>.lock — flock target for creating the files and for writers
+
+    Both data files are memory-mapped and shared by all workers on a host.
+    Slots are grouped in sets of WAYS by key hash, so lookups touch one set
+    and no in-memory index has to be rebuilt when another process adds
+    entries. The shape is part of the file names: a resized cache starts in
+    new files instead of truncating ones other workers have mapped.
+    """
+
+    def __init__(self, path: str, d: int, capacity: int):
+        self.d = d
+        self.sets = max(1, capacity // WAYS)
+        self.capacity = self.sets * WAYS
+        base = f"{path}.{self.capacity}x{d}"
+        self.vec_path = base + ".vec"
+        self.keys_path = base + ".keys"
+        self.lock_path = base + ".lock"
+        self._lock = threading.Lock()
+        self._keys = None
+        self._vectors = None
+
+    @contextmanager
+    def _file_lock(self):
+        # "a" creates the lock file but never truncates it
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    @staticmethod
+    def _create(path: str, size: int) -> None:
+        # under _file_lock: exactly one process creates the file, the rest see it
+        # at full size; the file stays sparse until filled
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return
+        try:
+            os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _map(path: str, dtype, shape) -> np.memmap:
+        size = np.dtype(dtype).itemsize * int(np.prod(shape))
+        actual = os.path.getsize(path)
+        if actual != size:
+            raise RuntimeError(
+                f"{path} is {actual} bytes, expected {size}; "
+                f"remove it to start this cache empty"
+            )
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def _open(self):
+        if self._keys is None:
+            with self._lock:
+                if self._keys is None:
+                    vec_shape, keys_shape = (self.capacity, self.d), (self.capacity,)
+                    with self._file_lock():
+                        self._create(self.vec_path, 4 * self.capacity * self.d)
+                        self._create(self.keys_path, SLOT_DTYPE.itemsize * self.capacity)
+                    self._vectors = self._map(self.vec_path, np.float32, vec_shape)
+                    self._keys = self._map(self.keys_path, SLOT_DTYPE, keys_shape)
+        return self._keys, self._vectors
+
+    def _set(self, key: np.ndarray) -> slice:
+        start = int(key[0] % self.sets) * WAYS
+        return slice(start, start + WAYS)
+
+    def _find(self, keys: np.memmap, key: np.ndarray):
+        ways = self._set(key)
+        match = np.flatnonzero(np.all(keys["key"][ways] == key, axis=1))
+        return ways.start + int(match[0]) if len(match) else None
+
+    def get(self, model: str, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (vectors, found): rows of vectors are filled where found is True.
+        """
+        keys, vectors = self._open()
+        out = np.zeros((len(texts), self.d), dtype=np.float32)
+        found = np.zeros(len(texts), dtype=bool)
+        now = int(time.time())
+        for i, text in enumerate(texts):
+            key = cache_key(model, text)
+            slot = self._find(keys, key)
+            if slot is None:
+                continue
+            row = np.array(vectors[slot])
+            # the slot may have been evicted while we copied it
+            if not np.array_equal(keys["key"][slot], key):
+                continue
+            out[i] = row
+            found[i] = True
+            keys["used"][slot] = now
+        return out, found
+
+    @contextmanager
+    def _write_lock(self):
+        # one writer per host at a time; readers never block
+        with self._lock, self._file_lock():
+            yield
+
+    def put(self, model: str, texts: List[str], embeddings: np.ndarray):
+        keys, vectors = self._open()
+        now = int(time.time())
+        with self._write_lock():
+            writes = []
+            taken = set()
+            for text, embedding in zip(texts, embeddings):
+                key = cache_key(model, text)
+                if self._find(keys, key) is not None:
+                    continue
+                ways = self._set(key)
+                candidates = [s for s in range(ways.start, ways.stop) if s not in taken]
+                if not candidates:
+                    continue
+                empty = [s for s in candidates if not keys["key"][s].any()]
+                slot = empty[0] if empty else min(candidates, key=lambda s: keys["used"][s])
+                taken.add(slot)
+                writes.append((slot, key, embedding))
+            if not writes:
+                return
+
+            # invalidate, write vectors, then publish keys: a reader never
+            # matches a key whose vector is not fully written
+            slots = [slot for slot, _, _ in writes]
+            keys["key"][slots] = 0
+            keys.flush()
+            vectors[slots] = np.array([embedding for _, _, embedding in writes], dtype=np.float32)
+            vectors.flush()
+            keys["key"][slots] = np.array([key for _, key, _ in writes])
+            keys["used"][slots] = now
+            keys.flush()
+
+    def __len__(self) -> int:
+        keys, _ = self._open()
+        return int(np.count_nonzero(keys["key"].any(axis=1)))
@@ -0,0 +1,89 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Tuple
+
+import openai
+from django.conf import settings
+
+from .s3_utils import s3_client, upload_draft_section
+
+SECTION_INSTRUCTIONS = (
+    "Ты помогаешь абитуриенту написать {letter_type} для программы «{program}». "
+    "Напиши только текст одного раздела письма по подсказке и в указанном тоне, "
+    "опираясь на ответы студента. Без заголовков и пояснений."
+)
+
+
+def generate_section_text(section: Dict[str, str], context: Dict) -> str:
+    """
+    Один вызов модели для одного раздела черновика.
+    """
+    resp = openai.chat.completions.create(
+        model=settings.DRAFT_SECTION_MODEL,
+        messages=[
+            {
+                "role": "system",
+                "content": SECTION_INSTRUCTIONS.format(
+                    letter_type=context["letter_type"],
+                    program=context["program"],
+                ),
+            },
+            {
+                "role": "user",
+                "content": json.dumps({
+                    "section": section["section_key"],
+                    "prompt_hint": section["prompt_hint"],
+                    "tone_style": section["tone_style"],
+                    "answers": context["answers"],
+                }, ensure_ascii=False),
+            },
+        ],
+        max_tokens=settings.DRAFT_SECTION_MAX_TOKENS,
+    )
+    return resp.choices[0].message.content.strip()
+
+
+def _generate_and_upload(section: Dict[str, str], context: Dict, s3) -> str:
+    text = generate_section_text(section, context)
+    upload_draft_section(
+        user_id=context["user_id"],
+        draft_id=context["draft_id"],
+        section_key=section["section_key"],
+        text=text,
+        s3=s3,
+    )
+    return text
+
+
+def iter_generated_sections(
+    sections: List[Dict[str, str]],
+    context: Dict,
+    max_workers: int,
+) -> Iterator[Tuple[Dict[str, str], str, Exception]]:
+    """
+    Генерирует разделы параллельно (не больше max_workers вызовов одновременно)
+    и отдаёт (section, text, error) по мере готовности, а не в порядке разделов.
+    Потоки не трогают БД: на вход — только простые словари. S3-клиент
+    создаётся один до пула и общий для потоков. Если генератор закрыли, не
+    дочитав (клиент отключился), ещё не начатые разделы отменяются.
+    """
+    if not sections:
+        return
+    s3 = s3_client()
+    pool = ThreadPoolExecutor(max_workers=min(max_workers, len(sections)))
+    try:
+        futures = {
+            pool.submit(_generate_and_upload, section, context, s3): section
+            for section in sections
+        }
+        for future in as_completed(futures):
+            section = futures[future]
+            try:
+                yield section, future.result(), None
+            except Exception as e:
+                logging.exception("Failed to generate section %s", section["section_key"])
+                yield section, None, e
+    finally:
+        # уже идущие вызовы не прервать — они доработают в фоне, но ответ их не ждёт
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,180 @@
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+import openai
+from django.conf import settings
+
+from .models import VersionHistorySummary
+from .timing import PhaseTimer
+
+# Служебная «обёртка» каждого сообщения в чате (роль, разделители)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Саммари идёт от ассистента и помечено как служебное: от user модель
+# приняла бы его за новое письмо или слова пользователя
+SUMMARY_ROLE = "assistant"
+SUMMARY_PREFIX = "[Служебное саммари предыдущих проверок этой версии, не новое письмо]\n"
+
+SUMMARY_INSTRUCTIONS = (
+    "Сожми историю проверок мотивационного письма. Сохрани оценки, "
+    "ключевые замечания и рекомендации, которые уже были даны. "
+    "Пиши кратко, без вступлений."
+)
+
+_encoding = None
+
+
+def _get_encoding():
+    """
+    Лениво загружает токенизатор tiktoken.
+    Если он недоступен — возвращает None, и подсчёт идёт по эвристике.
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            logging.warning("tiktoken unavailable, falling back to approximate token count")
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # ~4 символа на токен для латиницы, для кириллицы оценка завышена — это безопасно
+    return (len(text) + 3) // 4
+
+
+def split_tokens(text: str, max_tokens: int) -> List[str]:
+    """
+    Режет текст на куски не длиннее max_tokens токенов
+    (без tiktoken — по символам, с той же оценкой, что count_tokens).
+    """
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text)
+        return [encoding.decode(tokens[i:i + max_tokens])
+                for i in range(0, len(tokens), max_tokens)]
+    step = max_tokens * 4
+    return [text[i:i + step] for i in range(0, len(text), step)]
+
+
+def count_message_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def compact_messages(
+    messages: List[Dict[str, str]],
+    budget: int,
+    keep_recent: int,
+    summary: str = "",
+    summarized_count: int = 0,
+    summarize: Optional[Callable[[str, List[Dict[str, str]]], str]] = None,
+) -> Tuple[List[Dict[str, str]], str, int]:
+    """
+    Укладывает историю в бюджет токенов.
+    Последние keep_recent сообщений остаются как есть, более старые
+    заменяются накопительным саммари. Саммари дополняется только
+    сообщениями, которые ещё не вошли в него (summarized_count).
+    Если дополнить саммари не удалось, из не вошедших в него сообщений
+    остаются самые новые, сколько влезает в бюджет.
+
+    Возвращает (сообщения для thread'а, текст саммари, сколько сообщений в нём учтено).
+    """
+    if count_message_tokens(messages) <= budget or len(messages) <= keep_recent:
+        return messages, summary, summarized_count
+
+    split = len(messages) - keep_recent
+    older, recent = messages[:split], messages[split:]
+
+    # история только растёт; если это не так — пересчитываем саммари с нуля
+    if summarized_count > len(older):
+        summary, summarized_count = "", 0
+
+    pending = older[summarized_count:]
+    if pending and summarize is not None:
+        try:
+            summary = summarize(summary, pending)
+            summarized_count = len(older)
+        except Exception:
+            logging.exception("Failed to summarize history, keeping previous summary and newest messages")
+
+    compacted = list(recent)
+    header = [{"role": SUMMARY_ROLE, "content": SUMMARY_PREFIX + summary}] if summary else []
+    if summarized_count < len(older):
+        room = budget - count_message_tokens(header + compacted)
+        kept = []
+        for m in reversed(older[summarized_count:]):
+            room -= count_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS
+            if room < 0:
+                break
+            kept.append(m)
+        compacted = kept[::-1] + compacted
+    return header + compacted, summary, summarized_count
+
+
+def summarize_messages(previous_summary: str, messages: List[Dict[str, str]],
+                       throttle: Optional[Callable[[], None]] = None) -> str:
+    """
+    Дописывает в саммари новые сообщения одним вызовом модели;
+    throttle вызывается перед запросом.
+    """
+    transcript = "\n\n".join(f"[{m['role']}]\n{m['content']}" for m in messages)
+    if previous_summary:
+        transcript = f"[предыдущее саммари]\n{previous_summary}\n\n{transcript}"
+
+    if throttle is not None:
+        throttle()
+    resp = openai.chat.completions.create(
+        model=settings.HISTORY_SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+            {"role": "user", "content": transcript},
+        ],
+        max_tokens=settings.HISTORY_SUMMARY_MAX_TOKENS,
+    )
+    return resp.choices[0].message.content.strip()
+
+
+def build_history(version, timer: Optional[PhaseTimer] = None,
+                  throttle: Optional[Callable[[], None]] = None) -> List[Dict[str, str]]:
+    """
+    История сообщений версии для нового thread'а, ужатая под
+    HISTORY_TOKEN_BUDGET. Саммари сохраняется в БД и пересчитывается
+    только когда из «окна» выпадают новые сообщения; запрос за ним
+    проходит через throttle.
+    """
+    timer = timer or PhaseTimer()
+    with timer.span("db"):
+        messages = [
+            {"role": msg.role, "content": msg.content}
+            for msg in version.messages.all()
+        ]
+        stored = VersionHistorySummary.objects.filter(version=version).first()
+
+    def summarize(previous_summary, pending):
+        with timer.span("summarize"):
+            return summarize_messages(previous_summary, pending, throttle)
+
+    compacted, summary, summarized_count = compact_messages(
+        messages,
+        budget=settings.HISTORY_TOKEN_BUDGET,
+        keep_recent=settings.HISTORY_KEEP_RECENT_MESSAGES,
+        summary=stored.content if stored else "",
+        summarized_count=stored.messages_covered if stored else 0,
+        summarize=summarize,
+    )
+
+    if summary and (stored is None or stored.messages_covered != summarized_count):
+        with timer.span("db"):
+            VersionHistorySummary.objects.update_or_create(
+                version=version,
+                defaults={
+                    "content": summary,
+                    "messages_covered": summarized_count,
+                    "token_count": count_tokens(summary),
+                }
+            )
+    return compacted
@@ -0,0 +1,232 @@
+import csv
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from . import vector_utils
+from .history import count_tokens, split_tokens
+from .ratelimit import RateBudget
+from .vector_keys import METADATA_FIELDS
+
+# Лимит API: не больше 8191 токена на один вход и ~300k на запрос
+MAX_BATCH_TOKENS = 200_000
+# Сколько id#номер за раз проверять на лишние куски после перенарезки документа
+STALE_CHUNK_PROBE = 16
+
+_PARAGRAPHS = re.compile(r"\n\s*\n")
+
+
+def read_documents(path: str, id_field: str = "id", text_field: str = "text",
+                   skip: int = 0) -> Iterator[Tuple[int, str, str, Dict[str, str]]]:
+    """
+    Построчно читает JSONL или CSV (по расширению), не загружая файл целиком.
+    Возвращает (номер записи, id, текст, метаданные из полей METADATA_FIELDS);
+    первые skip записей пропускаются.
+    Записи без текста пропускаются, без id — получают id по номеру.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            csv.field_size_limit(sys.maxsize)
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) if line.strip() else {} for line in f)
+        for n, row in enumerate(rows):
+            if n < skip:
+                continue
+            text = (row.get(text_field) or "").strip()
+            if text:
+                metadata = {f: str(row[f]) for f in METADATA_FIELDS if row.get(f)}
+                yield n, str(row.get(id_field) or n), text, metadata
+
+
+def chunk_text(text: str, max_tokens: int) -> List[str]:
+    """
+    Делит текст на куски не длиннее max_tokens: сначала по абзацам,
+    слишком длинный абзац — по токенам (или по символам без tiktoken).
+    """
+    if count_tokens(text) <= max_tokens:
+        return [text]
+
+    pieces = []
+    for paragraph in _PARAGRAPHS.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if count_tokens(paragraph) <= max_tokens:
+            pieces.append(paragraph)
+            continue
+        pieces.extend(split_tokens(paragraph, max_tokens))
+
+    # склеиваем соседние абзацы, пока помещаются
+    chunks, current, current_tokens = [], [], 0
+    for piece in pieces:
+        tokens = count_tokens(piece)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+@dataclass
+class Batch:
+    seq: int
+    ids: List[str] = field(default_factory=list)
+    texts: List[str] = field(default_factory=list)
+    metadata: List[Dict[str, str]] = field(default_factory=list)
+    tokens: int = 0
+    # все записи с номером < records_done целиком вошли в этот или предыдущие батчи
+    records_done: int = 0
+    documents: int = 0
+    # (id, число кусков) документов, последний кусок которых в этом батче
+    chunk_counts: List[Tuple[str, int]] = field(default_factory=list)
+
+
+def iter_batches(documents: Iterator[Tuple[int, str, str, Dict[str, str]]], chunk_tokens: int,
+                 batch_size: int, start: int = 0) -> Iterator[Batch]:
+    batch = Batch(seq=0, records_done=start)
+    for n, doc_id, text, metadata in documents:
+        chunks = chunk_text(text, chunk_tokens)
+        for i, chunk in enumerate(chunks):
+            tokens = count_tokens(chunk)
+            if batch.ids and (len(batch.ids) >= batch_size
+                              or batch.tokens + tokens > MAX_BATCH_TOKENS):
+                yield batch
+                batch = Batch(seq=batch.seq + 1, records_done=batch.records_done)
+            # один кусок — id документа, несколько — id#номер
+            batch.ids.append(doc_id if len(chunks) == 1 else f"{doc_id}#{i}")
+            batch.texts.append(chunk)
+            batch.metadata.append(metadata)
+            batch.tokens += tokens
+        batch.records_done = n + 1
+        batch.documents += 1
+        batch.chunk_counts.append((doc_id, len(chunks)))
+    if batch.ids:
+        yield batch
+
+
+def load_checkpoint(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return json.load(f)["records"]
+
+
+def save_checkpoint(path: str, records: int) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"records": records, "updated_at": time.time()}, f)
+    os.replace(tmp_path, path)
+
+
+def delete_stale_chunks(store: vector_utils.PartitionedVectorStore,
+                        chunk_counts: List[Tuple[str, int]]) -> int:
+    """
+    Удаляет куски, оставшиеся от прежней нарезки документов: id без номера,
+    если кусков теперь несколько, и id#k для k от нового числа кусков.
+    Прежние куски нумеровались подряд, поэтому проверяем окнами по
+    STALE_CHUNK_PROBE, пока окно что-то удаляет. Возвращает число удалённых.
+    """
+    stale = [doc_id for doc_id, n in chunk_counts if n > 1]
+    # у документа из одного куска id#0 и дальше — все лишние
+    firsts = [(doc_id, n if n > 1 else 0) for doc_id, n in chunk_counts]
+    removed, offset = 0, 0
+    while True:
+        stale += [f"{doc_id}#{k}" for doc_id, first in firsts
+                  for k in range(first + offset, first + offset + STALE_CHUNK_PROBE)]
+        deleted = store.delete(stale) if stale else 0
+        removed += deleted
+        if not deleted:
+            return removed
+        stale, offset = [], offset + STALE_CHUNK_PROBE
+
+
+def _process_batch(batch: Batch, store: vector_utils.PartitionedVectorStore,
+                   budget: RateBudget) -> Tuple[int, int, int]:
+    """(записано, не изменилось, удалено лишних кусков)."""
+    positions = store.changed(batch.ids, batch.texts, batch.metadata)
+    written = 0
+    if positions:
+        ids = [batch.ids[i] for i in positions]
+        texts = [batch.texts[i] for i in positions]
+        metadata = [batch.metadata[i] for i in positions]
+        vectors = vector_utils.embed_texts(texts, throttle=budget.acquire)
+        written = store.upsert(ids, vectors, texts, metadata)
+    # и когда сами куски не изменились: документ мог стать короче на целый кусок
+    removed = delete_stale_chunks(store, batch.chunk_counts)
+    return written, len(batch.ids) - written, removed
+
+
+def ingest(path: str, checkpoint_path: str, budget: RateBudget,
+           store: Optional[vector_utils.PartitionedVectorStore] = None,
+           id_field: str = "id", text_field: str = "text",
+           chunk_tokens: int = 512, batch_size: int = 256, concurrency: int = 4,
+           report: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """
+    Загружает корпус в векторное хранилище.
+
+    Батчи эмбеддятся параллельно (в пределах budget), в индекс пишутся по мере
+    готовности. В чекпоинт пишется число записей, полностью обработанных без
+    пропусков: после падения часть записей пройдёт повторно, но неизменённые
+    куски не пересчитываются (content hash + кэш эмбеддингов).
+    """
+    store = store or vector_utils.backend()
+    start = load_checkpoint(checkpoint_path)
+    batches = iter_batches(
+        read_documents(path, id_field, text_field, skip=start),
+        chunk_tokens, batch_size, start
+    )
+
+    stats = {"documents": 0, "chunks": 0, "written": 0, "unchanged": 0, "stale_removed": 0,
+             "records": start, "started_from": start}
+    started = time.monotonic()
+    completed: Dict[int, Batch] = {}
+    next_seq = 0
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        in_flight = {}
+        exhausted = False
+        while in_flight or not exhausted:
+            # не больше 2×concurrency батчей в памяти
+            while not exhausted and len(in_flight) < concurrency * 2:
+                batch = next(batches, None)
+                if batch is None:
+                    exhausted = True
+                    break
+                in_flight[pool.submit(_process_batch, batch, store, budget)] = batch
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = in_flight.pop(future)
+                written, unchanged, removed = future.result()
+                stats["written"] += written
+                stats["unchanged"] += unchanged
+                stats["stale_removed"] += removed
+                stats["chunks"] += len(batch.ids)
+                stats["documents"] += batch.documents
+                completed[batch.seq] = batch
+
+            # чекпоинт двигается только по непрерывному префиксу батчей
+            advanced = False
+            while next_seq in completed:
+                stats["records"] = completed.pop(next_seq).records_done
+                next_seq += 1
+                advanced = True
+            if advanced:
+                save_checkpoint(checkpoint_path, stats["records"])
+                if report is not None:
+                    elapsed = time.monotonic() - started
+                    report(dict(stats, docs_per_sec=round(stats["documents"] / elapsed, 1)))
+
+    elapsed = time.monotonic() - started
+    stats["seconds"] = round(elapsed, 1)
+    stats["docs_per_sec"] = round(stats["documents"] / elapsed, 1) if elapsed else 0
+    return stats
@@ -0,0 +1,61 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from letters.analysis import build_analysis_result
+from letters.models import AnalysisResult, AnalysisCriterionScore, VersionMessage
+
+
+def _reject_constant(name):
+    # NaN/Infinity json.loads пропускает, но это не JSON и не оценка
+    raise ValueError(f"{name} is not valid JSON")
+
+
+class Command(BaseCommand):
+    help = "Создаёт AnalysisResult для старых assistant-сообщений с JSON-ответом"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        dry_run = options["dry_run"]
+
+        qs = (
+            VersionMessage.objects
+            .filter(role="assistant", analysis_result__isnull=True)
+            .select_related("version")
+            .order_by("created_at")
+        )
+
+        created = skipped = 0
+        batch = []
+        for message in qs.iterator(chunk_size=batch_size):
+            try:
+                payload = json.loads(message.content, parse_constant=_reject_constant)
+            except ValueError:
+                skipped += 1
+                continue
+            batch.append(build_analysis_result(message, payload))
+            if len(batch) >= batch_size:
+                created += self._flush(batch, dry_run)
+                batch = []
+        created += self._flush(batch, dry_run)
+
+        prefix = "[dry-run] " if dry_run else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Создано результатов: {created}, пропущено (не JSON): {skipped}"
+        ))
+
+    def _flush(self, batch, dry_run):
+        if not batch or dry_run:
+            return len(batch)
+        with transaction.atomic():
+            # UUID генерируется на клиенте, поэтому связи можно создать сразу
+            AnalysisResult.objects.bulk_create([result for result, _ in batch])
+            AnalysisCriterionScore.objects.bulk_create(
+                [score for _, scores in batch for score in scores]
+            )
+        return len(batch)
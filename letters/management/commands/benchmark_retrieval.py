@@ -0,0 +1,69 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from letters import vector_utils
+from letters.retrieval_benchmark import (
+    MODES, HashingEmbedder, generate_dataset, load_dataset, run_benchmark,
+)
+
+
+def _list(value: str):
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+class Command(BaseCommand):
+    help = (
+        "Замер качества и скорости поиска без сети: эмбеддинги считает "
+        "детерминированный хэширующий эмбеддер. Для каждого типа индекса, режима "
+        "и k пишет recall@k, MRR, QPS, p50/p99 задержки и память в JSON, который "
+        "можно сравнивать между коммитами."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dataset", help="JSON с documents и queries; по умолчанию синтетический")
+        parser.add_argument("--documents", type=int, default=10_000)
+        parser.add_argument("--queries", type=int, default=500)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--save-dataset", help="Сохранить сгенерированный набор в файл")
+        parser.add_argument("--types", type=_list, default=["flat", "hnsw", "sq8"],
+                            help=f"Через запятую из {', '.join(vector_utils.INDEX_TYPES)}")
+        parser.add_argument("--k", type=lambda v: [int(k) for k in _list(v)], default=[1, 5, 10])
+        parser.add_argument("--modes", type=_list, default=["vector", "hybrid"],
+                            help=f"Через запятую из {', '.join(MODES)}")
+        parser.add_argument("--dim", type=int, default=256)
+        parser.add_argument("--rerank-factor", type=int, default=0)
+        parser.add_argument("--output", default="retrieval_benchmark.json")
+
+    def handle(self, *args, **options):
+        for index_type in options["types"]:
+            if index_type not in vector_utils.INDEX_TYPES:
+                raise CommandError(f"Неизвестный тип индекса {index_type}")
+        for mode in options["modes"]:
+            if mode not in MODES:
+                raise CommandError(f"Неизвестный режим {mode}")
+
+        if options["dataset"]:
+            dataset = load_dataset(options["dataset"])
+        else:
+            dataset = generate_dataset(options["documents"], options["queries"], options["seed"])
+            if options["save_dataset"]:
+                with open(options["save_dataset"], "w", encoding="utf-8") as f:
+                    json.dump(dataset, f, ensure_ascii=False)
+
+        def report(row):
+            self.stdout.write(
+                f"{row['index_type']:8} {row['mode']:14} k={row['k']:<3} "
+                f"recall={row['recall']:.3f} mrr={row['mrr']:.3f} qps={row['qps']:.0f} "
+                f"p99={row['p99_ms']:.1f}ms index={row['index_bytes'] / 2 ** 20:.1f}MiB"
+            )
+
+        result = run_benchmark(
+            dataset, options["types"], options["k"], options["modes"],
+            embedder=HashingEmbedder(options["dim"]),
+            rerank_factor=options["rerank_factor"],
+            report=report,
+        )
+        with open(options["output"], "w") as f:
+            json.dump(result, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Результаты → {options['output']}"))
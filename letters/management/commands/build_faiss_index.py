@@ -0,0 +1,88 @@
+import time
+
+import faiss
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from letters import vector_utils
+
+
+class Command(BaseCommand):
+    help = (
+        "Перестраивает FAISS-индекс в другой тип (hnsw, ivf_*, sq8, fp16, pq) "
+        "из полных векторов на диске (<docstore>.f32) или, если их нет, из текущего "
+        "плоского индекса — тогда .f32 заодно заполняется. Порядок id сохраняется, "
+        "поэтому документы в FAISS_DOCSTORE_PATH остаются валидными. Новый индекс "
+        "публикуется следующей версией снимка: воркеры подхватят его сами. "
+        "Она же переводит индекс на метрику FAISS_METRIC, если та задана, а индекс записан с другой."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--type", choices=vector_utils.INDEX_TYPES,
+                            default=vector_utils.INDEX_TYPE)
+        parser.add_argument("--train-size", type=int, default=100_000,
+                            help="Сколько векторов брать для обучения IVF")
+        parser.add_argument("--batch-size", type=int, default=50_000)
+        parser.add_argument("--partition", default="",
+                            help="Тип письма; по умолчанию — общий индекс")
+        parser.add_argument("--output", help="По умолчанию — файл индекса раздела")
+
+    def handle(self, *args, **options):
+        # сначала переносим журнал в снимок, иначе часть векторов потеряется
+        store = vector_utils.partitioned_store.partition(options["partition"])
+        # индекс другой метрики (FAISS_METRIC) открывается только для перестройки
+        store.converting = True
+        store.snapshot()
+        source = store.index
+        total = source.ntotal
+        batch_size = options["batch_size"]
+
+        if store.raw is not None and len(store.raw) >= total:
+            def read(ids):
+                return store.raw.get(np.asarray(ids))
+            backfill = False
+        elif isinstance(source, faiss.IndexFlat):
+            def read(ids):
+                return source.reconstruct_batch(np.asarray(ids, dtype="int64"))
+            backfill = store.raw is not None and len(store.raw) == 0
+        else:
+            raise CommandError(
+                "Нет полных векторов (.f32), а текущий индекс не плоский: "
+                "исходные векторы не восстановить"
+            )
+        if store.metric == "cosine":
+            # индекс, собранный с FAISS_METRIC=l2, переводится на косинус здесь
+            read_vectors = read
+
+            def read(ids):
+                return vector_utils.normalized(read_vectors(ids))
+
+        started = time.monotonic()
+        target = vector_utils.build_index(options["type"], source.d)
+
+        if not target.is_trained:
+            rng = np.random.default_rng(0)
+            sample_ids = np.sort(rng.choice(total, min(total, options["train_size"]), replace=False))
+            sample = read(sample_ids)
+            vector_utils.train_index(target, sample)
+            self.stdout.write(f"Обучено на {len(sample)} векторах")
+
+        for start in range(0, total, batch_size):
+            n = min(batch_size, total - start)
+            vectors = read(range(start, start + n))
+            target.add(vectors)
+            if backfill:
+                store.raw.append(vectors, start)
+            self.stdout.write(f"  {start + n}/{total}")
+
+        # новая версия снимка: читатели доищут по старой и переключатся сами
+        if options["output"]:
+            output = options["output"]
+            vector_utils.write_index_atomic(target, output)
+        else:
+            store.install(target)
+            output = f"{store.index_path} (версия {store.version})"
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{options['type']}: {total} векторов за {time.monotonic() - started:.1f}s → {output}"
+        ))
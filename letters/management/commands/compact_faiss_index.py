@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from letters import vector_utils
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаляет из FAISS-индекса и таблиц документов слоты заменённых и удалённых "
+        "документов (tombstones): живые документы переписываются в новое поколение "
+        "таблиц, а их векторы — в новый индекс того же типа, который публикуется "
+        "следующей версией снимка: воркеры подхватят его сами. Сама по себе "
+        "компактизация запускается при записи, когда мёртвых слотов больше "
+        "FAISS_COMPACT_RATIO. С шардами запускайте с FAISS_INDEX_PATH и "
+        "FAISS_DOCSTORE_PATH каждого шарда."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--partition", default=None,
+                            help="Тип письма ('' — общий индекс); по умолчанию — все разделы")
+        parser.add_argument("--batch-size", type=int, default=50_000)
+
+    def handle(self, *args, **options):
+        if options["partition"] is None:
+            stores = vector_utils.partitioned_store.partitions()
+        else:
+            stores = [vector_utils.partitioned_store.partition(options["partition"])]
+        for store in stores:
+            started = time.monotonic()
+            dropped = store.compact(options["batch_size"])
+            self.stdout.write(self.style.SUCCESS(
+                f"{store.index_path}: удалено слотов {dropped}, осталось {store.ntotal} "
+                f"за {time.monotonic() - started:.1f} с"
+            ))
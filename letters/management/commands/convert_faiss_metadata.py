@@ -0,0 +1,52 @@
+import os
+import pickle
+
+from django.core.management.base import BaseCommand, CommandError
+
+from letters import vector_utils
+from letters.docstore import DocStore
+from letters.vector_keys import KeyTable, hash64
+
+
+class Command(BaseCommand):
+    help = (
+        "Однократно переносит тексты из старого faiss_metadata.pkl в "
+        "документное хранилище (FAISS_DOCSTORE_PATH). id документа — его номер "
+        "в старом списке. pickle исполняет код "
+        "при загрузке — запускайте только на собственном файле."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--input", default=vector_utils.META_PATH)
+        parser.add_argument("--output", default=vector_utils.DOCSTORE_PATH)
+        parser.add_argument("--batch-size", type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options["input"]):
+            raise CommandError(f"Файл {options['input']} не найден")
+
+        docs = DocStore(options["output"])
+        keys = KeyTable(options["output"])
+        if len(docs):
+            raise CommandError(
+                f"Хранилище {options['output']} уже содержит {len(docs)} документов"
+            )
+
+        with open(options["input"], "rb") as f:
+            id_to_text = pickle.load(f)
+
+        batch_size = options["batch_size"]
+        for start in range(0, len(id_to_text), batch_size):
+            batch = list(enumerate(id_to_text[start:start + batch_size], start))
+            docs.append([{"id": str(i), "text": t} for i, t in batch])
+            keys.append([hash64(str(i)) for i, _ in batch], [hash64(t) for _, t in batch])
+
+        ntotal = vector_utils.store.ntotal
+        if ntotal != len(id_to_text):
+            self.stdout.write(self.style.WARNING(
+                f"В индексе {ntotal} векторов, а текстов {len(id_to_text)}"
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f"Перенесено {len(id_to_text)} документов → {options['output']}. "
+            f"{options['input']} можно удалить."
+        ))
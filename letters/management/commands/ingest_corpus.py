@@ -0,0 +1,66 @@
+import os
+import resource
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from letters.ingest import ingest
+from letters.ratelimit import RateBudget
+
+
+class Command(BaseCommand):
+    help = (
+        "Загружает корпус из JSONL или CSV в векторный индекс: режет тексты "
+        "на куски по токенам, эмбеддит батчи параллельно и пишет в индекс по мере "
+        "готовности, по разделам letter_type. Поля country, university_id, language "
+        "сохраняются для фильтров. Прогресс хранится в чекпоинте: повторный "
+        "запуск продолжит с места падения."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--id-field", default="id")
+        parser.add_argument("--text-field", default="text")
+        parser.add_argument("--chunk-tokens", type=int, default=512)
+        parser.add_argument("--batch-size", type=int, default=256,
+                            help="Кусков в одном запросе к embeddings API")
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument("--requests-per-minute", type=int,
+                            default=settings.OPENAI_REQUESTS_PER_MINUTE)
+        parser.add_argument("--checkpoint", help="По умолчанию <path>.checkpoint")
+        parser.add_argument("--restart", action="store_true",
+                            help="Игнорировать чекпоинт и начать с начала")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not os.path.exists(path):
+            raise CommandError(f"Файл {path} не найден")
+        checkpoint = options["checkpoint"] or f"{path}.checkpoint"
+        if options["restart"] and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        def report(stats):
+            self.stdout.write(
+                f"records={stats['records']} documents={stats['documents']} "
+                f"chunks={stats['chunks']} written={stats['written']} "
+                f"unchanged={stats['unchanged']} stale_removed={stats['stale_removed']} "
+                f"{stats['docs_per_sec']} docs/s"
+            )
+
+        stats = ingest(
+            path,
+            checkpoint,
+            budget=RateBudget("openai_embeddings", options["requests_per_minute"]),
+            id_field=options["id_field"],
+            text_field=options["text_field"],
+            chunk_tokens=options["chunk_tokens"],
+            batch_size=options["batch_size"],
+            concurrency=options["concurrency"],
+            report=report,
+        )
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово: {stats['documents']} документов ({stats['chunks']} кусков, "
+            f"записано {stats['written']}) за {stats['seconds']}s, "
+            f"{stats['docs_per_sec']} docs/s, пик памяти {peak_mb:.0f} MB"
+        ))
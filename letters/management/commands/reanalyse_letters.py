@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from letters.models import LETTER_TYPES, ReanalysisJob
+from letters.reanalysis import JobAlreadyRunning, create_job, job_progress, pending_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = (
+        "Переоценивает последнюю версию каждого письма текущим ассистентом. "
+        "Прогресс сохраняется в БД: после падения запустите с --resume <job_id>. "
+        "С --pending выполняет задачи, созданные в админке (для cron или воркера)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--type", choices=[t for t, _ in LETTER_TYPES], default="")
+        parser.add_argument("--concurrency", type=int, default=None)
+        parser.add_argument("--resume", type=int, metavar="JOB_ID")
+        parser.add_argument("--retry-failed", action="store_true")
+        parser.add_argument("--pending", action="store_true",
+                            help="Выполнить ожидающие задачи, в том числе брошенные упавшим процессом")
+        parser.add_argument("--status", type=int, metavar="JOB_ID",
+                            help="Только показать прогресс задачи")
+
+    def handle(self, *args, **options):
+        if options["status"]:
+            job = self._get_job(options["status"])
+            self.stdout.write(f"{job}: {job_progress(job)}")
+            return
+
+        if options["pending"]:
+            for job in pending_jobs():
+                try:
+                    self._run(job, options)
+                except CommandError as e:
+                    # задачу успел взять другой воркер — берём следующую
+                    self.stderr.write(str(e))
+            return
+
+        if options["resume"]:
+            job = self._get_job(options["resume"])
+            if job.status == "completed" and not options["retry_failed"]:
+                raise CommandError(f"Задача #{job.pk} уже завершена")
+        else:
+            job = create_job(letter_type=options["type"])
+            self.stdout.write(f"Создана задача #{job.pk}: {job.total} версий")
+        self._run(job, options)
+
+    def _run(self, job, options):
+        def report(progress):
+            done = progress["done"] + progress["failed"]
+            self.stdout.write(
+                f"[{done}/{progress['total']}] done={progress['done']} "
+                f"failed={progress['failed']} pending={progress['pending']} "
+                f"{progress['rate_per_min']}/min"
+            )
+
+        try:
+            result = run_job(
+                job,
+                concurrency=options["concurrency"],
+                retry_failed=options["retry_failed"],
+                report=report,
+            )
+        except JobAlreadyRunning:
+            raise CommandError(
+                f"Задача #{job.pk} уже выполняется другим процессом; "
+                f"если он упал, повторите через REANALYSIS_STALE_SECONDS"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Задача #{job.pk} завершена: {result}"))
+
+    def _get_job(self, job_id):
+        try:
+            return ReanalysisJob.objects.get(pk=job_id)
+        except ReanalysisJob.DoesNotExist:
+            raise CommandError(f"Задача #{job_id} не найдена")
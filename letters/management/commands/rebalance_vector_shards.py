@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from letters import vector_utils
+
+
+class Command(BaseCommand):
+    help = (
+        "Переносит документы на шарды, которым они принадлежат после изменения "
+        "FAISS_SHARD_SOCKETS (добавили или убрали шард), вместе с векторами — "
+        "без повторных запросов к embeddings API. Можно прервать и запустить "
+        "снова. Запись в индекс на это время лучше остановить."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        store = vector_utils.sharded_store
+        if store is None:
+            raise CommandError("Задайте FAISS_SHARD_SOCKETS")
+
+        def report(stats):
+            self.stdout.write(f"{stats['shard']}: scanned={stats['scanned']} moved={stats['moved']}")
+
+        started = time.monotonic()
+        stats = store.rebalance(options["batch_size"], report=report)
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово: просмотрено {stats['scanned']}, перенесено {stats['moved']} "
+            f"за {time.monotonic() - started:.1f} с"
+        ))
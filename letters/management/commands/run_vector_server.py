@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from letters import vector_utils
+from letters.vector_server import VectorServer
+from universities import program_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Запускает сервер векторного поиска на Unix-сокете: один индекс на хост "
+        "вместо копии в каждом воркере. Он же собирает эмбеддинги запросов всех "
+        "воркеров в общие батчи и держит индекс программ для /programs/semantic/. "
+        "Воркеры используют его, если задан FAISS_SERVER_SOCKET."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--socket", default=vector_utils.SERVER_SOCKET)
+        parser.add_argument("--shard", action="store_true",
+                            help="Шард документов (run_vector_shards): без индекса программ")
+
+    def handle(self, *args, **options):
+        if not options["socket"]:
+            raise CommandError("Укажите --socket или FAISS_SERVER_SOCKET")
+
+        store = vector_utils.partitioned_store
+        # индекс грузится сразу и в режиме записи: сервер — единственный писатель
+        for partition in store.partitions():
+            partition.load(writable=True)
+        stores = {}
+        if not options["shard"]:
+            programs = program_index.writable_store()
+            programs.load(writable=True)
+            stores[program_index.STORE_NAME] = programs
+
+        # эмбеддинги запросов всех воркеров собираются в общие батчи
+        server = VectorServer(options["socket"], store,
+                              embed=vector_utils.embedding_batcher.embed_many, stores=stores)
+        self.stdout.write(self.style.SUCCESS(f"Слушаю {options['socket']}"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,79 @@
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from letters.vector_server import VectorClient
+
+
+class Command(BaseCommand):
+    help = (
+        "Запускает N шардов векторного индекса локальными процессами "
+        "run_vector_server --shard, у каждого свой каталог данных и сокет, и "
+        "печатает FAISS_SHARD_SOCKETS для воркеров. Так шардирование проверяется "
+        "на одной машине; на нескольких хостах шарды запускаются по одному. "
+        "После добавления шардов — manage.py rebalance_vector_shards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shards", type=int, default=2)
+        parser.add_argument("--data-dir", default="./faiss_shards")
+        parser.add_argument("--socket-dir", help="По умолчанию — --data-dir")
+
+    def handle(self, *args, **options):
+        data_dir = os.path.abspath(options["data_dir"])
+        socket_dir = os.path.abspath(options["socket_dir"] or data_dir)
+        os.makedirs(socket_dir, exist_ok=True)
+
+        processes, sockets = [], []
+        for i in range(options["shards"]):
+            shard_dir = os.path.join(data_dir, f"shard{i}")
+            os.makedirs(shard_dir, exist_ok=True)
+            sockets.append(os.path.join(socket_dir, f"shard{i}.sock"))
+            env = dict(
+                os.environ,
+                FAISS_INDEX_PATH=os.path.join(shard_dir, "index.bin"),
+                FAISS_DOCSTORE_PATH=os.path.join(shard_dir, "docs"),
+                FAISS_PARTITIONS_DIR=os.path.join(shard_dir, "partitions"),
+                FAISS_SERVER_SOCKET="",
+                FAISS_SHARD_SOCKETS="",
+            )
+            processes.append(subprocess.Popen(
+                [sys.executable, os.path.join(settings.BASE_DIR, "manage.py"),
+                 "run_vector_server", "--shard", "--socket", sockets[-1]],
+                env=env,
+            ))
+
+        try:
+            self._wait_ready(processes, sockets)
+            self.stdout.write(self.style.SUCCESS(f"FAISS_SHARD_SOCKETS={','.join(sockets)}"))
+            while all(p.poll() is None for p in processes):
+                time.sleep(1)
+            raise CommandError("Один из шардов завершился, останавливаю остальные")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for p in processes:
+                if p.poll() is None:
+                    p.terminate()
+            for p in processes:
+                p.wait()
+
+    @staticmethod
+    def _wait_ready(processes, sockets, timeout: float = 300):
+        # шард готов, когда отвечает на ping: индекс уже загружен
+        deadline = time.monotonic() + timeout
+        for process, path in zip(processes, sockets):
+            while True:
+                if process.poll() is not None:
+                    raise CommandError(f"Шард {path} не запустился")
+                try:
+                    VectorClient(path, timeout=5).ping()
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise CommandError(f"Шард {path} не ответил за {timeout:.0f} с")
+                    time.sleep(0.2)
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.1 on 2026-10-19 10:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("letters", "0004_letter_essay_prompt_letter_status_letter_university_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VersionHistorySummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("content", models.TextField()),
+                (
+                    "messages_covered",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="Сколько первых сообщений версии учтено в саммари",
+                    ),
+                ),
+                ("token_count", models.PositiveIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "version",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="history_summary",
+                        to="letters.letterversion",
+                    ),
+                ),
+            ],
+        ),
+    ]
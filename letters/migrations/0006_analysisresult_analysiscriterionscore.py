@@ -0,0 +1,104 @@
+# Generated by Django 5.2.1 on 2026-10-19 11:40
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("letters", "0005_versionhistorysummary"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AnalysisResult",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("payload", models.JSONField()),
+                (
+                    "overall_score",
+                    models.FloatField(blank=True, db_index=True, null=True),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "letter",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="analysis_results",
+                        to="letters.letter",
+                    ),
+                ),
+                (
+                    "message",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="analysis_result",
+                        to="letters.versionmessage",
+                    ),
+                ),
+                (
+                    "version",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="analysis_results",
+                        to="letters.letterversion",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-created_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["letter", "-created_at"],
+                        name="analysis_letter_created_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="AnalysisCriterionScore",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("criterion", models.CharField(max_length=100)),
+                ("score", models.FloatField()),
+                (
+                    "result",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="criterion_scores",
+                        to="letters.analysisresult",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["criterion", "score"], name="criterion_score_idx"
+                    )
+                ],
+                "unique_together": {("result", "criterion")},
+            },
+        ),
+    ]
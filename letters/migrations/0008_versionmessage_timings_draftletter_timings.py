@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-19 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("letters", "0007_reanalysisjob_reanalysisitem"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="draftletter",
+            name="timings",
+            field=models.JSONField(
+                blank=True,
+                help_text="Длительность фаз generate_structure, мс",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="versionmessage",
+            name="timings",
+            field=models.JSONField(
+                blank=True, help_text="Длительность фаз запроса, мс", null=True
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.1 on 2026-10-19 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("letters", "0008_versionmessage_timings_draftletter_timings"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="letterversion",
+            name="embedding",
+            field=models.BinaryField(
+                blank=True,
+                help_text="float32-вектор текста версии, считается в фоне после сохранения",
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.1 on 2026-10-19 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("letters", "0009_letterversion_embedding"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="reanalysisjob",
+            name="heartbeat_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="Последний сигнал от выполняющего процесса: без него дольше REANALYSIS_STALE_SECONDS задача считается брошенной",
+                null=True,
+            ),
+        ),
+    ]
@@ -1,6 +1,7 @@
 import uuid
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 LETTER_TYPES = [
     ('motivation', 'Motivation Letter'),
@@ -63,6 +64,11 @@ class LetterVersion(models.Model):
     s3_key = models.CharField(max_length=1024)
     created_at = models.DateTimeField(auto_now_add=True)
     checked_at = models.DateTimeField(null=True, blank=True)
+    embedding = models.BinaryField(
+        null=True,
+        blank=True,
+        help_text='float32-вектор текста версии, считается в фоне после сохранения'
+    )
 
     class Meta:
         unique_together = ('letter', 'version_num')
@@ -87,11 +93,162 @@ class VersionMessage(models.Model):
         choices=[('system','system'), ('user','user'), ('assistant','assistant')]
     )
     content = models.TextField()
+    timings = models.JSONField(
+        null=True,
+        blank=True,
+        help_text='Длительность фаз запроса, мс'
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['created_at']
 
+
+class VersionHistorySummary(models.Model):
+    """
+    Накопительное саммари старых сообщений версии,
+    которым analyse заменяет их при превышении бюджета токенов.
+    """
+    version = models.OneToOneField(
+        LetterVersion,
+        on_delete=models.CASCADE,
+        related_name='history_summary'
+    )
+    content = models.TextField()
+    messages_covered = models.PositiveIntegerField(
+        default=0,
+        help_text='Сколько первых сообщений версии учтено в саммари'
+    )
+    token_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Summary of {self.version} ({self.messages_covered} msgs)"
+
+class AnalysisResultQuerySet(models.QuerySet):
+    def latest_per_letter(self):
+        # DISTINCT ON (letter_id) по индексу (letter, -created_at)
+        return self.order_by('letter_id', '-created_at').distinct('letter_id')
+
+
+class AnalysisResult(models.Model):
+    """
+    Распарсенный JSON-ответ ассистента с вынесенными в колонки оценками.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    letter = models.ForeignKey(
+        Letter,
+        on_delete=models.CASCADE,
+        related_name='analysis_results'
+    )
+    version = models.ForeignKey(
+        LetterVersion,
+        on_delete=models.CASCADE,
+        related_name='analysis_results'
+    )
+    message = models.OneToOneField(
+        VersionMessage,
+        on_delete=models.CASCADE,
+        related_name='analysis_result'
+    )
+    payload = models.JSONField()
+    overall_score = models.FloatField(null=True, blank=True, db_index=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = AnalysisResultQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['letter', '-created_at'], name='analysis_letter_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.version} – {self.overall_score}"
+
+
+class AnalysisCriterionScore(models.Model):
+    result = models.ForeignKey(
+        AnalysisResult,
+        on_delete=models.CASCADE,
+        related_name='criterion_scores'
+    )
+    criterion = models.CharField(max_length=100)
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ('result', 'criterion')
+        indexes = [
+            models.Index(fields=['criterion', 'score'], name='criterion_score_idx'),
+        ]
+
+
+class ReanalysisJob(models.Model):
+    """
+    Пакетная переоценка последних версий писем (например, после смены ассистента).
+    Прогресс хранится по строкам ReanalysisItem, поэтому задачу можно продолжить после падения.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Ожидает'),
+        ('running', 'Выполняется'),
+        ('completed', 'Завершена'),
+        ('failed', 'Прервана'),
+    ]
+
+    letter_type = models.CharField(
+        max_length=20,
+        choices=LETTER_TYPES,
+        blank=True,
+        help_text='Пусто — все типы писем'
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    total = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(
+        null=True, blank=True,
+        help_text='Последний сигнал от выполняющего процесса: без него дольше '
+                  'REANALYSIS_STALE_SECONDS задача считается брошенной'
+    )
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Reanalysis #{self.pk} ({self.letter_type or 'all'}) – {self.status}"
+
+
+class ReanalysisItem(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'pending'),
+        ('running', 'running'),
+        ('done', 'done'),
+        ('failed', 'failed'),
+    ]
+
+    job = models.ForeignKey(
+        ReanalysisJob,
+        on_delete=models.CASCADE,
+        related_name='items'
+    )
+    version = models.ForeignKey(
+        LetterVersion,
+        on_delete=models.CASCADE,
+        related_name='reanalysis_items'
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('job', 'version')
+        indexes = [
+            models.Index(fields=['job', 'status'], name='reanalysis_job_status_idx'),
+        ]
+
+
 class DraftLetter(models.Model):
     id          = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user        = models.ForeignKey(settings.AUTH_USER_MODEL,
@@ -101,6 +258,8 @@ class DraftLetter(models.Model):
     type        = models.CharField(max_length=20, choices=LETTER_TYPES)
     program     = models.CharField(max_length=255)
     status      = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft')
+    timings     = models.JSONField(null=True, blank=True,
+                                   help_text='Длительность фаз generate_structure, мс')
     created_at  = models.DateTimeField(auto_now_add=True)
     updated_at  = models.DateTimeField(auto_now=True)
 
@@ -0,0 +1,52 @@
+import random
+import time
+from typing import Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class RateBudget:
+    """
+    Бюджет запросов в минуту, общий для всех процессов через Django cache
+    (с Redis — на весь кластер, с LocMem — на процесс).
+    consume() только учитывает запрос, acquire() ждёт, пока в окне есть место.
+    """
+
+    def __init__(self, key: str, per_minute: int):
+        self.key = key
+        self.per_minute = per_minute
+
+    def _window_key(self) -> str:
+        return f"ratebudget:{self.key}:{int(time.time() // 60)}"
+
+    def _consume(self, cost: int) -> Tuple[str, int]:
+        """(ключ окна, в которое записан запрос; сколько в нём израсходовано)."""
+        key = self._window_key()
+        cache.add(key, 0, timeout=120)
+        try:
+            return key, cache.incr(key, cost)
+        except ValueError:
+            # ключ успел протухнуть между add и incr
+            cache.set(key, cost, timeout=120)
+            return key, cost
+
+    def consume(self, cost: int = 1) -> int:
+        return self._consume(cost)[1]
+
+    def acquire(self, cost: int = 1) -> None:
+        while True:
+            # откатываем запрос в том же окне, в которое он записан
+            key, used = self._consume(cost)
+            if used <= self.per_minute:
+                return
+            try:
+                cache.decr(key, cost)
+            except ValueError:
+                pass
+            # ждём следующего окна, с джиттером, чтобы воркеры не стартовали разом
+            time.sleep(60 - time.time() % 60 + random.uniform(0, 1))
+
+
+def openai_budget() -> RateBudget:
+    return RateBudget("openai", settings.OPENAI_REQUESTS_PER_MINUTE)
@@ -0,0 +1,182 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from typing import Callable, Dict, Iterable, Optional
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, F, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .analysis import analyse_version, get_assistant_id
+from .models import LetterVersion, ReanalysisJob, ReanalysisItem
+from .ratelimit import RateBudget, openai_budget
+from .s3_utils import read_letter_text
+
+
+class JobAlreadyRunning(Exception):
+    """
+    Задачу уже выполняет другой процесс, и его heartbeat свежий.
+    """
+
+
+def resumable() -> Q:
+    """
+    Задачи, которые можно (пере)запустить: не running или running,
+    но без heartbeat дольше REANALYSIS_STALE_SECONDS (процесс упал).
+    """
+    stale = timezone.now() - timedelta(seconds=settings.REANALYSIS_STALE_SECONDS)
+    return ~Q(status="running") | Q(heartbeat_at__isnull=True) | Q(heartbeat_at__lt=stale)
+
+
+def _claim(job: ReanalysisJob):
+    """
+    Атомарно переводит задачу в running, если её никто не выполняет.
+    Возвращает записанный heartbeat — по нему процесс потом проверяет,
+    что задачу не перехватили; None, если задача занята.
+    """
+    now = timezone.now()
+    claimed = ReanalysisJob.objects.filter(resumable(), pk=job.pk).update(
+        status="running", heartbeat_at=now, started_at=Coalesce("started_at", now)
+    )
+    return now if claimed else None
+
+
+def _heartbeat(job: ReanalysisJob, last):
+    now = timezone.now()
+    alive = ReanalysisJob.objects.filter(pk=job.pk, heartbeat_at=last).update(heartbeat_at=now)
+    return now if alive else None
+
+
+def create_job(letter_type: str = "", letter_ids: Optional[Iterable] = None) -> ReanalysisJob:
+    """
+    Фиксирует список последних версий писем (по типу или по id) в строки ReanalysisItem.
+    """
+    versions = LetterVersion.objects.order_by("letter_id", "-version_num").distinct("letter_id")
+    if letter_type:
+        versions = versions.filter(letter__type=letter_type)
+    if letter_ids is not None:
+        versions = versions.filter(letter_id__in=list(letter_ids))
+    version_ids = list(versions.values_list("id", flat=True))
+
+    job = ReanalysisJob.objects.create(letter_type=letter_type, total=len(version_ids))
+    ReanalysisItem.objects.bulk_create(
+        [ReanalysisItem(job=job, version_id=vid) for vid in version_ids],
+        batch_size=1000
+    )
+    return job
+
+
+def job_progress(job: ReanalysisJob) -> Dict[str, int]:
+    counts = dict(
+        job.items.values_list("status").annotate(n=Count("id")).order_by()
+    )
+    progress = {s: counts.get(s, 0) for s, _ in ReanalysisItem.STATUS_CHOICES}
+    progress["total"] = job.total
+    return progress
+
+
+def _process_item(item_id: int, budget: RateBudget) -> None:
+    try:
+        # строку берёт только тот, кто перевёл её из pending
+        claimed = ReanalysisItem.objects.filter(id=item_id, status="pending").update(
+            status="running", attempts=F("attempts") + 1, updated_at=timezone.now()
+        )
+        if not claimed:
+            return
+        item = ReanalysisItem.objects.select_related("version__letter").get(id=item_id)
+
+        version = item.version
+        try:
+            letter_text = read_letter_text(version.s3_key)
+            assistant_id = get_assistant_id(version.letter.type)
+            if not assistant_id:
+                raise ValueError(f"Unknown letter type {version.letter.type}")
+            analyse_version(version, letter_text, assistant_id, throttle=budget.acquire)
+        except Exception as e:
+            logging.exception("Reanalysis of version %s failed", version.id)
+            # вернётся в очередь, пока не исчерпаны попытки
+            item.status = "pending" if item.attempts < settings.REANALYSIS_MAX_ATTEMPTS else "failed"
+            item.error = str(e)
+        else:
+            item.status = "done"
+            item.error = ""
+        item.save(update_fields=["status", "error", "updated_at"])
+    finally:
+        # у каждого потока своё соединение с БД
+        connection.close()
+
+
+def run_job(
+    job: ReanalysisJob,
+    concurrency: Optional[int] = None,
+    retry_failed: bool = False,
+    report: Optional[Callable[[Dict], None]] = None,
+) -> Dict[str, int]:
+    """
+    Выполняет (или продолжает) задачу: не больше concurrency писем одновременно,
+    каждый запрос к OpenAI проходит через общий бюджет OPENAI_REQUESTS_PER_MINUTE.
+    Задача сначала захватывается (status=running + heartbeat_at); если её уже
+    выполняет живой процесс — JobAlreadyRunning. Строки, зависшие в running
+    после падения прежнего процесса, возвращаются в очередь. Если heartbeat
+    перехватил другой процесс, новые строки больше не берутся.
+    """
+    concurrency = concurrency or settings.REANALYSIS_CONCURRENCY
+    budget = openai_budget()
+
+    heartbeat = _claim(job)
+    if heartbeat is None:
+        raise JobAlreadyRunning(f"Reanalysis #{job.pk} is already running")
+    job.refresh_from_db()
+
+    job.items.filter(status="running").update(status="pending")
+    if retry_failed:
+        job.items.filter(status="failed").update(status="pending", attempts=0)
+
+    started = time.monotonic()
+    processed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            while heartbeat is not None:
+                batch = list(
+                    job.items.filter(status="pending")
+                    .order_by("id")
+                    .values_list("id", flat=True)[:concurrency * 4]
+                )
+                if not batch:
+                    break
+                futures = [pool.submit(_process_item, item_id, budget) for item_id in batch]
+                for future in as_completed(futures):
+                    future.result()
+                    processed += 1
+                    heartbeat = heartbeat and _heartbeat(job, heartbeat)
+                    if report is not None:
+                        progress = job_progress(job)
+                        elapsed = time.monotonic() - started
+                        progress["rate_per_min"] = round(processed / elapsed * 60, 1) if elapsed else 0
+                        report(progress)
+    except BaseException:
+        if heartbeat is not None:
+            ReanalysisJob.objects.filter(pk=job.pk, heartbeat_at=heartbeat).update(status="failed")
+        raise
+
+    if heartbeat is None:
+        logging.warning("Reanalysis #%s was taken over by another process", job.pk)
+        return job_progress(job)
+    ReanalysisJob.objects.filter(pk=job.pk, heartbeat_at=heartbeat).update(
+        status="completed", finished_at=timezone.now()
+    )
+    job.refresh_from_db()
+    return job_progress(job)
+
+
+def pending_jobs():
+    """
+    Задачи для воркера (reanalyse_letters --pending): созданные, но не
+    запущенные, и running, чей процесс упал. Упавшие с ошибкой (failed)
+    продолжаются только явно, через --resume.
+    """
+    return (ReanalysisJob.objects.filter(resumable(), status__in=["pending", "running"])
+            .order_by("created_at"))
@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from . import vector_utils
+from .history import count_tokens
+from .models import LetterVersion
+
+CONTEXT_PREFIX = (
+    "Для ориентира — примеры сильных эссе того же типа и фрагменты критериев "
+    "оценки. Их не нужно оценивать, сравнивай с ними только письмо ниже:\n\n"
+)
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def _executor() -> ThreadPoolExecutor:
+    # свой пул в каждом воркере gunicorn: потоки не переживают fork
+    global _pool, _pool_pid
+    if _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool_pid != os.getpid():
+                _pool = ThreadPoolExecutor(settings.LETTER_EMBEDDING_WORKERS,
+                                           thread_name_prefix="letter-embedding")
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def _embed_version(version_id, text: str, throttle: Optional[Callable[[], None]]) -> None:
+    try:
+        vector = vector_utils.embed_texts([text], throttle=throttle)[0]
+        LetterVersion.objects.filter(id=version_id).update(embedding=vector.tobytes())
+    except Exception:
+        logging.exception("Embedding of letter version %s failed", version_id)
+    finally:
+        # у каждого потока своё соединение с БД
+        connection.close()
+
+
+def embed_version_later(version: LetterVersion, text: str,
+                        throttle: Optional[Callable[[], None]] = None) -> None:
+    """
+    Считает эмбеддинг версии в фоновом потоке после коммита, чтобы
+    POST /versions/ и analyse не ждали embeddings API. Пока вектора нет,
+    analyse идёт без примеров из индекса (см. retrieve_context). Это
+    единственный запрос к API за контекстом analyse; throttle — перед ним.
+    """
+    if text.strip():
+        transaction.on_commit(
+            lambda: _executor().submit(_embed_version, version.id, text, throttle)
+        )
+
+
+def version_embedding(version: LetterVersion) -> Optional[np.ndarray]:
+    """
+    Сохранённый вектор версии или None, если фоновый расчёт ещё не закончился.
+    Здесь ничего не считается: запрос к embeddings API на пути analyse
+    стоил бы сотни миллисекунд.
+    """
+    embedding = version.embedding
+    if embedding is None:
+        # вектор мог появиться после того, как версия была прочитана
+        embedding = (LetterVersion.objects.filter(id=version.id)
+                     .values_list("embedding", flat=True).first())
+        if embedding is None:
+            return None
+        version.embedding = embedding
+    vector = np.frombuffer(bytes(embedding), dtype="float32")
+    return vector if len(vector) == vector_utils.dim else None
+
+
+def retrieve_context(version: LetterVersion, text: str, k: Optional[int] = None) -> List[Dict]:
+    """
+    top-k документов индекса (примеры эссе, фрагменты критериев) того же типа
+    письма, ближайших к тексту версии, кроме менее похожих, чем
+    ANALYSE_CONTEXT_MIN_SIMILARITY: нерелевантные примеры только тратят
+    токены промпта. Текст версии не меняется, поэтому
+    найденное кэшируется по версии. Ошибка поиска не должна ломать analyse:
+    тогда возвращается пустой список. Пустой список и тогда, когда у версии
+    ещё нет сохранённого вектора (embed_version_later не успел).
+    """
+    k = settings.ANALYSE_CONTEXT_K if k is None else k
+    if k <= 0 or not text.strip():
+        return []
+    min_similarity = settings.ANALYSE_CONTEXT_MIN_SIMILARITY
+    key = f"analyse_context:{version.id}:{k}:{min_similarity}"
+    docs = cache.get(key)
+    if docs is not None:
+        return docs
+    vector = version_embedding(version)
+    if vector is None:
+        logging.info("Version %s has no embedding yet, analysing without context", version.id)
+        return []
+    try:
+        hits = vector_utils.search_documents(
+            vector, k,
+            filters={vector_utils.PARTITION_FIELD: version.letter.type},
+            min_similarity=min_similarity if min_similarity > -1 else None,
+        )
+    except Exception:
+        logging.exception("Context retrieval for version %s failed", version.id)
+        return []
+    docs = [{"id": hit["id"], "text": hit["text"]} for hit in hits]
+    # пустой результат не кэшируем: индекс могли ещё не наполнить
+    if docs:
+        cache.set(key, docs, timeout=settings.ANALYSE_CONTEXT_CACHE_SECONDS)
+    return docs
+
+
+def format_context(docs: List[Dict], max_tokens: Optional[int] = None) -> str:
+    """
+    Сообщение для thread с найденными документами, не длиннее max_tokens;
+    пустая строка, если добавлять нечего.
+    """
+    max_tokens = settings.ANALYSE_CONTEXT_MAX_TOKENS if max_tokens is None else max_tokens
+    parts, used = [], count_tokens(CONTEXT_PREFIX)
+    for n, doc in enumerate(docs, start=1):
+        part = f"[{n}] {doc['text'].strip()}"
+        tokens = count_tokens(part)
+        if used + tokens > max_tokens:
+            break
+        parts.append(part)
+        used += tokens
+    return CONTEXT_PREFIX + "\n\n".join(parts) if parts else ""
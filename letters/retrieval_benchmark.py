@@ -0,0 +1,175 @@
+import json
+import os
+import resource
+import subprocess
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Sequence
+
+import faiss
+import numpy as np
+
+from . import vector_utils
+from .bm25 import term_hash, tokenize
+
+MODES = ("vector", "hybrid", "hybrid_rerank")
+
+
+class HashingEmbedder:
+    """
+    Детерминированная замена embeddings API для офлайн-замеров: слова и
+    биграммы хэшируются в dim координат со знаком (feature hashing), вектор
+    нормируется. Похожие по словам тексты получают близкие векторы, а результат
+    не зависит ни от сети, ни от процесса.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype="float32")
+        for i, text in enumerate(texts):
+            tokens = tokenize(text)
+            features = Counter(tokens + [a + " " + b for a, b in zip(tokens, tokens[1:])])
+            for feature, tf in features.items():
+                h = term_hash(feature)
+                vectors[i, h % self.dim] += (1 + np.log(tf)) * (1 if h >> 63 else -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+def generate_dataset(documents: int = 10_000, queries: int = 500, seed: int = 0) -> Dict:
+    """
+    Синтетический размеченный набор: документы из тематической лексики и
+    общего фона (Zipf), у каждого — уникальное название. Запрос — отрывок из
+    8 слов своего документа, иногда с его названием, плюс 2 случайных слова;
+    релевантен ровно этот документ.
+    """
+    rng = np.random.default_rng(seed)
+    background = [f"w{i}" for i in range(20_000)]
+    weights = 1 / np.arange(1, len(background) + 1)
+    weights /= weights.sum()
+    topics = [[f"t{t}_{j}" for j in range(200)] for t in range(100)]
+
+    docs = []
+    for n in range(documents):
+        topic = topics[n % len(topics)]
+        words = [background[j] for j in rng.choice(len(background), 60, p=weights)]
+        words += [topic[j] for j in rng.integers(len(topic), size=30)]
+        rng.shuffle(words)
+        docs.append({"id": f"doc{n}", "text": f"Program{n} " + " ".join(words)})
+
+    labelled = []
+    for target in rng.choice(documents, size=min(queries, documents), replace=False):
+        words = docs[target]["text"].split()
+        start = int(rng.integers(1, len(words) - 8))
+        picked = words[start:start + 8]
+        if rng.random() < 0.3:
+            picked.append(words[0])  # название программы
+        picked += [background[j] for j in rng.choice(len(background), 2, p=weights)]
+        labelled.append({"text": " ".join(picked), "relevant": [docs[target]["id"]]})
+    return {"name": f"synthetic-{documents}-{queries}-seed{seed}", "documents": docs, "queries": labelled}
+
+
+def load_dataset(path: str) -> Dict:
+    """JSON {"documents": [{"id", "text"}], "queries": [{"text", "relevant": [id, ...]}]}."""
+    with open(path, encoding="utf-8") as f:
+        dataset = json.load(f)
+    dataset.setdefault("name", os.path.basename(path))
+    return dataset
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def evaluate(store: vector_utils.VectorStore, embedder: HashingEmbedder, queries: List[Dict],
+             k: int, mode: str) -> Dict:
+    """recall@k, MRR@k, QPS и задержки по одному запросу за раз, как в API."""
+    vectors = embedder.embed([q["text"] for q in queries])
+    recall, reciprocal_ranks, latencies = [], [], []
+    for query, vector in zip(queries, vectors):
+        started = time.perf_counter()
+        if mode == "vector":
+            hits = store.search_batch(vector, k)[0]
+        else:
+            hits = store.hybrid_search_batch(vector, [query["text"]], k,
+                                             rerank=mode == "hybrid_rerank")[0]
+        latencies.append(time.perf_counter() - started)
+        relevant = set(query["relevant"])
+        found = [hit["id"] in relevant for hit in hits]
+        recall.append(sum(found) / len(relevant))
+        reciprocal_ranks.append(1 / (found.index(True) + 1) if any(found) else 0.0)
+    latencies = np.array(latencies)
+    return {
+        "recall": round(float(np.mean(recall)), 4),
+        "mrr": round(float(np.mean(reciprocal_ranks)), 4),
+        "qps": round(len(latencies) / float(latencies.sum()), 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 2),
+    }
+
+
+def run_benchmark(dataset: Dict, index_types: Sequence[str], ks: Sequence[int],
+                  modes: Sequence[str] = ("vector",), embedder: Optional[HashingEmbedder] = None,
+                  rerank_factor: int = 0, batch_size: int = 10_000,
+                  report=None) -> Dict:
+    """
+    Для каждого типа индекса строит хранилище во временном каталоге, загружает
+    документы и прогоняет запросы для всех mode × k. Результат — словарь,
+    который пишется в JSON и сравнивается между коммитами.
+    """
+    embedder = embedder or HashingEmbedder()
+    docs = dataset["documents"]
+    results = []
+    for index_type in index_types:
+        with tempfile.TemporaryDirectory(prefix="retrieval-benchmark-") as workdir:
+            rss_before = _rss_mb()
+            store = vector_utils.VectorStore(
+                os.path.join(workdir, "index.bin"), os.path.join(workdir, "docs"),
+                index_type, embedder.dim, use_mmap=False, rerank_factor=rerank_factor,
+            )
+            started = time.perf_counter()
+            # IVF и PQ обучаются на первом батче, поэтому он должен быть большим
+            for start in range(0, len(docs), batch_size):
+                batch = docs[start:start + batch_size]
+                texts = [doc["text"] for doc in batch]
+                store.upsert([doc["id"] for doc in batch], embedder.embed(texts), texts)
+            build_seconds = time.perf_counter() - started
+            index_bytes = int(faiss.serialize_index(store.index).nbytes)
+
+            for mode in modes:
+                for k in ks:
+                    row = {"index_type": index_type, "mode": mode, "k": k,
+                           **evaluate(store, embedder, dataset["queries"], k, mode),
+                           "build_seconds": round(build_seconds, 2),
+                           "index_bytes": index_bytes,
+                           "rss_mb": round(_rss_mb() - rss_before, 1)}
+                    results.append(row)
+                    if report is not None:
+                        report(row)
+            del store
+    return {
+        "commit": git_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "dataset": {"name": dataset.get("name"), "documents": len(docs),
+                    "queries": len(dataset["queries"])},
+        "config": {"embedder": f"hashing-{embedder.dim}", "rerank_factor": rerank_factor,
+                   "hnsw_m": vector_utils.HNSW_M, "ef_search": vector_utils.HNSW_EF_SEARCH,
+                   "ivf_nlist": vector_utils.IVF_NLIST, "nprobe": vector_utils.IVF_NPROBE,
+                   "pq_m": vector_utils.PQ_M},
+        "results": results,
+    }
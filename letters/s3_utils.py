@@ -2,6 +2,11 @@
 import boto3
 from django.conf import settings
 
+def s3_client():
+    # boto3.client() на общей сессии по умолчанию не потокобезопасен:
+    # для пула потоков клиент создаётся заранее, а сам клиент можно делить
+    return boto3.client('s3', region_name=settings.AWS_REGION)
+
 def upload_letter_text(user_id: str, letter_id: str, version_num: int, text: str) -> str:
     key = f"user_{user_id}/letter_{letter_id}/version_{version_num}.txt"
     s3 = boto3.client('s3', region_name=settings.AWS_REGION)
@@ -13,9 +18,15 @@ def upload_letter_text(user_id: str, letter_id: str, version_num: int, text: str
     )
     return key
 
-def upload_draft_section(user_id: str, draft_id: str, section_key: str, text: str) -> str:
-    key = f"user_{user_id}/draft_{draft_id}/section_{section_key}.txt"
+def read_letter_text(key: str) -> str:
     s3 = boto3.client('s3', region_name=settings.AWS_REGION)
+    obj = s3.get_object(Bucket=settings.AWS_S3_BUCKET, Key=key)
+    return obj["Body"].read().decode("utf-8")
+
+def upload_draft_section(user_id: str, draft_id: str, section_key: str, text: str,
+                         s3=None) -> str:
+    key = f"user_{user_id}/draft_{draft_id}/section_{section_key}.txt"
+    s3 = s3 or s3_client()
     s3.put_object(
         Bucket=settings.AWS_S3_BUCKET,
         Key=key,
@@ -0,0 +1,43 @@
+import os
+import tempfile
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..vector_utils import VectorStore
+
+D = 8
+
+
+def unit(*axes):
+    vector = np.zeros(D, dtype="float32")
+    vector[list(axes)] = 1
+    return vector / np.linalg.norm(vector)
+
+
+def random_vectors(n, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, D)).astype("float32")
+
+
+def live_ids(store):
+    """id всех живых документов store (через scan, как rebalance)."""
+    ids, cursor = [], None
+    while True:
+        docs, _, cursor = store.scan(cursor, 100)
+        ids.extend(doc["id"] for doc in docs)
+        if cursor is None:
+            return ids
+
+
+class StoreTestCase(SimpleTestCase):
+    """Каждый тест — в своём временном каталоге."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+
+    def make_store(self, name="index", **kwargs):
+        kwargs.setdefault("metric", "l2")
+        return VectorStore(os.path.join(self.root, f"{name}.bin"),
+                           os.path.join(self.root, f"{name}_docs"), "flat", D, **kwargs)
@@ -0,0 +1,71 @@
+import json
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from ..analysis import extract_scores
+from ..models import AnalysisCriterionScore, AnalysisResult, Letter, LetterVersion, VersionMessage
+
+
+class ExtractScoresTests(SimpleTestCase):
+
+    def test_overall_key_and_number_formats(self):
+        self.assertEqual(extract_scores({"overall_score": "7,5/10"}), (7.5, {}))
+        self.assertEqual(extract_scores({"score": 8}), (8.0, {}))
+        # первый ключ без числа не мешает следующему
+        self.assertEqual(extract_scores({"overall_score": "n/a", "total_score": 6})[0], 6.0)
+        self.assertEqual(extract_scores({"overall": True}), (None, {}))
+
+    def test_criteria_as_dict(self):
+        _, criteria = extract_scores({"criteria": {"structure": 7, "style": {"score": "8"},
+                                                   "tone": "хорошо"}})
+        self.assertEqual(criteria, {"structure": 7.0, "style": 8.0})
+
+    def test_criteria_as_list(self):
+        payload = {"scores": [{"criterion": "structure", "score": 6},
+                              {"name": "style", "score": "9/10"},
+                              {"score": 5}, "junk"]}
+        self.assertEqual(extract_scores(payload)[1], {"structure": 6.0, "style": 9.0})
+
+    def test_not_a_dict(self):
+        self.assertEqual(extract_scores(["overall_score", 7]), (None, {}))
+        self.assertEqual(extract_scores("7"), (None, {}))
+
+
+class BackfillAnalysisResultsTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user("student@example.com", "password")
+        letter = Letter.objects.create(user=user, name="UCAS", type="ucas")
+        self.version = LetterVersion.objects.create(letter=letter, version_num=1, s3_key="k")
+
+    def message(self, content, role="assistant"):
+        return VersionMessage.objects.create(version=self.version, role=role, content=content)
+
+    def backfill(self, *args):
+        out = StringIO()
+        call_command("backfill_analysis_results", *args, stdout=out)
+        return out.getvalue()
+
+    def test_creates_results_for_json_replies_only(self):
+        valid = self.message(json.dumps({"overall_score": 7, "criteria": {"style": 8}}))
+        self.message('{"overall_score": NaN}')
+        self.message("Не JSON")
+        self.message(json.dumps({"overall_score": 5}), role="user")
+
+        self.assertIn("Создано результатов: 1, пропущено (не JSON): 2", self.backfill())
+        result = AnalysisResult.objects.get()
+        self.assertEqual((result.message_id, result.overall_score), (valid.id, 7.0))
+        self.assertEqual(list(AnalysisCriterionScore.objects.values_list("criterion", "score")),
+                         [("style", 8.0)])
+
+        # повторный запуск ничего не дублирует
+        self.assertIn("Создано результатов: 0", self.backfill())
+        self.assertEqual(AnalysisResult.objects.count(), 1)
+
+    def test_dry_run_writes_nothing(self):
+        self.message(json.dumps({"overall_score": 7}))
+        self.assertIn("[dry-run] Создано результатов: 1", self.backfill("--dry-run"))
+        self.assertFalse(AnalysisResult.objects.exists())
@@ -0,0 +1,74 @@
+import json
+
+import numpy as np
+
+from .helpers import StoreTestCase, random_vectors, unit
+
+
+class CosineTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.store = self.make_store(metric="cosine")
+        # cos с unit(0): 1, ~0.707, 0
+        self.store.upsert(["same", "half", "orthogonal"],
+                          np.array([unit(0), unit(0, 1), unit(1)]) * 5, ["s", "h", "o"])
+
+    def test_similarity_and_cutoff(self):
+        query = unit(0) * 3  # длина запроса не важна
+        hits = self.store.search(query, 3)
+        self.assertEqual([hit["id"] for hit in hits], ["same", "half", "orthogonal"])
+        for hit, expected in zip(hits, [1.0, 2 ** -0.5, 0.0]):
+            self.assertAlmostEqual(hit["similarity"], expected, places=5)
+
+        hits = self.store.search(query, 3, min_similarity=0.5)
+        self.assertEqual([hit["id"] for hit in hits], ["same", "half"])
+        self.assertEqual(self.store.search(query, 3, min_similarity=-0.5)[-1]["id"], "orthogonal")
+        self.assertEqual(self.store.search(-query, 3, min_similarity=0.5), [])
+
+    def test_vectors_are_stored_normalized(self):
+        _, vectors = self.store.vectors(["same"])
+        self.assertAlmostEqual(float(np.linalg.norm(vectors[0])), 1.0, places=5)
+
+    def test_cutoff_needs_cosine(self):
+        store = self.make_store("l2")
+        store.upsert(["a"], random_vectors(1), ["a"])
+        with self.assertRaises(ValueError):
+            store.search(random_vectors(1)[0], 1, min_similarity=0.5)
+
+    def test_store_of_another_metric_is_refused(self):
+        with self.assertRaisesRegex(RuntimeError, "build_faiss_index"):
+            self.make_store(metric="l2").search(unit(0), 1)
+
+
+class LegacyMetricTests(StoreTestCase):
+
+    def make_legacy_store(self):
+        """Снимок, записанный до того, как метрика попала в манифест."""
+        store = self.make_store()
+        self.vectors = random_vectors(3)
+        store.upsert(["a", "b", "c"], self.vectors, ["a", "b", "c"])
+        store.snapshot()
+        with open(store.manifest_path) as f:
+            manifest = json.load(f)
+        del manifest["metric"]
+        with open(store.manifest_path, "w") as f:
+            json.dump(manifest, f)
+
+    def test_manifest_without_metric_opens_as_l2(self):
+        self.make_legacy_store()
+        store = self.make_store(metric=None)
+        self.assertEqual(store.metric, "l2")
+        self.assertEqual(store.search(self.vectors[1], 1)[0]["id"], "b")
+        # и пишется дальше в той же метрике
+        store.upsert(["d"], random_vectors(1, seed=1), ["d"])
+        store.snapshot()
+        self.assertEqual(self.make_store(metric=None).metric, "l2")
+
+    def test_explicit_metric_still_refuses_legacy_store(self):
+        self.make_legacy_store()
+        with self.assertRaisesRegex(RuntimeError, "build_faiss_index"):
+            self.make_store(metric="cosine").search(unit(0), 1)
+
+    def test_new_store_without_metric_is_cosine(self):
+        self.assertEqual(self.make_store(metric=None).metric, "cosine")
@@ -0,0 +1,25 @@
+import os
+
+from ..docstore import DocStore
+from .helpers import StoreTestCase
+
+
+class DocStoreTests(StoreTestCase):
+
+    def test_docstore_ignores_torn_offset(self):
+        docs = DocStore(os.path.join(self.root, "docs"))
+        self.assertEqual(docs.append([{"text": "a"}, {"text": "b"}]), 0)
+        with open(docs.idx_path, "ab") as f:
+            f.write(b"\x01\x02\x03")
+        self.assertEqual(len(docs), 2)
+        self.assertEqual(docs.append([{"text": "c"}]), 2)
+        self.assertEqual([d["text"] for d in docs.get([0, 1, 2])], ["a", "b", "c"])
+        self.assertEqual(docs.get([3, -1]), [None, None])
+
+    def test_docstore_truncate(self):
+        docs = DocStore(os.path.join(self.root, "docs"))
+        docs.append([{"text": str(i)} for i in range(5)])
+        docs.truncate(3)
+        self.assertEqual(len(docs), 3)
+        self.assertEqual(docs.append([{"text": "x"}]), 3)
+        self.assertEqual(docs.get([3])[0]["text"], "x")
@@ -0,0 +1,66 @@
+import threading
+import time
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..embedding_batcher import EmbeddingBatcher
+from .helpers import D
+
+
+class RecordingEmbedder:
+    """Эмбеддер вместо embeddings API: строка i — float(текст), партии запоминаются."""
+
+    def __init__(self, gate=None):
+        self.batches = []
+        self.gate = gate
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        if self.gate is not None:
+            self.gate.wait(5)
+        return np.array([[float(text)] * D for text in texts], dtype="float32")
+
+
+class EmbeddingBatcherTests(SimpleTestCase):
+
+    def test_concurrent_requests_share_a_call(self):
+        embedder = RecordingEmbedder()
+        batcher = EmbeddingBatcher(embedder, max_wait=0.2)
+        futures = [batcher.submit(str(i)) for i in range(10)]
+        for i, future in enumerate(futures):
+            np.testing.assert_array_equal(future.result(5), np.full(D, i))
+        self.assertEqual(embedder.batches, [[str(i) for i in range(10)]])
+
+    def test_batches_are_capped(self):
+        embedder = RecordingEmbedder()
+        batcher = EmbeddingBatcher(embedder, max_batch=4, max_wait=0.2)
+        vectors = batcher.embed_many([str(i) for i in range(10)])
+        np.testing.assert_array_equal(vectors[:, 0], np.arange(10))
+        self.assertEqual([len(batch) for batch in embedder.batches], [4, 4, 2])
+
+    def test_batch_grows_while_calls_are_in_flight(self):
+        gate = threading.Event()
+        embedder = RecordingEmbedder(gate)
+        batcher = EmbeddingBatcher(embedder, max_wait=0.01, max_concurrency=1)
+        first = batcher.submit("0")
+        while not embedder.batches:
+            time.sleep(0.01)
+        later = [batcher.submit(str(i)) for i in range(1, 6)]
+        time.sleep(0.1)  # дольше max_wait: партия ждёт свободного вызова
+        gate.set()
+        self.assertEqual([future.result(5)[0] for future in [first] + later], list(range(6)))
+        self.assertEqual(embedder.batches, [["0"], [str(i) for i in range(1, 6)]])
+
+    def test_every_caller_gets_the_error(self):
+        def failing(texts):
+            raise RuntimeError("API down")
+
+        batcher = EmbeddingBatcher(failing, max_wait=0.2)
+        futures = [batcher.submit(str(i)) for i in range(3)]
+        for future in futures:
+            with self.assertRaisesRegex(RuntimeError, "API down"):
+                future.result(5)
+        # сбой не останавливает сборщик
+        batcher._embed = RecordingEmbedder()
+        np.testing.assert_array_equal(batcher.embed("7"), np.full(D, 7))
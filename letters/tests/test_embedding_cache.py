@@ -0,0 +1,89 @@
+import os
+import tempfile
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from .. import embedding_cache as cache_module
+from ..embedding_cache import WAYS, EmbeddingCache
+from .helpers import D, random_vectors
+
+MODEL = "text-embedding-ada-002"
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "embeddings")
+        patcher = mock.patch.object(cache_module, "time")
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.clock.time.return_value = 1000
+
+    def test_round_trip(self):
+        cache = EmbeddingCache(self.path, D, 64)
+        vectors = random_vectors(3)
+        cache.put(MODEL, ["a", "b", "c"], vectors)
+        found_vectors, found = cache.get(MODEL, ["b", "zzz", "a"])
+        self.assertEqual(found.tolist(), [True, False, True])
+        np.testing.assert_array_equal(found_vectors[[0, 2]], vectors[[1, 0]])
+        np.testing.assert_array_equal(found_vectors[1], 0)
+        # ключ включает модель
+        self.assertFalse(cache.get("other-model", ["a"])[1].any())
+        self.assertEqual(len(cache), 3)
+
+    def test_full_set_evicts_least_recently_used(self):
+        cache = EmbeddingCache(self.path, D, WAYS)  # один набор на все ключи
+        texts = [f"text {i}" for i in range(WAYS)]
+        for i, text in enumerate(texts):
+            self.clock.time.return_value = 1000 + i
+            cache.put(MODEL, [text], random_vectors(1, seed=i))
+        # чтение обновляет время использования: самым старым становится text 1
+        self.clock.time.return_value = 2000
+        self.assertTrue(cache.get(MODEL, ["text 0"])[1].all())
+
+        cache.put(MODEL, ["new"], random_vectors(1, seed=99))
+        _, found = cache.get(MODEL, texts + ["new"])
+        self.assertEqual([text for text, hit in zip(texts + ["new"], found) if not hit], ["text 1"])
+        self.assertEqual(len(cache), WAYS)
+
+    def test_batch_larger_than_a_set_keeps_what_fits(self):
+        cache = EmbeddingCache(self.path, D, WAYS)
+        texts = [f"text {i}" for i in range(WAYS + 4)]
+        cache.put(MODEL, texts, random_vectors(len(texts)))
+        _, found = cache.get(MODEL, texts)
+        self.assertEqual(found.tolist(), [True] * WAYS + [False] * 4)
+
+    def test_processes_share_files(self):
+        writer, reader = EmbeddingCache(self.path, D, 64), EmbeddingCache(self.path, D, 64)
+        self.assertFalse(reader.get(MODEL, ["a"])[1].any())  # файлы созданы читателем
+        vectors = random_vectors(1)
+        writer.put(MODEL, ["a"], vectors)
+        found_vectors, found = reader.get(MODEL, ["a"])
+        self.assertTrue(found.all())
+        np.testing.assert_array_equal(found_vectors, vectors)
+
+    def test_create_is_exclusive(self):
+        cache = EmbeddingCache(self.path, D, 64)
+        cache.put(MODEL, ["a"], random_vectors(1))
+        size = os.path.getsize(cache.vec_path)
+        # второй процесс, открывающий кэш, файлы не пересоздаёт и не обрезает
+        EmbeddingCache._create(cache.vec_path, 1)
+        self.assertEqual(os.path.getsize(cache.vec_path), size)
+        self.assertTrue(EmbeddingCache(self.path, D, 64).get(MODEL, ["a"])[1].all())
+
+    def test_resized_cache_uses_new_files(self):
+        EmbeddingCache(self.path, D, 64).put(MODEL, ["a"], random_vectors(1))
+        resized = EmbeddingCache(self.path, D, 128)
+        self.assertFalse(resized.get(MODEL, ["a"])[1].any())
+        self.assertNotEqual(resized.vec_path, EmbeddingCache(self.path, D, 64).vec_path)
+
+    def test_file_of_wrong_size_is_refused(self):
+        cache = EmbeddingCache(self.path, D, 64)
+        with open(cache.keys_path, "wb") as f:
+            f.write(b"\0" * 10)
+        with self.assertRaisesRegex(RuntimeError, "remove it"):
+            cache.get(MODEL, ["a"])
@@ -0,0 +1,53 @@
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from .. import generation
+from ..generation import iter_generated_sections
+
+
+def make_sections(n):
+    return [{"section_key": f"s{i}", "prompt_hint": "", "tone_style": ""} for i in range(n)]
+
+
+class IterGeneratedSectionsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.started = []
+        self.release = threading.Event()
+        patcher = mock.patch.object(generation, "s3_client")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(generation, "_generate_and_upload", side_effect=self.generate)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def generate(self, section, context, s3):
+        self.started.append(section["section_key"])
+        if section["section_key"] == "s1":
+            raise RuntimeError("model failed")
+        if section["section_key"] != "s0":
+            self.release.wait(5)
+        return section["section_key"].upper()
+
+    def test_results_and_errors_per_section(self):
+        self.release.set()
+        with self.assertLogs(level="ERROR"):
+            results = {section["section_key"]: (text, error and str(error))
+                       for section, text, error in iter_generated_sections(make_sections(3), {}, 2)}
+        self.assertEqual(results, {"s0": ("S0", None), "s1": (None, "model failed"),
+                                   "s2": ("S2", None)})
+
+    def test_closing_cancels_sections_not_started(self):
+        sections = iter_generated_sections(make_sections(6), {}, 1)
+        section, text, _ = next(sections)
+        self.assertEqual((section["section_key"], text), ("s0", "S0"))
+        # один поток: s1 и s2 могли начаться, остальные ждут в очереди;
+        # закрываем генератор, как при обрыве соединения
+        sections.close()
+        self.release.set()
+        time.sleep(0.2)
+        self.assertLessEqual(len(self.started), 3)
+        self.assertNotIn("s5", self.started)
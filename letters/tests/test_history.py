@@ -0,0 +1,111 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from .. import history
+from ..history import (SUMMARY_PREFIX, SUMMARY_ROLE, compact_messages, count_message_tokens,
+                       count_tokens, summarize_messages)
+
+
+def make_messages(n):
+    roles = ("user", "assistant")
+    return [{"role": roles[i % 2], "content": f"message {i} " + "word " * 30} for i in range(n)]
+
+
+class SummarizerStub:
+    """Вместо модели: запоминает, что ей передали, и дописывает номера сообщений."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, previous, pending):
+        self.calls.append((previous, [m["content"].split()[1] for m in pending]))
+        return " ".join([previous] + [m["content"].split()[1] for m in pending]).strip()
+
+
+class CompactMessagesTests(SimpleTestCase):
+
+    def test_within_budget_is_untouched(self):
+        messages = make_messages(4)
+        result = compact_messages(messages, count_message_tokens(messages), keep_recent=2,
+                                  summarize=SummarizerStub())
+        self.assertEqual(result, (messages, "", 0))
+
+    def test_older_messages_become_a_labelled_summary(self):
+        messages = make_messages(6)
+        summarize = SummarizerStub()
+        compacted, summary, covered = compact_messages(messages, 100, keep_recent=2,
+                                                       summarize=summarize)
+        self.assertEqual((summary, covered), ("0 1 2 3", 4))
+        self.assertEqual(compacted[0], {"role": SUMMARY_ROLE, "content": SUMMARY_PREFIX + summary})
+        self.assertNotEqual(compacted[0]["role"], "user")
+        self.assertEqual(compacted[1:], messages[4:])
+
+    def test_summary_is_extended_with_new_messages_only(self):
+        messages = make_messages(8)
+        summarize = SummarizerStub()
+        _, summary, covered = compact_messages(messages, 100, keep_recent=2, summary="0 1 2 3",
+                                               summarized_count=4, summarize=summarize)
+        self.assertEqual(summarize.calls, [("0 1 2 3", ["4", "5"])])
+        self.assertEqual((summary, covered), ("0 1 2 3 4 5", 6))
+
+    def test_nothing_new_to_summarize(self):
+        messages = make_messages(6)
+        summarize = SummarizerStub()
+        compacted, _, covered = compact_messages(messages, 100, keep_recent=2, summary="s",
+                                                 summarized_count=4, summarize=summarize)
+        self.assertEqual((summarize.calls, covered, len(compacted)), ([], 4, 3))
+
+    def test_shorter_history_resets_the_summary(self):
+        messages = make_messages(6)
+        summarize = SummarizerStub()
+        _, summary, covered = compact_messages(messages, 100, keep_recent=2, summary="stale",
+                                               summarized_count=10, summarize=summarize)
+        self.assertEqual(summarize.calls, [("", ["0", "1", "2", "3"])])
+        self.assertEqual((summary, covered), ("0 1 2 3", 4))
+
+    def test_failed_summary_keeps_newest_messages_in_budget(self):
+        messages = make_messages(8)
+
+        def failing(previous, pending):
+            raise RuntimeError("API down")
+
+        header = {"role": SUMMARY_ROLE, "content": SUMMARY_PREFIX + "0 1"}
+        # бюджет: саммари, два последних и ещё два из не вошедших в саммари
+        budget = count_message_tokens([header] + messages[4:])
+        with self.assertLogs(level="ERROR"):
+            compacted, summary, covered = compact_messages(
+                messages, budget, keep_recent=2, summary="0 1", summarized_count=2,
+                summarize=failing,
+            )
+        self.assertEqual((summary, covered), ("0 1", 2))
+        self.assertEqual(compacted, [header] + messages[4:])
+        self.assertLessEqual(count_message_tokens(compacted), budget)
+
+    def test_failed_first_summary_drops_the_oldest(self):
+        messages = make_messages(6)
+        budget = count_message_tokens(messages[3:]) + count_tokens("x")
+        with self.assertLogs(level="ERROR"):
+            compacted, summary, covered = compact_messages(
+                messages, budget, keep_recent=2,
+                summarize=lambda previous, pending: 1 / 0,
+            )
+        self.assertEqual((compacted, summary, covered), (messages[3:], "", 0))
+
+
+class SummarizeMessagesTests(SimpleTestCase):
+
+    def test_throttle_runs_before_the_request(self):
+        calls = []
+        reply = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=" summary "))])
+
+        def create(**kwargs):
+            calls.append("request")
+            return reply
+
+        with mock.patch.object(history, "openai") as openai:
+            openai.chat.completions.create.side_effect = create
+            summary = summarize_messages("", make_messages(2),
+                                         throttle=lambda: calls.append("throttle"))
+        self.assertEqual((summary, calls), ("summary", ["throttle", "request"]))
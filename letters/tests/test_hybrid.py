@@ -0,0 +1,117 @@
+import os
+import statistics
+import time
+
+import numpy as np
+
+from .. import bm25
+from ..vector_utils import RRF_K
+from .helpers import StoreTestCase, random_vectors, unit
+
+# Гибридный поиск должен укладываться в несколько миллисекунд сверх чисто векторного на 100k документов
+LATENCY_DOCS = 100_000
+LATENCY_BUDGET_MS = 5.0
+
+
+class HybridSearchTests(StoreTestCase):
+
+    def test_bm25_ranks_and_filters(self):
+        table = bm25.TermTable(os.path.join(self.root, "docs"))
+        texts = ["Oxford physics MSc", "Oxford history", "Cambridge physics", "law"]
+        table.append(texts, 0)
+        segments = bm25.add_segment((), table, len(texts))
+        allowed = np.ones(len(texts), dtype=bool)
+
+        scores, slots = bm25.search(segments, "oxford physics", allowed, 3)
+        self.assertEqual(slots[0], 0)
+        self.assertEqual(sorted(slots.tolist()), [0, 1, 2])
+        self.assertTrue(np.all(np.diff(scores) <= 0))
+
+        allowed[0] = False
+        _, slots = bm25.search(segments, "oxford physics", allowed, 3)
+        self.assertNotIn(0, slots.tolist())
+        self.assertEqual(len(bm25.search(segments, "chemistry", allowed, 3)[1]), 0)
+
+    def test_bm25_segments_merge_logarithmically(self):
+        table = bm25.TermTable(os.path.join(self.root, "docs"))
+        segments = ()
+        for slot in range(16):
+            table.append([f"doc {slot}"], slot)
+            segments = bm25.add_segment(segments, table, slot + 1)
+        self.assertEqual(len(segments), 1)
+        self.assertEqual((segments[0].start, segments[0].end), (0, 16))
+        _, slots = bm25.search(segments, "doc 7", np.ones(16, dtype=bool), 1)
+        self.assertEqual(slots.tolist(), [7])
+
+    def test_bm25_statistics_skip_dead_slots(self):
+        texts = ["zebra", "zebra lion", "zebra", "lion zebra in a very long text", "law"]
+        table = bm25.TermTable(os.path.join(self.root, "docs"))
+        table.append(texts, 0)
+        segments = bm25.add_segment((), table, len(texts))
+        live = np.array([False, True, False, True, True])
+        # те же живые документы без мёртвых слотов
+        compacted = bm25.TermTable(os.path.join(self.root, "compacted"))
+        compacted.append([text for text, alive in zip(texts, live) if alive], 0)
+        expected_segments = bm25.add_segment((), compacted, int(live.sum()))
+
+        self.assertEqual(bm25.idf(segments, "zebra lion", live),
+                         bm25.idf(expected_segments, "zebra lion"))
+        self.assertNotEqual(bm25.idf(segments, "zebra lion"),
+                            bm25.idf(expected_segments, "zebra lion"))
+        scores, slots = bm25.search(segments, "zebra lion", live, 5, live)
+        expected_scores, expected_slots = bm25.search(expected_segments, "zebra lion",
+                                                      np.ones(3, dtype=bool), 5)
+        self.assertEqual(slots.tolist(), np.flatnonzero(live)[expected_slots].tolist())
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-6)
+
+    def test_reciprocal_rank_fusion(self):
+        store = self.make_store()
+        store.upsert(["a", "b", "c"], np.array([unit(0), unit(1), unit(2)]),
+                     ["alpha", "zebra physics", "gamma"])
+        hits = store.hybrid_search_batch(unit(0)[None], ["zebra"], 3)[0]
+        # b: 2-е место по вектору и 1-е по BM25 — выше a, первого только по вектору
+        self.assertEqual([hit["id"] for hit in hits], ["b", "a", "c"])
+        self.assertAlmostEqual(hits[0]["score"], 1 / (RRF_K + 2) + 1 / (RRF_K + 1))
+        self.assertAlmostEqual(hits[1]["score"], 1 / (RRF_K + 1))
+        self.assertAlmostEqual(hits[1]["distance"], 0.0)
+
+    def test_hybrid_skips_tombstones_and_filters(self):
+        store = self.make_store()
+        store.upsert(["a", "b"], np.array([unit(0), unit(1)]), ["zebra", "zebra"],
+                     [{"country": "UK"}, {"country": "DE"}])
+        store.delete(["a"])
+        hits = store.hybrid_search_batch(unit(0)[None], ["zebra"], 5)[0]
+        self.assertEqual([hit["id"] for hit in hits], ["b"])
+        hits = store.hybrid_search_batch(unit(1)[None], ["zebra"], 5, filters={"country": "UK"})[0]
+        self.assertEqual(hits, [])
+
+
+class HybridLatencyTests(StoreTestCase):
+
+    @staticmethod
+    def median_ms(search, repeat=25):
+        search()  # прогрев: первое обращение читает mmap с диска
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            search()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
+
+    def test_hybrid_within_budget_of_vector_only(self):
+        rng = np.random.default_rng(0)
+        words = np.array([f"term{i}" for i in range(5000)])
+        texts = [" ".join(row) for row in words[rng.integers(0, len(words), (LATENCY_DOCS, 8))]]
+        ids = [str(i) for i in range(LATENCY_DOCS)]
+        vectors = random_vectors(LATENCY_DOCS)
+        store = self.make_store()
+        for start in range(0, LATENCY_DOCS, 20_000):
+            end = start + 20_000
+            store.upsert(ids[start:end], vectors[start:end], texts[start:end])
+
+        query = random_vectors(1, seed=1)
+        text = [texts[123].split(" ", 3)[-1]]
+        vector_ms = self.median_ms(lambda: store.search_batch(query, 10))
+        hybrid_ms = self.median_ms(lambda: store.hybrid_search_batch(query, text, 10))
+        self.assertLess(hybrid_ms - vector_ms, LATENCY_BUDGET_MS,
+                        f"hybrid {hybrid_ms:.2f} ms vs vector-only {vector_ms:.2f} ms")
@@ -0,0 +1,87 @@
+import json
+import os
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from .. import ingest as ingest_module
+from .. import vector_utils
+from ..history import count_tokens, split_tokens
+from ..ingest import chunk_text, ingest
+from ..ratelimit import RateBudget
+from ..vector_utils import PartitionedVectorStore
+from .helpers import D, StoreTestCase, live_ids
+
+
+def paragraph(word, n=40):
+    return " ".join([word] * n)
+
+
+def fake_embeddings(texts, throttle=None):
+    return np.random.default_rng(len(texts)).standard_normal((len(texts), D)).astype("float32")
+
+
+class ChunkTextTests(SimpleTestCase):
+
+    def test_short_text_is_one_chunk(self):
+        self.assertEqual(chunk_text("short text", 60), ["short text"])
+
+    def test_paragraphs_are_merged_while_they_fit(self):
+        text = "\n\n".join(paragraph(w, 5) for w in ("alpha", "beta", "gamma"))
+        limit = count_tokens(paragraph("delta"))  # первый абзац занимает кусок целиком
+        chunks = chunk_text(paragraph("delta") + "\n\n \n\n" + text, limit)
+        self.assertEqual(chunks, [paragraph("delta"), text])
+
+    def test_long_paragraph_is_split_by_tokens(self):
+        chunks = chunk_text(paragraph("epsilon", 300), 60)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(count_tokens(chunk) <= 60 for chunk in chunks))
+
+
+class SplitTokensTests(SimpleTestCase):
+
+    def test_pieces_fit_and_join_back(self):
+        text = "The quick brown fox jumps over the lazy dog. " * 50
+        pieces = split_tokens(text, 25)
+        self.assertEqual("".join(pieces), text)
+        self.assertTrue(all(count_tokens(piece) <= 25 for piece in pieces))
+        self.assertEqual(split_tokens("", 25), [])
+
+
+class StaleChunkTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.corpus = os.path.join(self.root, "corpus.jsonl")
+        self.store = PartitionedVectorStore(os.path.join(self.root, "partitions"),
+                                            default=self.make_store(), d=D, metric="l2")
+        patcher = mock.patch.object(vector_utils, "embed_texts", fake_embeddings)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ingest(self, paragraphs):
+        """Загружает документ "a" из paragraphs абзацев (каждый — отдельный кусок) и "b"."""
+        docs = [{"id": "a", "text": "\n\n".join(paragraph(f"w{i}") for i in range(paragraphs))},
+                {"id": "b", "text": "one chunk"}]
+        with open(self.corpus, "w") as f:
+            f.write("\n".join(json.dumps(doc) for doc in docs))
+        checkpoint = self.corpus + ".checkpoint"
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        # абзац помещается в кусок, два — уже нет
+        chunk_tokens = count_tokens(paragraph("w0")) + 1
+        stats = ingest(self.corpus, checkpoint, RateBudget("test", 10_000), store=self.store,
+                       chunk_tokens=chunk_tokens, batch_size=2, concurrency=1)
+        return sorted(live_ids(self.store.default)), stats["stale_removed"]
+
+    def test_fewer_chunks_remove_the_rest(self):
+        self.assertEqual(self.ingest(4), (["a#0", "a#1", "a#2", "a#3", "b"], 0))
+        self.assertEqual(self.ingest(2), (["a#0", "a#1", "b"], 2))
+        self.assertEqual(self.ingest(1), (["a", "b"], 2))
+        self.assertEqual(self.ingest(3), (["a#0", "a#1", "a#2", "b"], 1))
+
+    def test_probe_continues_past_a_full_window(self):
+        self.ingest(7)
+        with mock.patch.object(ingest_module, "STALE_CHUNK_PROBE", 2):
+            self.assertEqual(self.ingest(1), (["a", "b"], 7))
@@ -0,0 +1,50 @@
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from .. import ratelimit
+from ..ratelimit import RateBudget
+
+
+class RateBudgetTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.budget = RateBudget("test", per_minute=2)
+        # часы подменяются только для ratelimit: LocMem считает срок жизни ключей по настоящим
+        self.minute = int(time.time() // 60)
+        patcher = mock.patch.object(ratelimit, "time")
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def at(self, *seconds):
+        """Следующие вызовы time.time() в ratelimit: seconds от начала текущей минуты."""
+        self.clock.time.side_effect = [self.minute * 60 + s for s in seconds]
+
+    def used(self, minute):
+        return cache.get(f"ratebudget:test:{self.minute + minute}")
+
+    def test_consume_counts_per_window(self):
+        self.at(30, 31, 90)
+        self.assertEqual([self.budget.consume(), self.budget.consume(2), self.budget.consume()],
+                         [1, 3, 1])
+        self.assertEqual((self.used(0), self.used(1)), (3, 1))
+
+    def test_acquire_within_budget_does_not_wait(self):
+        self.at(30, 31)
+        self.budget.acquire()
+        self.budget.acquire()
+        self.clock.sleep.assert_not_called()
+        self.assertEqual(self.used(0), 2)
+
+    def test_acquire_over_budget_rolls_back_its_own_window(self):
+        self.at(10)
+        self.budget.consume(2)
+        # окно сменяется сразу после записи: откат должен попасть в то же окно
+        self.at(59.99, 60.01, 60.02, 60.03)
+        self.budget.acquire()
+        self.clock.sleep.assert_called_once()
+        self.assertEqual((self.used(0), self.used(1)), (2, 1))
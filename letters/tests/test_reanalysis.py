@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+from django.contrib.admin.sites import site
+from django.contrib.auth import get_user_model
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from ..admin import ReanalysisJobAdmin
+from ..models import Letter, LetterVersion, ReanalysisItem, ReanalysisJob
+from ..reanalysis import pending_jobs
+
+
+class ReanalysisJobAdminTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user("student@example.com", "password")
+        letter = Letter.objects.create(user=user, name="UCAS", type="ucas")
+        self.versions = [LetterVersion.objects.create(letter=letter, version_num=n, s3_key=str(n))
+                         for n in range(1, 4)]
+
+    def make_job(self, statuses, **fields):
+        job = ReanalysisJob.objects.create(total=len(statuses), **fields)
+        ReanalysisItem.objects.bulk_create([
+            ReanalysisItem(job=job, version=version, status=item_status)
+            for version, item_status in zip(self.versions, statuses)
+        ])
+        return job
+
+    def test_progress_in_one_query(self):
+        self.make_job(["done", "done", "failed"])
+        self.make_job(["pending", "done"])
+        model_admin = ReanalysisJobAdmin(ReanalysisJob, site)
+        with self.assertNumQueries(1):
+            progress = [model_admin.progress(job) for job in
+                        model_admin.get_queryset(RequestFactory().get("/")).order_by("id")]
+        self.assertEqual(progress, ["2/3 (failed 1)", "1/2 (failed 0)"])
+
+    @override_settings(REANALYSIS_STALE_SECONDS=60)
+    def test_pending_jobs(self):
+        now = timezone.now()
+        new = self.make_job(["pending"])
+        crashed = self.make_job(["running"], status="running",
+                                heartbeat_at=now - timedelta(minutes=5))
+        self.make_job(["running"], status="running", heartbeat_at=now)
+        self.make_job(["failed"], status="failed")
+        self.make_job(["done"], status="completed")
+        self.assertEqual(list(pending_jobs()), [new, crashed])
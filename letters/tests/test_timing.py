@@ -0,0 +1,139 @@
+import json
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from .. import views
+from ..models import DraftAnswer, DraftLetter
+from ..timing import PhaseTimer, incr_counter, observe, render_metrics
+
+
+def metric_lines(text, phase, endpoint="analyse"):
+    labels = f'endpoint="{endpoint}",phase="{phase}"'
+    return [line for line in text.splitlines() if labels in line]
+
+
+class PhaseTimerTests(SimpleTestCase):
+
+    def test_spans_accumulate(self):
+        timer = PhaseTimer()
+        timer.add("message_post", 0.01)
+        timer.add("message_post", 0.0205)
+        with timer.span("db"):
+            pass
+        timings = timer.finish()
+        self.assertEqual(timings["message_post"], 30.5)
+        self.assertGreaterEqual(timings["total"], timings["db"])
+        self.assertIn("message_post;dur=30.5", timer.server_timing())
+
+
+class RenderMetricsTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_histogram_is_cumulative(self):
+        for seconds in (0.02, 0.02, 200):
+            timer = PhaseTimer()
+            timer.add("db", seconds)
+            timer.add("not_a_phase", 1)
+            observe("analyse", timer)
+        lines = metric_lines(render_metrics(), "db")
+        self.assertIn('achievka_phase_seconds_bucket{endpoint="analyse",phase="db",le="0.01"} 0', lines)
+        self.assertIn('achievka_phase_seconds_bucket{endpoint="analyse",phase="db",le="0.025"} 2', lines)
+        self.assertIn('achievka_phase_seconds_bucket{endpoint="analyse",phase="db",le="120"} 2', lines)
+        # длиннее последней корзины — только в +Inf и count
+        self.assertIn('achievka_phase_seconds_bucket{endpoint="analyse",phase="db",le="+Inf"} 3', lines)
+        self.assertIn('achievka_phase_seconds_sum{endpoint="analyse",phase="db"} 200.04', lines)
+        self.assertIn('achievka_phase_seconds_count{endpoint="analyse",phase="db"} 3', lines)
+        self.assertNotIn("not_a_phase", render_metrics())
+
+    def test_counters(self):
+        incr_counter("embedding_cache_hits", 3)
+        incr_counter("embedding_cache_hits", 0)
+        text = render_metrics()
+        self.assertIn("achievka_embedding_cache_hits_total 3", text)
+        self.assertIn("achievka_embedding_cache_misses_total 0", text)
+
+
+class MetricsViewTests(SimpleTestCase):
+
+    def get(self, **headers):
+        return self.client.get(reverse("letters:metrics"), headers=headers)
+
+    @override_settings(METRICS_TOKEN="")
+    def test_closed_without_a_token(self):
+        self.assertEqual(self.get(**{"X-Metrics-Token": ""}).status_code, 403)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_token_required(self):
+        self.assertEqual(self.get().status_code, 403)
+        self.assertEqual(self.get(**{"X-Metrics-Token": "wrong"}).status_code, 403)
+        response = self.get(**{"X-Metrics-Token": "secret"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"# TYPE achievka_phase_seconds histogram", response.content)
+
+
+def assistant_reply(text):
+    content = [SimpleNamespace(text=SimpleNamespace(value=text))]
+    return SimpleNamespace(data=[SimpleNamespace(content=content)] if text is not None else [])
+
+
+class GenerateStructureTimingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        user = get_user_model().objects.create_user("student@example.com", "password",
+                                                    has_subscription=True)
+        self.draft = DraftLetter.objects.create(user=user, name="UCAS", type="ucas_create",
+                                                program="Physics")
+        DraftAnswer.objects.create(draft_letter=self.draft, question_key="why", answer_text="-",
+                                   order=1)
+        self.user = user
+        patcher = mock.patch.object(views, "openai")
+        self.openai = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.openai.beta.threads.runs.create.return_value = SimpleNamespace(status="completed")
+
+    def post(self, reply):
+        self.openai.beta.threads.messages.list.return_value = assistant_reply(reply)
+        request = APIRequestFactory().post("/")
+        force_authenticate(request, self.user)
+        view = views.DraftLetterViewSet.as_view({"post": "generate_structure"})
+        return view(request, pk=self.draft.pk)
+
+    def observed(self):
+        lines = metric_lines(render_metrics(), "total", endpoint="generate_structure")
+        return next((line.rsplit(" ", 1)[1] for line in lines if "_count" in line), "0")
+
+    def test_success_saves_finished_timings(self):
+        sections = [{"key": "intro", "prompt_hint": "h", "tone_style": "t"}]
+        with mock.patch("letters.s3_utils.get_presigned_url", return_value="https://s3/intro"):
+            response = self.post(json.dumps({"sections": sections}))
+        self.assertEqual(response.status_code, 200)
+        self.draft.refresh_from_db()
+        self.assertIn("total", self.draft.timings)
+        self.assertEqual(self.observed(), "1")
+
+    def test_failures_are_observed(self):
+        response = self.post(None)
+        self.assertEqual((response.status_code, response.data["detail"]),
+                         (500, "No assistant response"))
+        response = self.post("not json")
+        self.assertEqual((response.status_code, response.data["raw"]), (500, "not json"))
+        self.assertEqual(self.observed(), "2")
+
+    def test_openai_errors_are_wrapped(self):
+        self.openai.beta.threads.create.side_effect = RuntimeError("boom")
+        with self.assertLogs(level="ERROR"):
+            response = self.post("{}")
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.data, {"detail": "OpenAI thread creation failed", "error": "boom"})
+        self.assertEqual(self.observed(), "1")
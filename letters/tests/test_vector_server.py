@@ -0,0 +1,113 @@
+import os
+import socket
+import threading
+
+import numpy as np
+
+from ..vector_server import (OP_PING, OP_SEARCH, STATUS_OK, VectorClient, VectorServer,
+                             VectorServerError, _vectors, read_frame, write_frame)
+from .helpers import D, StoreTestCase, random_vectors
+
+
+class VectorServerTests(StoreTestCase):
+
+    def test_frame_round_trip(self):
+        left, right = socket.socketpair()
+        self.addCleanup(left.close)
+        self.addCleanup(right.close)
+        vectors = random_vectors(3)
+        write_frame(left, OP_SEARCH, {"k": 2, "text": "привет", "n": 3, "d": D}, vectors)
+        code, meta, payload = read_frame(right)
+        self.assertEqual(code, OP_SEARCH)
+        self.assertEqual(meta["text"], "привет")
+        np.testing.assert_array_equal(_vectors(meta, payload), vectors)
+
+        write_frame(left, STATUS_OK, {})
+        self.assertEqual(read_frame(right), (STATUS_OK, {}, b""))
+
+    def test_large_frame_arrives_whole(self):
+        left, right = socket.socketpair()
+        self.addCleanup(left.close)
+        self.addCleanup(right.close)
+        vectors = random_vectors(50_000)  # больше буфера сокета
+        writer = threading.Thread(target=write_frame,
+                                  args=(left, OP_SEARCH, {"n": len(vectors), "d": D}, vectors))
+        writer.start()
+        code, meta, payload = read_frame(right)
+        writer.join()
+        np.testing.assert_array_equal(_vectors(meta, payload), vectors)
+
+    def test_truncated_frame_raises(self):
+        left, right = socket.socketpair()
+        self.addCleanup(right.close)
+        left.sendall(b"\x10\x00\x00\x00\x01")
+        left.close()
+        with self.assertRaises(ConnectionError):
+            read_frame(right)
+
+
+
+class ClientServerTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.root, "vector.sock")
+        self.server = VectorServer(self.path, self.make_store(),
+                                   stores={"programs": self.make_store("programs")})
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.client = self.connect()
+        self.vectors = random_vectors(3)
+        self.client.upsert(["a", "b", "c"], self.vectors, ["a", "b", "c"],
+                           [{"letter_type": "ucas"}, {}, {}])
+
+    def connect(self, **kwargs):
+        client = VectorClient(self.path, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def test_upsert_search_delete(self):
+        self.assertEqual(self.client.changed(["a", "b"], ["a", "b changed"],
+                                             [{"letter_type": "ucas"}, {}]), [1])
+        hits = self.client.search_batch(self.vectors[:2], 1)
+        self.assertEqual([row[0]["id"] for row in hits], ["a", "b"])
+        hits = self.client.search_batch(self.vectors[:1], 3, filters={"letter_type": "ucas"})[0]
+        self.assertEqual([(hit["id"], hit["metadata"]) for hit in hits], [("a", {"letter_type": "ucas"})])
+        self.assertEqual(self.client.delete(["a"]), 1)
+        self.assertEqual(self.client.ping()["pid"], os.getpid())
+
+    def test_named_store(self):
+        programs = self.connect(store="programs")
+        self.assertEqual(programs.search_batch(self.vectors[:1], 3), [[]])
+        programs.upsert(["1"], self.vectors[:1], ["1"])
+        self.assertEqual([hit["id"] for hit in programs.search_batch(self.vectors[:1], 3)[0]], ["1"])
+        # основной индекс не задет
+        self.assertEqual(len(self.client.search_batch(self.vectors[:1], 5)[0]), 3)
+
+    def test_errors_keep_the_connection(self):
+        with self.assertLogs(level="ERROR"):
+            with self.assertRaisesRegex(VectorServerError, "Unknown opcode"):
+                self.client._call(99, {})
+        self.assertEqual(self.client._call(OP_PING, {})["pid"], os.getpid())
+
+    def test_scan(self):
+        docs, scanned, cursor = self.client.scan(limit=2)
+        self.assertEqual([doc["id"] for doc in docs], ["a", "b"])
+        self.assertEqual(scanned.shape, (2, D))
+        docs, scanned, cursor = self.client.scan(cursor)
+        self.assertEqual(([doc["id"] for doc in docs], cursor), (["c"], None))
+        np.testing.assert_allclose(scanned, self.vectors[2:])
+
+    def test_vectors_by_id(self):
+        self.client.delete(["b"])
+        ids, vectors = self.client.vectors(["c", "b", "a"])
+        self.assertEqual(ids, ["a", "c"])
+        np.testing.assert_allclose(vectors, self.vectors[[0, 2]])
+
+    def test_embed(self):
+        with self.assertLogs(level="ERROR"):
+            with self.assertRaisesRegex(VectorServerError, "does not embed"):
+                self.client.embed(["a"])
+        self.server.embed = lambda texts: np.ones((len(texts), D))
+        np.testing.assert_array_equal(self.client.embed(["a", "b"]), np.ones((2, D)))
@@ -0,0 +1,58 @@
+import numpy as np
+
+from ..vector_shards import ShardedVectorStore
+from .helpers import StoreTestCase, live_ids, random_vectors
+
+
+class ShardTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.shards = [self.make_store(f"s{i}") for i in range(4)]
+        self.ids = [f"doc{i}" for i in range(60)]
+        self.vectors = random_vectors(60)
+
+    def sharded(self, count):
+        return ShardedVectorStore(self.shards[:count], names=[f"s{i}" for i in range(count)])
+
+    def test_documents_live_on_their_owner(self):
+        sharded = self.sharded(3)
+        self.assertEqual(sharded.upsert(self.ids, self.vectors, self.ids), 60)
+        for i, shard in enumerate(self.shards[:3]):
+            self.assertEqual(sorted(live_ids(shard)),
+                             sorted(d for d in self.ids if sharded.owner(d) == i))
+        hits = sharded.search_batch(self.vectors[7][None], 5)[0]
+        self.assertEqual(hits[0]["id"], "doc7")
+        self.assertEqual(len({hit["id"] for hit in hits}), 5)
+
+    def test_adding_a_shard_moves_only_to_it(self):
+        three, four = self.sharded(3), self.sharded(4)
+        moved = [d for d in self.ids if three.owner(d) != four.owner(d)]
+        self.assertTrue(moved)
+        self.assertTrue(all(four.owner(d) == 3 for d in moved))
+
+    def test_rebalance(self):
+        self.sharded(3).upsert(self.ids, self.vectors, self.ids)
+        four = self.sharded(4)
+        expected = sum(four.owner(d) == 3 for d in self.ids)
+
+        stats = four.rebalance(batch_size=7)
+        # новый шард сканируется последним, уже с переехавшими документами
+        self.assertEqual(stats, {"scanned": 60 + expected, "moved": expected})
+        for i, shard in enumerate(self.shards):
+            self.assertEqual(sorted(live_ids(shard)),
+                             sorted(d for d in self.ids if four.owner(d) == i))
+        # вектор переехал вместе с документом
+        moved = next(d for d in self.ids if four.owner(d) == 3)
+        docs, vectors, _ = self.shards[3].scan(None, 100)
+        row = [doc["id"] for doc in docs].index(moved)
+        np.testing.assert_allclose(vectors[row], self.vectors[self.ids.index(moved)])
+        self.assertEqual(four.rebalance()["moved"], 0)
+
+    def test_upsert_removes_copies_from_other_shards(self):
+        self.shards[0].upsert(["stray"], self.vectors[:1], ["old"])
+        sharded = self.sharded(3)
+        sharded.upsert(["stray"], self.vectors[:1], ["new"])
+        holders = [i for i, shard in enumerate(self.shards[:3]) if "stray" in live_ids(shard)]
+        self.assertEqual(holders, [sharded.owner("stray")])
+        self.assertEqual(sharded.delete(["stray"]), 1)
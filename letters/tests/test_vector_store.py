@@ -0,0 +1,164 @@
+import os
+import time
+from unittest import mock
+
+import numpy as np
+
+from .. import vector_utils
+from ..vector_keys import KeyTable
+from .helpers import StoreTestCase, random_vectors, live_ids
+
+
+class KeyTableTests(StoreTestCase):
+
+    def test_key_table_truncate_and_tombstones(self):
+        keys = KeyTable(os.path.join(self.root, "docs"))
+        keys.append([1, 2, 3], [10, 20, 30])
+        keys.delete([1])
+        with open(keys.keys_path, "ab") as f:
+            f.write(b"\x00" * 5)  # недописанная запись
+        keys.truncate(2)
+        self.assertEqual(len(keys), 2)
+        self.assertEqual(keys.records()["key"].tolist(), [1, 2])
+        self.assertEqual(keys.deleted().tolist(), [1])
+
+
+class TombstoneTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.store = self.make_store()
+        self.vectors = random_vectors(3)
+        self.store.upsert(["a", "b", "c"], self.vectors, ["a v1", "b", "c"])
+
+    def test_replaced_document_has_one_live_version(self):
+        self.assertEqual(self.store.upsert(["a"], self.vectors[:1], ["a v2"]), 1)
+        hits = self.store.search(self.vectors[0], 5)
+        self.assertEqual(sorted(hit["id"] for hit in hits), ["a", "b", "c"])
+        self.assertEqual(hits[0]["text"], "a v2")
+        # старый слот остаётся в индексе как tombstone
+        self.assertEqual(self.store.ntotal, 4)
+        self.assertEqual(self.store.keys.deleted().tolist(), [0])
+
+    def test_unchanged_documents_are_skipped(self):
+        self.assertEqual(self.store.changed(["a", "b"], ["a v1", "b changed"]), [1])
+        self.assertEqual(self.store.upsert(["a"], self.vectors[:1], ["a v1"]), 0)
+        self.assertEqual(self.store.ntotal, 3)
+
+    def test_metadata_change_is_a_change(self):
+        self.assertEqual(self.store.changed(["a"], ["a v1"], [{"letter_type": "ucas"}]), [0])
+
+    def test_last_duplicate_in_batch_wins(self):
+        self.store.upsert(["d", "d"], random_vectors(2, seed=1), ["d first", "d last"])
+        hits = self.store.search(random_vectors(2, seed=1)[1], 1, ids=["d"])
+        self.assertEqual([hit["text"] for hit in hits], ["d last"])
+        self.assertEqual(self.store.ntotal, 4)
+
+    def test_delete(self):
+        self.assertEqual(self.store.delete(["a", "missing"]), 1)
+        self.assertEqual(self.store.delete(["a"]), 0)
+        self.assertNotIn("a", [hit["id"] for hit in self.store.search(self.vectors[0], 5)])
+
+    def test_tombstones_survive_reopen(self):
+        self.store.upsert(["a"], self.vectors[:1], ["a v2"])
+        self.store.delete(["b"])
+        reader = self.make_store()
+        hits = reader.search(self.vectors[0], 5)
+        self.assertEqual([(hit["id"], hit["text"]) for hit in hits
+                          if hit["id"] != "c"], [("a", "a v2")])
+        self.assertEqual(sorted(live_ids(reader)), ["a", "c"])
+
+    def test_vectors_by_id_skip_dead_and_unknown(self):
+        self.store.delete(["b"])
+        ids, vectors = self.store.vectors(["a", "b", "zzz"])
+        self.assertEqual(ids, ["a"])
+        np.testing.assert_allclose(vectors, self.vectors[:1])
+
+
+class CompactionTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.store = self.make_store()
+        self.vectors = random_vectors(4)
+        self.store.upsert(["a", "b", "c", "d"], self.vectors, ["a v1", "b", "c", "d"],
+                          [{"country": "UK"}, {"country": "DE"}, {"country": "UK"}, {}])
+        self.store.upsert(["a"], self.vectors[:1], ["a v2"], [{"country": "UK"}])
+        self.store.delete(["b"])
+
+    def assert_contents(self, store):
+        self.assertEqual(live_ids(store), ["c", "d", "a"])
+        hits = store.search(self.vectors[0], 1)
+        self.assertEqual([(hit["id"], hit["text"]) for hit in hits], [("a", "a v2")])
+        hits = store.search(self.vectors[2], 5, filters={"country": "UK"})
+        self.assertEqual(sorted(hit["id"] for hit in hits), ["a", "c"])
+        ids, vectors = store.vectors(["a", "c"])
+        self.assertEqual(ids, ["c", "a"])
+        np.testing.assert_allclose(vectors, self.vectors[[2, 0]])
+
+    def test_compact_drops_tombstones(self):
+        self.assertEqual(self.store.compact(), 2)
+        self.assertEqual(self.store.ntotal, 3)
+        self.assertEqual(len(self.store.docs), 3)
+        self.assertEqual(len(self.store.keys), 3)
+        self.assertEqual(len(self.store.terms), 3)
+        self.assertEqual(self.store.keys.deleted_count(), 0)
+        self.assert_contents(self.store)
+        self.assert_contents(self.make_store())
+        # нечего удалять — ничего и не пишется
+        version = self.store.version
+        self.assertEqual(self.store.compact(), 0)
+        self.assertEqual(self.store.version, version)
+
+    def test_writes_continue_after_compaction(self):
+        self.store.compact()
+        self.store.upsert(["c", "e"], random_vectors(2, seed=1), ["c v2", "e"])
+        self.store.delete(["d"])
+        self.assertEqual(sorted(live_ids(self.make_store())), ["a", "c", "e"])
+        self.assertEqual(self.store.compact(), 2)
+        self.assertEqual(live_ids(self.make_store()), ["a", "c", "e"])
+
+    def test_old_generations_are_removed(self):
+        docs_path = os.path.join(self.root, "index_docs")
+        self.store.compact()
+        # предыдущее поколение остаётся для читателей, только что прочитавших манифест
+        self.assertTrue(os.path.exists(docs_path + ".idx"))
+        self.store.delete(["c"])
+        self.store.compact()
+        self.assertFalse(os.path.exists(docs_path + ".idx"))
+        self.assertTrue(os.path.exists(docs_path + ".g1.idx"))
+        self.assertTrue(os.path.exists(docs_path + ".g2.idx"))
+
+    def test_reader_switches_after_compaction(self):
+        reader = self.make_store(read_only=True)
+        self.assert_contents(reader)
+        self.store.compact()
+        with mock.patch.object(vector_utils, "REFRESH_SECONDS", 0):
+            # пока новая версия не загружена, поиск идёт по старым слотам и таблицам
+            self.assert_contents(reader)
+            deadline = time.monotonic() + 5
+            while reader.ntotal != 3 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(reader.ntotal, 3)
+        self.assert_contents(reader)
+
+    def test_hybrid_search_after_compaction(self):
+        texts = ["a v2"]
+        before = self.store.hybrid_search_batch(self.vectors[:1], texts, 2)[0]
+        self.store.compact()
+        after = self.store.hybrid_search_batch(self.vectors[:1], texts, 2)[0]
+        self.assertEqual([hit["id"] for hit in after], [hit["id"] for hit in before])
+        self.assertEqual(after[0]["text"], "a v2")
+
+    def test_due_snapshot_compacts(self):
+        with mock.patch.object(vector_utils, "SNAPSHOT_MIN_WAL_BYTES", 0), \
+                mock.patch.object(vector_utils, "SNAPSHOT_RATIO", 0):
+            self.store.delete(["c"])
+            self.store.upsert(["e"], random_vectors(1, seed=1), ["e"])
+        # 3 мёртвых слота из 6 — не больше половины: только снимок
+        self.assertEqual(self.store.ntotal, 6)
+        with mock.patch.object(vector_utils, "SNAPSHOT_MIN_WAL_BYTES", 0), \
+                mock.patch.object(vector_utils, "SNAPSHOT_RATIO", 0):
+            self.store.upsert(["d"], random_vectors(1, seed=2), ["d v2"])
+        self.assertEqual(self.store.ntotal, 3)
+        self.assertEqual(sorted(live_ids(self.store)), ["a", "d", "e"])
@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+
+from ..vector_keys import hash64
+from ..vector_wal import WriteAheadLog
+from .helpers import D, StoreTestCase, live_ids, random_vectors
+
+
+class WriteAheadLogTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.wal = WriteAheadLog(os.path.join(self.root, "index.wal"), D)
+        self.batches = [random_vectors(n, seed=n) for n in (2, 3, 4)]
+        self.ends = []
+        first_id = 0
+        for vectors in self.batches:
+            self.wal.append(first_id, vectors)
+            self.ends.append(self.wal.size)
+            first_id += len(vectors)
+
+    def test_replay_returns_every_record(self):
+        records = list(self.wal.replay())
+        self.assertEqual([first_id for first_id, _, _ in records], [0, 2, 5])
+        self.assertEqual([end for _, _, end in records], self.ends)
+        for (_, vectors, _), expected in zip(records, self.batches):
+            np.testing.assert_array_equal(vectors, expected)
+
+    def test_replay_from_offset(self):
+        records = list(self.wal.replay(self.ends[0]))
+        self.assertEqual([first_id for first_id, _, _ in records], [2, 5])
+
+    def test_torn_tail_ends_the_log(self):
+        with open(self.wal.path, "ab") as f:
+            f.truncate(self.ends[-1] - 5)
+        self.assertEqual([first_id for first_id, _, _ in self.wal.replay()], [0, 2])
+
+    def test_corrupt_record_ends_the_log(self):
+        # байт в данных второй записи: CRC не сходится, третья тоже не читается
+        with open(self.wal.path, "r+b") as f:
+            f.seek(self.ends[1] - 1)
+            byte = f.read(1)
+            f.seek(self.ends[1] - 1)
+            f.write(bytes([byte[0] ^ 0xFF]))
+        self.assertEqual([first_id for first_id, _, _ in self.wal.replay()], [0])
+
+    def test_truncate_and_reset(self):
+        self.wal.truncate(self.ends[0])
+        self.assertEqual(self.wal.size, self.ends[0])
+        inode = self.wal.state()[0]
+        self.wal.reset()
+        self.assertEqual(self.wal.size, 0)
+        self.assertNotEqual(self.wal.state()[0], inode)
+        self.assertEqual(list(self.wal.replay()), [])
+
+
+class RecoveryTests(StoreTestCase):
+
+    def test_writer_drops_documents_without_vectors(self):
+        store = self.make_store()
+        store.upsert(["a", "b"], random_vectors(2), ["a", "b"])
+        # процесс упал после записи документов и ключей, но до записи в лог
+        store.docs.append([{"id": "c", "text": "c"}])
+        store.keys.append([hash64("c")], [0])
+        self.assertEqual(len(store.docs), 3)
+
+        reopened = self.make_store()
+        reopened.load(writable=True)
+        self.assertEqual(reopened.ntotal, 2)
+        self.assertEqual(len(reopened.docs), 2)
+        self.assertEqual(len(reopened.keys), 2)
+        self.assertEqual(reopened.upsert(["c"], random_vectors(1, seed=1), ["c"]), 1)
+        self.assertEqual(sorted(live_ids(reopened)), ["a", "b", "c"])
+
+    def test_logged_batches_are_replayed(self):
+        store = self.make_store()
+        store.upsert(["a", "b"], random_vectors(2), ["a", "b"])  # первый снапшот
+        store.upsert(["c", "d"], random_vectors(2, seed=1), ["c", "d"])  # только в логе
+        self.assertGreater(store.wal.size, 0)
+
+        reader = self.make_store()
+        self.assertEqual(reader.ntotal, 4)
+        self.assertEqual(sorted(live_ids(reader)), ["a", "b", "c", "d"])
+
+    def test_corrupt_log_record_is_dropped_with_its_documents(self):
+        store = self.make_store()
+        store.upsert(["a", "b"], random_vectors(2), ["a", "b"])
+        store.upsert(["c", "d"], random_vectors(2, seed=1), ["c", "d"])
+        with open(store.wal.path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"\xff")
+
+        reopened = self.make_store()
+        reopened.load(writable=True)
+        self.assertEqual(reopened.ntotal, 2)
+        self.assertEqual(reopened.wal.size, 0)
+        self.assertEqual(len(reopened.docs), 2)
+        self.assertEqual(len(reopened.keys), 2)
+        self.assertEqual(reopened.changed(["c", "d"], ["c", "d"]), [0, 1])
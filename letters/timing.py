@@ -0,0 +1,175 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import redis
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+
+# Фазы, для которых копятся гистограммы (остальные только сохраняются в строке)
+PHASES = (
+    "s3_read", "s3_write", "db", "summarize", "retrieval", "thread_create", "message_post",
+    "run_queued", "run_in_progress", "message_list", "parse", "total",
+)
+ENDPOINTS = ("analyse", "generate_structure")
+# Границы корзин в секундах
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+METRICS_TTL = None  # без срока жизни: гистограммы накапливаются
+
+# Монотонные счётчики: имя → описание для /metrics
+COUNTERS = {
+    "embedding_cache_hits": "Texts whose embedding was served from the cache",
+    "embedding_cache_misses": "Texts sent to the embeddings API",
+    "embedding_api_calls_saved": "Embeddings API requests avoided thanks to the cache",
+    "embedding_batches": "Micro-batches of query texts sent for embedding",
+    "embedding_batched_texts": "Query texts embedded through micro-batches",
+}
+
+
+class PhaseTimer:
+    """
+    Накапливает длительность именованных фаз одного запроса.
+    Одна фаза может встречаться несколько раз (например, message_post в цикле).
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: Dict[str, float] = defaultdict(float)
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[name] += time.perf_counter() - start
+
+    def add(self, name: str, seconds: float) -> None:
+        self.spans[name] += seconds
+
+    def finish(self) -> Dict[str, float]:
+        self.spans["total"] = time.perf_counter() - self.started
+        return self.as_dict()
+
+    def as_dict(self) -> Dict[str, float]:
+        # миллисекунды — удобнее читать в админке и JSON
+        return {name: round(seconds * 1000, 1) for name, seconds in self.spans.items()}
+
+    def server_timing(self) -> str:
+        return ", ".join(
+            f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.spans.items()
+        )
+
+
+def _key(endpoint: str, phase: str, suffix: str) -> str:
+    return f"timing:{endpoint}:{phase}:{suffix}"
+
+
+def _incr(key: str, delta: int) -> None:
+    cache.add(key, 0, timeout=METRICS_TTL)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.set(key, delta, timeout=METRICS_TTL)
+
+
+_redis: Optional[redis.Redis] = None
+
+
+def _redis_client() -> redis.Redis:
+    # свой клиент к тому же REDIS_URL, что у кэша: внутренности RedisCache не трогаем
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(settings.REDIS_URL)
+    return _redis
+
+
+def _incr_many(deltas: Dict[str, int]) -> None:
+    """
+    Несколько счётчиков сразу: с Redis — один pipeline из INCRBY
+    (целые RedisCache хранит без pickle, поэтому cache.get_many их читает),
+    с другими бэкендами — по ключу.
+    """
+    backend = caches["default"]
+    if isinstance(backend, RedisCache) and settings.REDIS_URL:
+        pipe = _redis_client().pipeline(transaction=False)
+        for key, delta in deltas.items():
+            pipe.incrby(backend.make_and_validate_key(key), delta)
+        pipe.execute()
+        return
+    for key, delta in deltas.items():
+        _incr(key, delta)
+
+
+def _bucket(seconds: float) -> Optional[str]:
+    # корзины храним не накопительно: запрос попадает ровно в одну,
+    # накопительные le считает render_metrics; длиннее последней — только count (+Inf)
+    for bound in BUCKETS:
+        if seconds <= bound:
+            return f"bucket_{bound}"
+    return None
+
+
+def observe(endpoint: str, timer: PhaseTimer) -> None:
+    """
+    Добавляет фазы запроса в гистограммы (общие для воркеров, если кэш — Redis)
+    одним обращением к кэшу: по корзине, count и sum на фазу.
+    """
+    deltas = {}
+    for phase, seconds in timer.spans.items():
+        if phase not in PHASES:
+            continue
+        bucket = _bucket(seconds)
+        if bucket is not None:
+            deltas[_key(endpoint, phase, bucket)] = 1
+        deltas[_key(endpoint, phase, "count")] = 1
+        deltas[_key(endpoint, phase, "sum_us")] = int(seconds * 1_000_000)
+    if deltas:
+        _incr_many(deltas)
+
+
+def incr_counter(name: str, delta: int = 1) -> None:
+    if delta:
+        _incr(f"counter:{name}", delta)
+
+
+def render_metrics() -> str:
+    """
+    Гистограммы в текстовом формате Prometheus.
+    """
+    keys = [
+        _key(endpoint, phase, suffix)
+        for endpoint in ENDPOINTS
+        for phase in PHASES
+        for suffix in [f"bucket_{b}" for b in BUCKETS] + ["count", "sum_us"]
+    ]
+    values = cache.get_many(keys)
+
+    lines = [
+        "# HELP achievka_phase_seconds Duration of request phases",
+        "# TYPE achievka_phase_seconds histogram",
+    ]
+    for endpoint in ENDPOINTS:
+        for phase in PHASES:
+            count = values.get(_key(endpoint, phase, "count"), 0)
+            if not count:
+                continue
+            labels = f'endpoint="{endpoint}",phase="{phase}"'
+            n = 0
+            for bound in BUCKETS:
+                n += values.get(_key(endpoint, phase, f"bucket_{bound}"), 0)
+                lines.append(f'achievka_phase_seconds_bucket{{{labels},le="{bound}"}} {n}')
+            lines.append(f'achievka_phase_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            total = values.get(_key(endpoint, phase, "sum_us"), 0) / 1_000_000
+            lines.append(f"achievka_phase_seconds_sum{{{labels}}} {total}")
+            lines.append(f"achievka_phase_seconds_count{{{labels}}} {count}")
+
+    counters = cache.get_many([f"counter:{name}" for name in COUNTERS])
+    for name, description in COUNTERS.items():
+        lines.append(f"# HELP achievka_{name}_total {description}")
+        lines.append(f"# TYPE achievka_{name}_total counter")
+        lines.append(f"achievka_{name}_total {counters.get(f'counter:{name}', 0)}")
+    return "\n".join(lines) + "\n"
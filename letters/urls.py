@@ -1,7 +1,7 @@
 # letters/urls.py
 
 from django.urls import path
-from .views import LetterViewSet
+from .views import LetterViewSet, metrics
 
 app_name = 'letters'
 
@@ -39,4 +39,5 @@ urlpatterns = [
         }),
         name='letter-analyse'
     ),
+    path('metrics/', metrics, name='metrics'),
 ]
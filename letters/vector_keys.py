@@ -0,0 +1,229 @@
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+# one record per vector slot: hash of the caller's document id, hash of its text
+KEY_DTYPE = np.dtype([("key", "<u8"), ("content", "<u8")])
+
+# document attributes that retrieval can filter on
+METADATA_FIELDS = ("letter_type", "country", "university_id", "language")
+
+
+def hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class KeyTable:
+    """
+    Maps vector slots to caller document ids, plus tombstones for slots that
+    were replaced or deleted.
+
+    <path>.keys    — KEY_DTYPE record per slot, appended together with the docstore
+    <path>.deleted — uint64 slot numbers, append-only
+
+    Slots are never reused or removed from the index in place: HNSW cannot
+    remove vectors and a memory-mapped index cannot be modified, so deleted
+    slots are filtered out at search time instead, until VectorStore.compact()
+    rewrites the live ones into new tables.
+    """
+
+    def __init__(self, path: str):
+        self.keys_path = path + ".keys"
+        self.deleted_path = path + ".deleted"
+
+    def __len__(self) -> int:
+        if not os.path.exists(self.keys_path):
+            return 0
+        return os.path.getsize(self.keys_path) // KEY_DTYPE.itemsize
+
+    def records(self) -> np.ndarray:
+        if not len(self):
+            return np.zeros(0, dtype=KEY_DTYPE)
+        return np.fromfile(self.keys_path, dtype=KEY_DTYPE, count=len(self))
+
+    def deleted(self) -> np.ndarray:
+        if not os.path.exists(self.deleted_path):
+            return np.zeros(0, dtype="<u8")
+        return np.fromfile(self.deleted_path, dtype="<u8", count=self.deleted_count())
+
+    def deleted_count(self) -> int:
+        if not os.path.exists(self.deleted_path):
+            return 0
+        return os.path.getsize(self.deleted_path) // 8
+
+    def append(self, keys: Iterable[int], contents: Iterable[int]):
+        records = np.array(list(zip(keys, contents)), dtype=KEY_DTYPE)
+        self._append(self.keys_path, records.tobytes(), len(self) * KEY_DTYPE.itemsize)
+
+    def delete(self, slots: Iterable[int]):
+        slots = np.array(list(slots), dtype="<u8")
+        if len(slots):
+            size = os.path.getsize(self.deleted_path) if os.path.exists(self.deleted_path) else 0
+            self._append(self.deleted_path, slots.tobytes(), size - size % 8)
+
+    def truncate(self, count: int):
+        """Drops records for slots >= count (used when recovering from a crash)."""
+        if len(self) > count or os.path.exists(self.keys_path) and \
+                os.path.getsize(self.keys_path) % KEY_DTYPE.itemsize:
+            with open(self.keys_path, "ab") as f:
+                f.truncate(min(len(self), count) * KEY_DTYPE.itemsize)
+
+    @staticmethod
+    def _append(path: str, data: bytes, valid_size: int):
+        with open(path, "ab") as f:
+            # a torn record from a crashed writer is overwritten
+            f.truncate(valid_size)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class AttributeTable:
+    """
+    Filterable document attributes, one row of codes per vector slot.
+
+    <path>.attrs      — int32 (slots, len(METADATA_FIELDS)); 0 means "not set"
+    <path>.vocab.json — per field, value -> code
+
+    Rows are fixed-size so a filter becomes a vectorised comparison over the
+    whole column instead of a scan over the documents.
+    """
+
+    def __init__(self, path: str):
+        self.attrs_path = path + ".attrs"
+        self.vocab_path = path + ".vocab.json"
+        self._row_bytes = 4 * len(METADATA_FIELDS)
+        self._vocab = None
+
+    def __len__(self) -> int:
+        if not os.path.exists(self.attrs_path):
+            return 0
+        return os.path.getsize(self.attrs_path) // self._row_bytes
+
+    @property
+    def vocab(self) -> Dict[str, Dict[str, int]]:
+        if self._vocab is None:
+            self._vocab = {f: {} for f in METADATA_FIELDS}
+            if os.path.exists(self.vocab_path):
+                with open(self.vocab_path) as f:
+                    self._vocab.update(json.load(f))
+        return self._vocab
+
+    def reload(self):
+        self._vocab = None
+
+    def rows(self, count: Optional[int] = None) -> np.ndarray:
+        count = len(self) if count is None else min(count, len(self))
+        if not count:
+            return np.zeros((0, len(METADATA_FIELDS)), dtype="<i4")
+        return np.fromfile(self.attrs_path, dtype="<i4",
+                           count=count * len(METADATA_FIELDS)).reshape(count, -1)
+
+    def append(self, metadata: List[Dict[str, str]], first_slot: int):
+        vocab = self.vocab
+        added = False
+        rows = np.zeros((len(metadata), len(METADATA_FIELDS)), dtype="<i4")
+        for i, meta in enumerate(metadata):
+            for j, field in enumerate(METADATA_FIELDS):
+                value = meta.get(field)
+                if value in (None, ""):
+                    continue
+                value = str(value)
+                if value not in vocab[field]:
+                    vocab[field][value] = len(vocab[field]) + 1
+                    added = True
+                rows[i, j] = vocab[field][value]
+        if added:
+            # the vocabulary goes first: a code on disk always has a name
+            self._save_vocab()
+
+        # slots written before attributes existed have none
+        count = len(self)
+        padding = np.zeros((max(0, first_slot - count), len(METADATA_FIELDS)), dtype="<i4")
+        KeyTable._append(self.attrs_path, padding.tobytes() + rows.tobytes(),
+                         min(count, first_slot) * self._row_bytes)
+
+    def append_rows(self, rows: np.ndarray, first_slot: int, vocab: Dict[str, Dict[str, int]]):
+        """Appends rows already coded with vocab, which this table takes over (compaction)."""
+        if vocab != self.vocab:
+            self._vocab = {field: dict(codes) for field, codes in vocab.items()}
+            self._save_vocab()
+        KeyTable._append(self.attrs_path, np.ascontiguousarray(rows, dtype="<i4").tobytes(),
+                         first_slot * self._row_bytes)
+
+    def _save_vocab(self):
+        tmp_path = self.vocab_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._vocab, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.vocab_path)
+
+    def mask(self, filters: Dict[str, str], count: int) -> np.ndarray:
+        """Slots among the first count whose attributes match every filter."""
+        rows = self.rows(count)
+        mask = np.zeros(count, dtype=bool)
+        matches = np.ones(len(rows), dtype=bool)
+        for field, value in filters.items():
+            if field not in METADATA_FIELDS:
+                raise ValueError(f"Unknown filter {field!r}, expected one of {METADATA_FIELDS}")
+            code = self.vocab[field].get(str(value))
+            if code is None:
+                return mask
+            matches &= rows[:, METADATA_FIELDS.index(field)] == code
+        mask[:len(rows)] = matches
+        return mask
+
+    def truncate(self, count: int):
+        """Drops rows for slots >= count (used when recovering from a crash)."""
+        if os.path.exists(self.attrs_path) and os.path.getsize(self.attrs_path) > count * self._row_bytes:
+            with open(self.attrs_path, "ab") as f:
+                f.truncate(count * self._row_bytes)
+
+
+class VectorTable:
+    """
+    Full-precision float32 vectors, one row per slot (<path>.f32).
+
+    Compressed indexes (sq8, fp16, pq) lose precision; candidates they return
+    are re-ranked against these rows. The file is memory-mapped, so only the
+    rows of the candidates are read. Stores created before this table existed
+    have no rows for old slots: append() then does nothing and re-ranking
+    stays off until `manage.py build_faiss_index` backfills it.
+    """
+
+    def __init__(self, path: str, d: int):
+        self.path = path + ".f32"
+        self.d = d
+        self._row_bytes = 4 * d
+        self._rows = None
+
+    def __len__(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        return os.path.getsize(self.path) // self._row_bytes
+
+    def append(self, vectors: np.ndarray, first_slot: int) -> bool:
+        if len(self) != first_slot:
+            return False
+        vectors = np.ascontiguousarray(vectors, dtype="<f4")
+        KeyTable._append(self.path, vectors.tobytes(), first_slot * self._row_bytes)
+        return True
+
+    def get(self, slots: np.ndarray) -> np.ndarray:
+        rows = self._rows
+        needed = int(slots.max()) + 1 if len(slots) else 0
+        if rows is None or len(rows) < needed:
+            rows = self._rows = np.memmap(self.path, dtype="<f4", mode="r",
+                                          shape=(len(self), self.d))
+        return np.asarray(rows[slots])
+
+    def truncate(self, count: int):
+        """Drops rows for slots >= count (used when recovering from a crash)."""
+        if os.path.exists(self.path) and os.path.getsize(self.path) > count * self._row_bytes:
+            with open(self.path, "ab") as f:
+                f.truncate(count * self._row_bytes)
+        self._rows = None
@@ -0,0 +1,250 @@
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# frame: u32 body length | body
+# body:  u8 opcode (request) or status (response) | u32 json length | json | float32 rows
+_LENGTH = struct.Struct("<I")
+_BODY = struct.Struct("<BI")
+
+(OP_SEARCH, OP_CHANGED, OP_UPSERT, OP_DELETE, OP_PING, OP_HYBRID, OP_EMBED, OP_SCAN,
+ OP_VECTORS) = range(1, 10)
+STATUS_OK, STATUS_ERROR = 0, 1
+
+
+class VectorServerError(Exception):
+    pass
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray(size)
+    view = memoryview(buf)
+    while size:
+        n = sock.recv_into(view, size)
+        if not n:
+            raise ConnectionError("Connection closed")
+        view = view[n:]
+        size -= n
+    return bytes(buf)
+
+
+def write_frame(sock: socket.socket, code: int, meta: Dict,
+                vectors: Optional[np.ndarray] = None) -> None:
+    meta_bytes = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+    payload = b"" if vectors is None else np.ascontiguousarray(vectors, dtype="<f4").tobytes()
+    body_length = _BODY.size + len(meta_bytes) + len(payload)
+    sock.sendall(_LENGTH.pack(body_length) + _BODY.pack(code, len(meta_bytes)) + meta_bytes + payload)
+
+
+def read_frame(sock: socket.socket) -> Tuple[int, Dict, bytes]:
+    (body_length,) = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+    body = _recv_exact(sock, body_length)
+    code, meta_length = _BODY.unpack_from(body)
+    meta_end = _BODY.size + meta_length
+    return code, json.loads(body[_BODY.size:meta_end]), body[meta_end:]
+
+
+def _vectors(meta: Dict, payload: bytes) -> np.ndarray:
+    return np.frombuffer(payload, dtype="<f4").reshape(meta["n"], meta["d"])
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        # one connection serves many requests: clients keep it open
+        while True:
+            try:
+                op, meta, payload = read_frame(self.request)
+            except (ConnectionError, struct.error):
+                return
+            vectors = None
+            try:
+                result, status = self.server.dispatch(op, meta, payload), STATUS_OK
+                if isinstance(result, tuple):
+                    result, vectors = result
+            except Exception as e:
+                logging.exception("Vector server request %s failed", op)
+                result, status = {"error": f"{type(e).__name__}: {e}"}, STATUS_ERROR
+            try:
+                write_frame(self.request, status, result, vectors)
+            except OSError:
+                return
+
+
+class VectorServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Owns one (partitioned) vector store per host and serves it to all workers
+    over a Unix socket, so upserts from any worker are visible to every search.
+    Requests need no lock here: searches read an immutable view of the store
+    and writers serialise inside it. Other indexes (stores, by name) are
+    served the same way to clients created with that name.
+
+    With embed (e.g. EmbeddingBatcher.embed_many), it also embeds query texts
+    for the workers, so concurrent queries from all of them share API calls.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, store,
+                 embed: Optional[Callable[[List[str]], np.ndarray]] = None,
+                 stores: Optional[Dict[str, object]] = None):
+        self.store = store
+        self.stores = dict(stores or {})
+        self.embed = embed
+        if os.path.exists(socket_path):
+            os.remove(socket_path)  # left over from a previous run
+        super().__init__(socket_path, _Handler)
+        os.chmod(socket_path, 0o660)
+
+    def _store(self, name: Optional[str]):
+        if name is None:
+            return self.store
+        if name not in self.stores:
+            raise ValueError(f"Unknown store {name!r}")
+        return self.stores[name]
+
+    def dispatch(self, op: int, meta: Dict, payload: bytes):
+        store = self._store(meta.get("store"))
+        if op == OP_SEARCH:
+            return {"hits": store.search_batch(
+                _vectors(meta, payload), meta["k"], meta.get("ef_search"),
+                meta.get("nprobe"), meta.get("filters"), meta.get("ids"),
+                meta.get("min_similarity"),
+            )}
+        if op == OP_HYBRID:
+            return {"hits": store.hybrid_search_batch(
+                _vectors(meta, payload), meta["texts"], meta["k"], meta.get("ef_search"),
+                meta.get("nprobe"), meta.get("filters"), meta.get("rerank", False),
+            )}
+        if op == OP_CHANGED:
+            return {"positions": store.changed(meta["ids"], meta["texts"], meta.get("metadata"))}
+        if op == OP_UPSERT:
+            return {"written": store.upsert(
+                meta["ids"], _vectors(meta, payload), meta["texts"], meta.get("metadata"),
+            )}
+        if op == OP_DELETE:
+            return {"deleted": store.delete(meta["ids"])}
+        if op == OP_SCAN:
+            docs, vectors, cursor = store.scan(meta.get("cursor"), meta.get("limit", 1000))
+            return {"docs": docs, "cursor": cursor, "n": len(vectors), "d": vectors.shape[1]}, vectors
+        if op == OP_VECTORS:
+            ids, vectors = store.vectors(meta["ids"])
+            return {"ids": ids, "n": len(vectors), "d": vectors.shape[1]}, vectors
+        if op == OP_EMBED:
+            if self.embed is None:
+                raise ValueError("This server does not embed texts")
+            vectors = np.asarray(self.embed(meta["texts"]), dtype="float32")
+            return {"n": vectors.shape[0], "d": vectors.shape[1]}, vectors
+        if op == OP_PING:
+            return {"pid": os.getpid()}
+        raise ValueError(f"Unknown opcode {op}")
+
+
+class VectorClient:
+    """
+    Same interface as PartitionedVectorStore (search_batch,
+    hybrid_search_batch, changed, upsert, delete, scan), plus vectors for
+    named VectorStores, backed by a VectorServer.
+    Each thread keeps its own connection and reconnects once if the server
+    restarted; every operation is idempotent, so a retry is safe. With store,
+    requests go to that named store of the server instead of the default one.
+    """
+
+    def __init__(self, socket_path: str, timeout: float = 30.0, store: Optional[str] = None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.store = store
+        self._local = threading.local()
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def _call(self, op: int, meta: Dict, vectors: Optional[np.ndarray] = None) -> Dict:
+        return self._request(op, meta, vectors)[0]
+
+    def _request(self, op: int, meta: Dict,
+                 vectors: Optional[np.ndarray] = None) -> Tuple[Dict, bytes]:
+        if vectors is not None:
+            vectors = np.asarray(vectors, dtype="float32")
+            vectors = vectors.reshape(-1, vectors.shape[-1])
+            meta = dict(meta, n=vectors.shape[0], d=vectors.shape[1])
+        if self.store is not None:
+            meta = dict(meta, store=self.store)
+        for attempt in (1, 2):
+            try:
+                sock = self._connection()
+                write_frame(sock, op, meta, vectors)
+                status, result, payload = read_frame(sock)
+                break
+            except (OSError, ConnectionError):
+                self.close()
+                if attempt == 2:
+                    raise
+        if status != STATUS_OK:
+            raise VectorServerError(result.get("error", "unknown error"))
+        return result, payload
+
+    def search_batch(self, queries: np.ndarray, k: int,
+                     ef_search: Optional[int] = None,
+                     nprobe: Optional[int] = None,
+                     filters: Optional[Dict[str, str]] = None,
+                     ids: Optional[List[str]] = None,
+                     min_similarity: Optional[float] = None) -> List[List[Dict]]:
+        meta = {"k": k, "ef_search": ef_search, "nprobe": nprobe, "filters": filters,
+                "ids": None if ids is None else [str(i) for i in ids],
+                "min_similarity": min_similarity}
+        return self._call(OP_SEARCH, meta, queries)["hits"]
+
+    def hybrid_search_batch(self, queries: np.ndarray, texts: List[str], k: int,
+                            ef_search: Optional[int] = None,
+                            nprobe: Optional[int] = None,
+                            filters: Optional[Dict[str, str]] = None,
+                            rerank: bool = False) -> List[List[Dict]]:
+        meta = {"texts": texts, "k": k, "ef_search": ef_search, "nprobe": nprobe,
+                "filters": filters, "rerank": rerank}
+        return self._call(OP_HYBRID, meta, queries)["hits"]
+
+    def changed(self, ids: List[str], texts: List[str],
+                metadata: Optional[List[Dict[str, str]]] = None) -> List[int]:
+        return self._call(OP_CHANGED, {"ids": ids, "texts": texts, "metadata": metadata})["positions"]
+
+    def upsert(self, ids: List[str], vectors: np.ndarray, texts: List[str],
+               metadata: Optional[List[Dict[str, str]]] = None) -> int:
+        meta = {"ids": ids, "texts": texts, "metadata": metadata}
+        return self._call(OP_UPSERT, meta, vectors)["written"]
+
+    def delete(self, ids: List[str]) -> int:
+        return self._call(OP_DELETE, {"ids": list(ids)})["deleted"]
+
+    def scan(self, cursor=None, limit: int = 1000) -> Tuple[List[Dict], np.ndarray, object]:
+        result, payload = self._request(OP_SCAN, {"cursor": cursor, "limit": limit})
+        return result["docs"], _vectors(result, payload), result["cursor"]
+
+    def vectors(self, ids: List[str]) -> Tuple[List[str], np.ndarray]:
+        result, payload = self._request(OP_VECTORS, {"ids": [str(i) for i in ids]})
+        return result["ids"], _vectors(result, payload)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        result, payload = self._request(OP_EMBED, {"texts": list(texts)})
+        return _vectors(result, payload)
+
+    def ping(self) -> Dict:
+        return self._call(OP_PING, {})
@@ -0,0 +1,169 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .vector_keys import hash64
+
+
+class ShardedVectorStore:
+    """
+    Spreads documents over shards, each a store of its own (in production a
+    VectorClient of a vector server process, on this host or another), so
+    the corpus is not limited by one host's memory.
+
+    A document lives on the shard with the highest hash64(shard name, id)
+    (rendezvous hashing): adding a shard moves only the ~1/N of documents the
+    new shard wins, and every coordinator with the same shard names agrees
+    on placement without shared state. Writes go to the owner; searches go to
+    every shard in parallel and the per-shard top-k lists are merged.
+
+    After shards are added or removed, rebalance() moves documents that are
+    now on the wrong shard, vectors included. Until then they are still
+    found, since searches ask every shard.
+    """
+
+    def __init__(self, shards: Sequence, names: Optional[Sequence[str]] = None):
+        if not shards:
+            raise ValueError("At least one shard is needed")
+        self.shards = list(shards)
+        self.names = [str(n) for n in names] if names is not None else [
+            getattr(shard, "socket_path", None) or str(i) for i, shard in enumerate(self.shards)
+        ]
+        if len(set(self.names)) != len(self.names):
+            raise ValueError(f"Shard names must be unique: {self.names}")
+        self._lock = threading.Lock()
+        self._pid = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def _executor(self) -> ThreadPoolExecutor:
+        # threads do not survive a fork: each process gets its own pool
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(len(self.shards),
+                                                    thread_name_prefix="vector-shard")
+                    self._pid = os.getpid()
+        return self._pool
+
+    def _map(self, fn: Callable, items: Sequence) -> List:
+        """fn(item) for each item in parallel (one per shard at most); results in order."""
+        if len(items) == 1:
+            return [fn(items[0])]
+        futures = [self._executor().submit(fn, item) for item in items]
+        return [future.result() for future in futures]
+
+    def _scatter(self, call: Callable, shards: Optional[Sequence[int]] = None) -> List:
+        """call(shard) on each of shards (all by default) in parallel."""
+        shards = range(len(self.shards)) if shards is None else shards
+        return self._map(lambda i: call(self.shards[i]), list(shards))
+
+    def owner(self, doc_id: str) -> int:
+        return max(range(len(self.names)), key=lambda i: hash64(f"{self.names[i]}\0{doc_id}"))
+
+    def _group(self, ids: List[str]) -> Dict[int, List[int]]:
+        groups: Dict[int, List[int]] = {}
+        for i, doc_id in enumerate(ids):
+            groups.setdefault(self.owner(doc_id), []).append(i)
+        return groups
+
+    def changed(self, ids: List[str], texts: List[str],
+                metadata: Optional[List[Dict[str, str]]] = None) -> List[int]:
+        metadata = metadata or [{}] * len(ids)
+        groups = list(self._group(ids).items())
+        results = self._map(lambda item: self.shards[item[0]].changed(
+            [ids[i] for i in item[1]], [texts[i] for i in item[1]], [metadata[i] for i in item[1]],
+        ), groups) if groups else []
+        return sorted(group[i] for (_, group), local in zip(groups, results) for i in local)
+
+    def upsert(self, ids: List[str], vectors: np.ndarray, texts: List[str],
+               metadata: Optional[List[Dict[str, str]]] = None) -> int:
+        """
+        Writes each document to its owner and deletes it from the other
+        shards, so an id has one copy even while a rebalance is pending.
+        """
+        vectors = np.asarray(vectors, dtype="float32")
+        metadata = metadata or [{}] * len(ids)
+        written = 0
+        for owner, group in self._group(ids).items():
+            group_ids = [ids[i] for i in group]
+            others = [i for i in range(len(self.shards)) if i != owner]
+            written += self.shards[owner].upsert(
+                group_ids, vectors[group], [texts[i] for i in group], [metadata[i] for i in group]
+            )
+            if others:
+                self._scatter(lambda shard: shard.delete(group_ids), others)
+        return written
+
+    def delete(self, ids: List[str]) -> int:
+        ids = list(ids)
+        return sum(self._scatter(lambda shard: shard.delete(ids)))
+
+    @staticmethod
+    def _merge(rows: List[List[List[Dict]]], k: int, key: Callable) -> List[List[Dict]]:
+        merged = []
+        for hits in zip(*rows):
+            seen, row = set(), []
+            for hit in sorted((hit for shard_hits in hits for hit in shard_hits), key=key):
+                if hit["id"] not in seen:
+                    seen.add(hit["id"])
+                    row.append(hit)
+                    if len(row) == k:
+                        break
+            merged.append(row)
+        return merged
+
+    def search_batch(self, queries: np.ndarray, k: int,
+                     ef_search: Optional[int] = None,
+                     nprobe: Optional[int] = None,
+                     filters: Optional[Dict[str, str]] = None,
+                     ids: Optional[List[str]] = None,
+                     min_similarity: Optional[float] = None) -> List[List[Dict]]:
+        rows = self._scatter(lambda shard: shard.search_batch(
+            queries, k, ef_search, nprobe, filters, ids, min_similarity))
+        return self._merge(rows, k, key=lambda hit: hit["distance"])
+
+    def hybrid_search_batch(self, queries: np.ndarray, texts: List[str], k: int,
+                            ef_search: Optional[int] = None,
+                            nprobe: Optional[int] = None,
+                            filters: Optional[Dict[str, str]] = None,
+                            rerank: bool = False) -> List[List[Dict]]:
+        """Fused scores are per shard ranks, so hits merge by score as partitions do."""
+        rows = self._scatter(lambda shard: shard.hybrid_search_batch(
+            queries, texts, k, ef_search, nprobe, filters, rerank))
+        return self._merge(rows, k, key=lambda hit: -hit["score"])
+
+    def rebalance(self, batch_size: int = 1000,
+                  report: Optional[Callable[[Dict], None]] = None) -> Dict[str, int]:
+        """
+        Moves every document that is not on its owner shard there, with its
+        stored vector (nothing is embedded again), then deletes the old copy.
+        Safe to interrupt and run again. A document updated on its owner
+        while its old copy is being moved can be overwritten by that copy,
+        so run it with ingestion paused.
+        """
+        stats = {"scanned": 0, "moved": 0}
+        for source, shard in enumerate(self.shards):
+            cursor = None
+            while True:
+                docs, vectors, cursor = shard.scan(cursor, batch_size)
+                stats["scanned"] += len(docs)
+                moving: Dict[int, List[int]] = {}
+                for i, doc in enumerate(docs):
+                    owner = self.owner(doc["id"])
+                    if owner != source:
+                        moving.setdefault(owner, []).append(i)
+                for owner, group in moving.items():
+                    self.shards[owner].upsert(
+                        [docs[i]["id"] for i in group], vectors[group],
+                        [docs[i]["text"] for i in group], [docs[i]["metadata"] for i in group],
+                    )
+                    shard.delete([docs[i]["id"] for i in group])
+                    stats["moved"] += len(group)
+                if report is not None and (moving or cursor is None):
+                    report(dict(stats, shard=self.names[source]))
+                if cursor is None:
+                    break
+        return stats
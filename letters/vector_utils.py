@@ -1,58 +1,1379 @@
-
+import fcntl
+import json
+import logging
 import os
+import re
+import threading
+import time
 import openai
-import pickle
 import faiss
 import numpy as np
-from typing import List, Tuple
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Callable, Dict, List, Optional, Tuple
+
+from . import bm25
+from .docstore import DocStore
+from .embedding_batcher import EmbeddingBatcher
+from .embedding_cache import EmbeddingCache
+from .timing import incr_counter
+from .vector_server import VectorClient
+from .vector_shards import ShardedVectorStore
+from .vector_keys import AttributeTable, KeyTable, VectorTable, hash64
+from .vector_wal import WriteAheadLog
 
 # OpenAI API Key
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
-# FAISS index and metadata paths
+# FAISS index and document store paths
 dim = 1536
 INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "./faiss_index.bin")
+DOCSTORE_PATH = os.getenv("FAISS_DOCSTORE_PATH", "./faiss_docs")
+# One sub-index per letter type; documents without a type stay in the paths above
+PARTITIONS_DIR = os.getenv("FAISS_PARTITIONS_DIR", "./faiss_partitions")
+PARTITION_FIELD = "letter_type"
+# Rewrite the snapshot once the log outgrows this fraction of it: snapshots grow
+# geometrically, so total bytes written stay linear in the corpus size
+SNAPSHOT_RATIO = float(os.getenv("FAISS_SNAPSHOT_RATIO", 1.0))
+SNAPSHOT_MIN_WAL_BYTES = int(os.getenv("FAISS_SNAPSHOT_MIN_WAL_BYTES", 64 * 1024 * 1024))
+# A snapshot that is due compacts the store instead once more than this share
+# of its slots are tombstones (1 never compacts on its own, see
+# `manage.py compact_faiss_index`); compactions too cost linear time overall
+COMPACT_RATIO = float(os.getenv("FAISS_COMPACT_RATIO", 0.5))
+# How often a reading process checks whether the writer published a new
+# snapshot version, logged batches or deleted documents
+REFRESH_SECONDS = float(os.getenv("FAISS_REFRESH_SECONDS", 1.0))
+# Unix socket of `manage.py run_vector_server`; when set, workers search and
+# upsert through it instead of loading their own copy of the index
+SERVER_SOCKET = os.getenv("FAISS_SERVER_SOCKET", "")
+# Comma-separated sockets of shard servers (`manage.py run_vector_shards`);
+# when set, documents are spread over them and searches fan out to all.
+# The socket paths name the shards: renaming one moves its documents
+SHARD_SOCKETS = [s for s in os.getenv("FAISS_SHARD_SOCKETS", "").split(",") if s]
+# Legacy pickled id_to_text list, only read by `manage.py convert_faiss_metadata`
 META_PATH = os.getenv("FAISS_METADATA_PATH", "./faiss_metadata.pkl")
 
-# Load or initialize FAISS index and metadata
-if os.path.exists(INDEX_PATH) and os.path.exists(META_PATH):
-    index = faiss.read_index(INDEX_PATH)
-    with open(META_PATH, "rb") as f:
-        id_to_text = pickle.load(f)
-else:
-    index = faiss.IndexFlatL2(dim)
-    id_to_text = []
+# Embeddings: the API accepts up to 2048 inputs per request
+EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-ada-002")
+EMBEDDING_BATCH_SIZE = 2048
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache")
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 100_000))  # ~600 MB at dim 1536
+# Query texts embedded concurrently are sent as one request: a batch waits at
+# most this long for more texts, and holds at most this many
+EMBEDDING_MICROBATCH_WAIT_MS = float(os.getenv("EMBEDDING_MICROBATCH_WAIT_MS", 5))
+EMBEDDING_MICROBATCH_SIZE = int(os.getenv("EMBEDDING_MICROBATCH_SIZE", 256))
+
+# Index type: flat (exact scan), hnsw, ivf_flat, ivf_pq, or a compressed
+# exhaustive scan: sq8 (1 byte/dim), fp16 (2 bytes/dim), pq (PQ_M bytes/vector)
+INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+HNSW_M = int(os.getenv("FAISS_HNSW_M", 32))
+HNSW_EF_CONSTRUCTION = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", 200))
+HNSW_EF_SEARCH = int(os.getenv("FAISS_HNSW_EF_SEARCH", 64))
+IVF_NLIST = int(os.getenv("FAISS_IVF_NLIST", 1024))
+IVF_NPROBE = int(os.getenv("FAISS_IVF_NPROBE", 16))
+PQ_M = int(os.getenv("FAISS_PQ_M", 64))  # 1536 / 64 = 24 dims per sub-quantizer
+PQ_NBITS = int(os.getenv("FAISS_PQ_NBITS", 8))
+# Memory-map the index on read so workers on one host share page-cache pages
+USE_MMAP = os.getenv("FAISS_MMAP", "1") == "1"
+# Keep full float32 vectors on disk next to the docstore (disk only, not RAM)
+RAW_VECTORS = os.getenv("FAISS_RAW_VECTORS", "1") == "1"
+# Fetch k * factor candidates and re-rank them exactly against the raw vectors;
+# 0 or 1 disables. Worth it for sq8/pq, pointless for flat
+RERANK_FACTOR = int(os.getenv("FAISS_RERANK_FACTOR", 0))
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq", "sq8", "fp16", "pq")
+
+# cosine: vectors are L2-normalized on ingest and query, so the L2 distance
+# ranks like cosine similarity (distance = 2 - 2 * similarity) and hits carry
+# "similarity"; l2: vectors are indexed as given. The metric is recorded in
+# the snapshot manifest. Unset, a store keeps the metric it was written with
+# (l2 for snapshots from before it was recorded) and new stores are cosine;
+# set, a store written with another metric is not opened:
+# `manage.py build_faiss_index` converts it
+METRIC = os.getenv("FAISS_METRIC") or None
+METRICS = ("cosine", "l2")
+NEW_STORE_METRIC = "cosine"
+
+# Exhaustive search switches from a per-query SIMD scan to one BLAS matrix
+# product once n * d reaches this threshold. The faiss default (128000) only
+# kicks in at ~84 queries for dim 1536; the scan re-reads the whole index per
+# query, so batches of 4+ are already faster with BLAS
+BLAS_MIN_QUERIES = int(os.getenv("FAISS_BLAS_MIN_QUERIES", 4))
+faiss.cvar.distance_compute_blas_threshold = BLAS_MIN_QUERIES * dim
+
+# Hybrid search: term frequencies are kept next to the docstore (<docs>.terms)
+# for a BM25 index, built in memory on the first hybrid query
+LEXICAL_INDEX = os.getenv("FAISS_LEXICAL_INDEX", "1") == "1"
+# Candidates taken from each of the vector and BM25 lists before fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", 50))
+# Reciprocal rank fusion: a hit at rank r in a list scores 1 / (RRF_K + r)
+RRF_K = 60
+# The optional rerank re-scores the top k * depth fused hits
+HYBRID_RERANK_DEPTH = 4
+
+
+# Build an empty index of the given type
+def build_index(index_type: str = INDEX_TYPE, d: int = dim) -> faiss.Index:
+    if index_type == "flat":
+        return faiss.IndexFlatL2(d)
+    if index_type == "hnsw":
+        idx = faiss.IndexHNSWFlat(d, HNSW_M)
+        idx.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        idx.hnsw.efSearch = HNSW_EF_SEARCH
+        return idx
+    if index_type == "ivf_flat":
+        idx = faiss.IndexIVFFlat(faiss.IndexFlatL2(d), d, IVF_NLIST)
+        idx.nprobe = IVF_NPROBE
+        return idx
+    if index_type == "ivf_pq":
+        idx = faiss.IndexIVFPQ(faiss.IndexFlatL2(d), d, IVF_NLIST, PQ_M, PQ_NBITS)
+        idx.nprobe = IVF_NPROBE
+        return idx
+    if index_type == "sq8":
+        return faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit)
+    if index_type == "fp16":
+        return faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_fp16)
+    if index_type == "pq":
+        # a single inverted list: same exhaustive PQ scan as IndexPQ, but it
+        # accepts search params, so tombstones and filters work
+        idx = faiss.IndexIVFPQ(faiss.IndexFlatL2(d), d, 1, PQ_M, PQ_NBITS)
+        idx.nprobe = 1
+        return idx
+    raise ValueError(f"Unknown FAISS index type {index_type!r}, expected one of {INDEX_TYPES}")
+
+
+# Float32 copy of vectors scaled to unit L2 norm, all rows in one call (zero rows stay zero)
+def normalized(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.array(vectors, dtype='float32', order='C')
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+# Cosine similarity of unit vectors from their squared L2 distance, and back
+def similarity(distance: float) -> float:
+    return 1.0 - distance / 2.0
+
+
+def max_distance(min_similarity: float) -> float:
+    return 2.0 * (1.0 - min_similarity)
+
+
+# Minimum number of vectors an untrained index needs for train()
+def min_training_size(idx: faiss.Index) -> int:
+    if idx.is_trained:
+        return 0
+    ivf = faiss.try_extract_index_ivf(idx)
+    size = ivf.nlist if ivf is not None else 1
+    if isinstance(ivf, faiss.IndexIVFPQ):
+        size = max(size, 2 ** ivf.pq.nbits)
+    return size
+
+
+# Train IVF variants; no-op for flat and HNSW
+def train_index(idx: faiss.Index, vectors: np.ndarray):
+    if idx.is_trained:
+        return
+    needed = min_training_size(idx)
+    if len(vectors) < needed:
+        raise ValueError(
+            f"Index needs at least {needed} vectors to train, got {len(vectors)}. "
+            "Ingest into a flat index first and convert it with "
+            "`manage.py build_faiss_index`."
+        )
+    idx.train(np.ascontiguousarray(vectors, dtype='float32'))
+
+
+# Per-call search parameters (thread-safe, unlike setting idx.nprobe).
+# Unset fields fall back to the index's own settings, not to faiss defaults.
+def search_params(idx: faiss.Index, ef_search: Optional[int] = None,
+                  nprobe: Optional[int] = None,
+                  sel: Optional[faiss.IDSelector] = None) -> Optional[faiss.SearchParameters]:
+    extra = {"sel": sel} if sel is not None else {}
+    if isinstance(idx, faiss.IndexHNSW):
+        if ef_search is None and not extra:
+            return None
+        return faiss.SearchParametersHNSW(efSearch=ef_search or idx.hnsw.efSearch, **extra)
+    ivf = faiss.try_extract_index_ivf(idx)
+    if ivf is not None:
+        if nprobe is None and not extra:
+            return None
+        return faiss.SearchParametersIVF(nprobe=nprobe or ivf.nprobe, **extra)
+    return faiss.SearchParameters(**extra) if extra else None
+
+
+# Selector that skips the given ids; the inner selector is returned too,
+# faiss keeps only a raw pointer to it
+def exclude_selector(ids: np.ndarray):
+    if not len(ids):
+        return None
+    batch = faiss.IDSelectorBatch(np.ascontiguousarray(ids, dtype='int64'))
+    return faiss.IDSelectorNot(batch), batch
+
+
+# Selector that accepts ids whose mask entry is set; the bitmap is returned too,
+# faiss reads it in place
+def bitmap_selector(mask: np.ndarray):
+    bitmap = np.packbits(mask, bitorder="little")
+    return faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap)), bitmap
+
+
+# Content hash covers attributes too, so re-tagging a document re-upserts it
+def content_hash(text: str, metadata: Optional[Dict[str, str]] = None) -> int:
+    if not metadata:
+        return hash64(text)
+    return hash64(text + "\0" + json.dumps(metadata, sort_keys=True, ensure_ascii=False))
+
+
+# IO flags that map the index file instead of copying it into the process:
+# IVF variants ("Iw.." fourcc) map their inverted lists, the rest their flat codes
+def mmap_io_flags(path: str) -> int:
+    with open(path, "rb") as f:
+        fourcc = f.read(4)
+    if fourcc.startswith(b"Iw"):
+        return faiss.IO_FLAG_MMAP
+    return faiss.IO_FLAG_MMAP_IFC
+
+
+# Write the index to path without ever exposing a partial file
+def write_index_atomic(idx: faiss.Index, path: str):
+    tmp_path = path + ".tmp"
+    faiss.write_index(idx, tmp_path)
+    with open(tmp_path, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+@dataclass(frozen=True, eq=False)
+class _Tables:
+    """
+    The per-slot tables of one generation: at the docstore path itself for
+    generation 0, at <docstore>.g<N> after the N-th compaction.
+    """
+    generation: int
+    docs: DocStore
+    keys: KeyTable
+    attrs: AttributeTable
+    raw: Optional[VectorTable]
+    terms: Optional[bm25.TermTable]
+
+    def remove(self):
+        paths = [self.docs.idx_path, self.docs.bin_path, self.keys.keys_path,
+                 self.keys.deleted_path, self.attrs.attrs_path, self.attrs.vocab_path]
+        if self.raw is not None:
+            paths.append(self.raw.path)
+        if self.terms is not None:
+            paths += [self.terms.terms_path, self.terms.idx_path]
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+@dataclass(frozen=True, eq=False)
+class _View:
+    """
+    Everything one search reads. Never modified once published: writers build
+    the next view and swap VectorStore._view with a single assignment.
+    """
+    version: int
+    snapshot: Optional[faiss.Index]
+    # (first slot, flat index) per logged segment past the snapshot
+    tail: Tuple[Tuple[int, faiss.Index], ...]
+    deleted: np.ndarray
+    # (inode, offset) of the log up to which batches are in the tail
+    wal: Tuple[int, int]
+    # the tables its slots refer to
+    tables: _Tables
+    # filters -> (mask of slots, per segment selectors), built on first use
+    filtered: Dict[Tuple, Tuple] = field(default_factory=dict)
+
+    @property
+    def segments(self) -> Tuple[Tuple[int, faiss.Index], ...]:
+        head = ((0, self.snapshot),) if self.snapshot is not None else ()
+        return head + self.tail
+
+    @property
+    def ntotal(self) -> int:
+        if self.tail:
+            return self.tail[-1][0] + self.tail[-1][1].ntotal
+        return self.snapshot.ntotal if self.snapshot is not None else 0
+
+    @property
+    def stamp(self) -> Tuple[int, int, int, int]:
+        return self.version, self.wal[0], self.wal[1], len(self.deleted)
+
+    @cached_property
+    def selectors(self) -> Tuple:
+        """Per segment, a selector skipping its tombstones (or None)."""
+        deleted = self.deleted
+        return tuple(
+            exclude_selector(deleted[(deleted >= start) & (deleted < start + index.ntotal)] - start)
+            for start, index in self.segments
+        )
+
+
+# Appends a flat segment to the tail, merging the last two while the newer is
+# no smaller than the older (like carries in a binary counter): the tail stays
+# O(log n) segments to search and each vector is copied O(log n) times
+def _add_segment(tail: Tuple, start: int, index: faiss.Index) -> Tuple:
+    tail = list(tail) + [(start, index)]
+    while len(tail) > 1 and tail[-1][1].ntotal >= tail[-2][1].ntotal:
+        (_, newer), (first, older) = tail.pop(), tail.pop()
+        merged = faiss.IndexFlatL2(older.d)
+        merged.add(np.vstack([older.reconstruct_n(0, older.ntotal),
+                              newer.reconstruct_n(0, newer.ntotal)]))
+        tail.append((first, merged))
+    return tuple(tail)
+
+
+class VectorStore:
+    """
+    FAISS index snapshot + write-ahead log of later batches + DocStore with the
+    texts + KeyTable with the caller's document ids + AttributeTable with their
+    filterable metadata, loaded on first use rather than at import.
+
+    Snapshots are versioned files (<index>.v<N>) named by <index>.current, and
+    are never modified after they are written. Searches read an immutable
+    _View: the memory-mapped snapshot plus flat segments with the logged
+    batches past it, and tombstones as of that moment. The writer keeps its own
+    private index for the next snapshot, publishes a new view after each
+    upsert or delete, and never touches one a search may be using, so searches
+    take no lock and never wait for ingestion.
+
+    Other processes notice a new snapshot version, a grown log or new
+    tombstones (checked at most every REFRESH_SECONDS) and build their next
+    view in a background thread while searches continue on the current one.
+
+    A re-upserted or deleted document keeps its old slot in the index as a
+    tombstone that searches skip, until compact() drops the tombstones along
+    with their documents. Metadata filters are applied the same way, as an id
+    selector inside the search rather than by over-fetching.
+    """
+
+    def __init__(self, index_path: str = INDEX_PATH, docstore_path: str = DOCSTORE_PATH,
+                 index_type: str = INDEX_TYPE, d: int = dim, use_mmap: bool = USE_MMAP,
+                 raw_vectors: bool = RAW_VECTORS, rerank_factor: int = RERANK_FACTOR,
+                 metric: Optional[str] = METRIC, read_only: bool = False):
+        if metric is not None and metric not in METRICS:
+            raise ValueError(f"Unknown metric {metric!r}, expected one of {METRICS}")
+        self.index_path = index_path
+        self.manifest_path = index_path + ".current"
+        self.docstore_path = docstore_path
+        self.index_type = index_type
+        self.metric = metric or self._stored_metric(NEW_STORE_METRIC)
+        # a process that must never write here (e.g. web workers next to a writer)
+        self.read_only = read_only
+        self.d = d
+        self.use_mmap = use_mmap
+        self.rerank_factor = rerank_factor
+        self.raw_vectors = raw_vectors
+        # docs, raw, keys, attrs and terms: the tables the current snapshot names
+        self._use_tables(self._open_tables(self._manifest().get("tables", 0)))
+        # the log lives next to the snapshot it extends
+        self.wal = WriteAheadLog(index_path + ".wal", d)
+        self._view: Optional[_View] = None
+        self._load_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        # writer only: the flock held across processes (see _writing), and the
+        # disk stamp after this process's last write
+        self._lock_file = None
+        self._synced: Optional[Tuple[int, int, int, int]] = None
+        # writer only: the metric the vectors on disk were written with
+        self._disk_metric = self.metric
+        # set by build_faiss_index: opens a store of another metric to convert it
+        self.converting = False
+        self._refresh_lock = threading.Lock()
+        self._next_refresh = 0.0
+        # writer only: the index the next snapshot is written from
+        self._working: Optional[faiss.Index] = None
+        # writer only: key hash -> (slot, content hash) of the live version
+        self._live: Dict[int, Tuple[int, int]] = {}
+        # (tables, BM25 postings over them), once a hybrid search asked for
+        # them; only ever extended, until a compaction replaces the tables
+        self._lexical: Optional[Tuple[_Tables, Tuple[bm25.Postings, ...]]] = None
+        self._lexical_lock = threading.Lock()
+
+    def _version_path(self, version: int) -> str:
+        # version 0 is a snapshot written before versioning, at index_path itself
+        return f"{self.index_path}.v{version}" if version else self.index_path
+
+    def _manifest(self) -> Dict:
+        """The current snapshot's manifest; empty before the first versioned snapshot."""
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _current(self, manifest: Optional[Dict] = None) -> Tuple[int, Optional[str]]:
+        """(version, path) of the current snapshot; path is None if there is none yet."""
+        manifest = self._manifest() if manifest is None else manifest
+        if not manifest:
+            return 0, self.index_path if os.path.exists(self.index_path) else None
+        return manifest["version"], self._version_path(manifest["version"])
+
+    def _open_tables(self, generation: int, every: bool = False) -> _Tables:
+        """The tables of a generation; every includes the optional ones whatever the settings."""
+        path = f"{self.docstore_path}.g{generation}" if generation else self.docstore_path
+        return _Tables(generation, DocStore(path), KeyTable(path), AttributeTable(path),
+                       VectorTable(path, self.d) if self.raw_vectors or every else None,
+                       bm25.TermTable(path) if LEXICAL_INDEX or every else None)
+
+    def _use_tables(self, tables: _Tables):
+        self._tables = tables
+        self.docs, self.raw, self.keys = tables.docs, tables.raw, tables.keys
+        self.attrs, self.terms = tables.attrs, tables.terms
+
+    def _stored_metric(self, new: Optional[str] = None) -> str:
+        """
+        Metric of the vectors on disk; snapshots written before it was recorded
+        are l2. A store with nothing on disk yet has new (self.metric by default).
+        """
+        manifest = self._manifest()
+        if manifest:
+            return manifest.get("metric", "l2")
+        return "l2" if os.path.exists(self.index_path) else new or self.metric
+
+    def _check_metric(self):
+        stored = self._stored_metric()
+        if stored != self.metric and not self.converting:
+            # mixing normalized and raw vectors would silently skew distances
+            raise RuntimeError(
+                f"{self.index_path} holds {stored} vectors, FAISS_METRIC is {self.metric}: "
+                f"convert it with `manage.py build_faiss_index` or set FAISS_METRIC={stored}"
+            )
+
+    def _replay(self, start_slot: int, offset: int, targets: List[faiss.Index]) -> int:
+        """Adds logged vectors for slots >= start_slot, from offset on; returns the offset reached."""
+        end = offset
+        for first_id, vectors, end in self.wal.replay(offset):
+            if first_id + len(vectors) <= start_slot:
+                continue  # already in the snapshot
+            if first_id > start_slot:
+                raise RuntimeError(
+                    f"Gap in {self.wal.path}: record starts at id {first_id}, "
+                    f"index has {start_slot} vectors"
+                )
+            for target in targets:
+                target.add(vectors[start_slot - first_id:])
+            start_slot = first_id + len(vectors)
+        return end
+
+    def _open_view(self, working: Optional[faiss.Index] = None) -> _View:
+        """
+        Reads the current snapshot and the log past it. working, if given, is
+        the writer's copy of the same snapshot and gets the logged vectors too.
+        """
+        self._check_metric()
+        while True:
+            manifest = self._manifest()
+            version, path = self._current(manifest)
+            generation = manifest.get("tables", 0)
+            if generation != self._tables.generation:
+                self._use_tables(self._open_tables(generation))
+            tables = self._tables
+            try:
+                snapshot = None
+                if path is not None:
+                    flags = mmap_io_flags(path) if self.use_mmap else 0
+                    snapshot = faiss.read_index(path, flags)
+                wal_inode = self.wal.state()[0]
+                tail = faiss.IndexFlatL2(self.d)
+                start = snapshot.ntotal if snapshot is not None else 0
+                targets = [tail] + ([working] if working is not None else [])
+                end = self._replay(start, 0, targets)
+            except (FileNotFoundError, RuntimeError):
+                # the writer published a new snapshot and reset the log meanwhile
+                if working is None and self._current()[0] != version:
+                    continue
+                raise
+            segments = ((start, tail),) if tail.ntotal else ()
+            return _View(version, snapshot, segments, tables.keys.deleted().astype('int64'),
+                         (wal_inode, end), tables)
+
+    def _current_view(self) -> _View:
+        view = self._view
+        if view is None:
+            with self._load_lock:
+                if self._view is None:
+                    self._view = self._open_view()
+                view = self._view
+        elif self._working is None and time.monotonic() >= self._next_refresh:
+            self._next_refresh = time.monotonic() + REFRESH_SECONDS
+            if self._disk_stamp() != view.stamp and self._refresh_lock.acquire(blocking=False):
+                threading.Thread(target=self._refresh, args=(view,), daemon=True).start()
+        return view
+
+    def _disk_stamp(self) -> Tuple[int, int, int, int]:
+        return (self._current()[0],) + self.wal.state() + (self.keys.deleted_count(),)
+
+    def _refresh(self, view: _View):
+        """Builds the next view of another process's writes; runs off the search path."""
+        try:
+            version = self._current()[0]
+            inode, size = self.wal.state()
+            self.attrs.reload()
+            if version != view.version or inode != view.wal[0]:
+                new = self._open_view()
+            else:
+                tail, offset = view.tail, view.wal[1]
+                if size > offset:
+                    segment = faiss.IndexFlatL2(self.d)
+                    offset = self._replay(view.ntotal, offset, [segment])
+                    if segment.ntotal:
+                        tail = _add_segment(tail, view.ntotal, segment)
+                new = _View(version, view.snapshot, tail,
+                            view.tables.keys.deleted().astype('int64'), (inode, offset),
+                            view.tables)
+            self._extend_lexical(new)
+            # a writer in this process publishes its own views
+            with self._load_lock:
+                if self._working is None and self._view is view:
+                    self._view = new
+        except Exception:
+            logging.exception("Reloading %s failed", self.index_path)
+        finally:
+            self._refresh_lock.release()
+
+    @contextmanager
+    def _writing(self):
+        """
+        Held around every mutation: the thread lock, and across processes an
+        exclusive flock on <index>.lock, so two processes never append to the
+        log and tables at the same time. If another process wrote since this
+        one last did, the writable state is read again from disk first rather
+        than appended to files that moved under it.
+        """
+        if self.read_only:
+            raise RuntimeError(f"{self.index_path} is opened read-only in this process")
+        with self._write_lock:
+            if self._lock_file is not None:
+                yield  # nested in a mutation of this thread
+                return
+            self._lock_file = open(self.index_path + ".lock", "a")
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                if self._working is not None and self._disk_stamp() != self._synced:
+                    logging.info("%s was written by another process, reloading", self.index_path)
+                    self._working = None
+                if self._working is None:
+                    self._open_writable()
+                yield
+                self._synced = self._disk_stamp()
+            except BaseException:
+                # half a mutation may be on disk: reload before the next one
+                self._working = None
+                raise
+            finally:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+                self._lock_file.close()
+                self._lock_file = None
+
+    def _load_writable(self):
+        with self._writing():
+            pass
+
+    def _open_writable(self):
+        _, path = self._current()
+        working = faiss.read_index(path) if path is not None else build_index(self.index_type, self.d)
+        view = self._open_view(working)
+        self._disk_metric = self._stored_metric()
+        # docs and keys are appended before the log record; drop the ones
+        # a crashed writer left without vectors, and a torn log record
+        self.wal.truncate(view.wal[1])
+        self.docs.truncate(view.ntotal)
+        self.keys.truncate(view.ntotal)
+        self.attrs.truncate(view.ntotal)
+        if self.raw is not None:
+            self.raw.truncate(view.ntotal)
+        if self.terms is not None:
+            self.terms.truncate(view.ntotal)
+            self._backfill_terms(view.ntotal)
+        with self._load_lock:
+            self._working, self._view, self._lexical = working, view, None
+        self._rebuild_live()
+
+    def _backfill_terms(self, count: int, batch_size: int = 10_000):
+        # stores written before the BM25 index existed get it from their texts
+        for start in range(len(self.terms), count, batch_size):
+            docs = self.docs.get(range(start, min(start + batch_size, count)))
+            self.terms.append([doc["text"] if doc else "" for doc in docs], start)
+
+    def _extend_lexical(self, view: _View):
+        if self._lexical is not None:
+            self._lexical_segments(view)
+
+    def _lexical_segments(self, view: _View) -> Tuple[bm25.Postings, ...]:
+        lexical = self._lexical
+        if lexical is None or lexical[0] is not view.tables or \
+                (lexical[1][-1].end if lexical[1] else 0) < view.ntotal:
+            with self._lexical_lock:
+                lexical = self._lexical
+                # postings over compacted-away tables are dropped, not extended
+                segments = lexical[1] if lexical is not None and lexical[0] is view.tables else ()
+                lexical = self._lexical = (
+                    view.tables, bm25.add_segment(segments, view.tables.terms, view.ntotal))
+        return lexical[1]
+
+    def _rebuild_live(self):
+        deleted = set(self._view.deleted.tolist())
+        self._live = {}
+        stale = []
+        for slot, (key, content) in enumerate(self.keys.records().tolist()):
+            if slot in deleted:
+                continue
+            previous = self._live.get(key)
+            if previous is not None:
+                # a crash between writing the new version and its tombstone
+                stale.append(previous[0])
+            self._live[key] = (slot, content)
+        if stale:
+            self._tombstone(stale)
+
+    def _tombstone(self, slots: List[int]):
+        self.keys.delete(slots)
+        view = self._view
+        deleted = np.concatenate([view.deleted, np.array(slots, dtype='int64')])
+        self._view = _View(view.version, view.snapshot, view.tail, deleted, view.wal, view.tables)
+
+    def _filtered(self, view: _View, filters: Optional[Dict[str, str]]) -> Tuple:
+        """(mask of live slots matching filters, per segment selectors admitting them)."""
+        key = tuple(sorted((field, str(value)) for field, value in (filters or {}).items()))
+        filtered = view.filtered.get(key)
+        if filtered is None:
+            if filters:
+                allowed = view.tables.attrs.mask(filters, view.ntotal)
+            else:
+                allowed = np.ones(view.ntotal, dtype=bool)
+            allowed[view.deleted[view.deleted < view.ntotal]] = False
+            selectors = tuple(bitmap_selector(allowed[start:start + index.ntotal])
+                              for start, index in view.segments)
+            if len(view.filtered) >= 64:
+                view.filtered.clear()
+            filtered = view.filtered[key] = (allowed, selectors)
+        return filtered
+
+    def _selected(self, view: _View, filters: Optional[Dict[str, str]], ids: List[str]) -> Tuple:
+        """Per segment selectors admitting live slots that match filters and hold one of ids."""
+        allowed = self._filtered(view, filters)[0].copy()
+        keys = view.tables.keys.records()["key"][:view.ntotal]
+        allowed[:len(keys)] &= np.isin(keys, np.array([hash64(str(i)) for i in ids], dtype='<u8'))
+        allowed[len(keys):] = False
+        return tuple(bitmap_selector(allowed[start:start + index.ntotal])
+                     for start, index in view.segments)
+
+    def load(self, writable: bool = False):
+        """Reads the index now instead of on first use."""
+        if writable:
+            self._load_writable()
+        else:
+            self._current_view()
+
+    @property
+    def version(self) -> int:
+        """Version of the snapshot searches currently read."""
+        return self._current_view().version
+
+    @property
+    def index(self) -> faiss.Index:
+        """The writer's full index, logged vectors included."""
+        self._load_writable()
+        return self._working
+
+    @property
+    def ntotal(self) -> int:
+        """Number of slots, including tombstones."""
+        return self._current_view().ntotal
+
+    def changed(self, ids: List[str], texts: List[str],
+                metadata: Optional[List[Dict[str, str]]] = None) -> List[int]:
+        """Positions of documents that are new or differ (text or metadata) from the stored version."""
+        metadata = metadata or [{}] * len(ids)
+        with self._writing():
+            positions = []
+            for i, (doc_id, text, meta) in enumerate(zip(ids, texts, metadata)):
+                live = self._live.get(hash64(doc_id))
+                if live is None or live[1] != content_hash(text, meta):
+                    positions.append(i)
+            return positions
+
+    def upsert(self, ids: List[str], vectors: np.ndarray, texts: List[str],
+               metadata: Optional[List[Dict[str, str]]] = None) -> int:
+        """
+        Adds new documents and replaces changed ones; unchanged ones are skipped.
+        Returns the number of vectors written.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype='float32')
+        if self.metric == "cosine":
+            vectors = normalized(vectors)
+        with self._writing():
+            if self._disk_metric != self.metric:
+                raise RuntimeError(f"{self.index_path} is being converted to {self.metric}")
+            # the last occurrence of an id within the batch wins
+            latest = {doc_id: i for i, doc_id in enumerate(ids)}
+            metadata = metadata or [{}] * len(ids)
+            keep = [i for i in self.changed(ids, texts, metadata) if latest[ids[i]] == i]
+            if not keep:
+                return 0
+            ids = [ids[i] for i in keep]
+            texts = [texts[i] for i in keep]
+            metadata = [metadata[i] for i in keep]
+            vectors = vectors[keep]
+            key_hashes = [hash64(doc_id) for doc_id in ids]
+            content_hashes = [content_hash(text, meta) for text, meta in zip(texts, metadata)]
+
+            train_index(self._working, vectors)
+            first_id = self.docs.append([
+                dict({"id": doc_id, "text": text}, **({"meta": meta} if meta else {}))
+                for doc_id, text, meta in zip(ids, texts, metadata)
+            ])
+            if first_id != self._working.ntotal or len(self.keys) != first_id:
+                raise RuntimeError(
+                    f"Document store out of sync with index: {first_id} docs, "
+                    f"{len(self.keys)} keys, {self._working.ntotal} vectors"
+                )
+            self.keys.append(key_hashes, content_hashes)
+            self.attrs.append(metadata, first_id)
+            if self.terms is not None:
+                self.terms.append(texts, first_id)
+            if self.raw is not None:
+                self.raw.append(vectors, first_id)
+            self.wal.append(first_id, vectors)
+            self._working.add(vectors)
+
+            replaced = []
+            for offset, (key, content) in enumerate(zip(key_hashes, content_hashes)):
+                previous = self._live.get(key)
+                if previous is not None:
+                    replaced.append(previous[0])
+                self._live[key] = (first_id + offset, content)
+            if replaced:
+                self.keys.delete(replaced)
+
+            # searches see the batch and the tombstones of the versions it
+            # replaces in one view, never half of it or both versions of an id
+            segment = faiss.IndexFlatL2(self.d)
+            segment.add(vectors)
+            view = self._view
+            self._view = _View(view.version, view.snapshot,
+                               _add_segment(view.tail, first_id, segment),
+                               np.concatenate([view.deleted, np.array(replaced, dtype='int64')]),
+                               self.wal.state(), view.tables)
+            self._extend_lexical(self._view)
+
+            _, path = self._current()
+            snapshot_size = os.path.getsize(path) if path is not None else 0
+            # no snapshot yet: write one, a trained IVF index cannot be rebuilt from the log
+            if not snapshot_size or self.wal.size > max(SNAPSHOT_MIN_WAL_BYTES,
+                                                        SNAPSHOT_RATIO * snapshot_size):
+                if self._working.ntotal - len(self._live) > COMPACT_RATIO * self._working.ntotal:
+                    self.compact()
+                else:
+                    self.snapshot()
+            return len(keep)
+
+    def delete(self, ids: List[str]) -> int:
+        """Removes documents by caller id; returns how many were present."""
+        with self._writing():
+            slots = []
+            for doc_id in set(ids):
+                live = self._live.pop(hash64(doc_id), None)
+                if live is not None:
+                    slots.append(live[0])
+            if slots:
+                self._tombstone(slots)
+            return len(slots)
+
+    def snapshot(self):
+        """Writes the full index as the next snapshot version and empties the log."""
+        with self._writing():
+            version = self._current()[0] + 1
+            write_index_atomic(self._working, self._version_path(version))
+            # the manifest switches readers over; the log is reset only after it,
+            # until then its records are skipped as already in the snapshot
+            tmp_path = self.manifest_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"version": version, "ntotal": self._working.ntotal,
+                           "metric": self._disk_metric, "tables": self._tables.generation}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.manifest_path)
+            self.wal.reset()
+            self._view = self._open_view()
+            self._remove_versions(version)
+
+    def _remove_versions(self, current: int):
+        # the previous version stays for readers that have just read the
+        # manifest; mapped files that are removed stay readable to those mapping them
+        prefix = os.path.basename(self.index_path) + ".v"
+        directory = os.path.dirname(self.index_path) or "."
+        for name in os.listdir(directory):
+            suffix = name[len(prefix):]
+            if name.startswith(prefix) and suffix.isdigit() and int(suffix) < current - 1:
+                os.remove(os.path.join(directory, name))
+        if current > 1 and os.path.exists(self.index_path):
+            os.remove(self.index_path)
+
+    def compact(self, batch_size: int = 50_000) -> int:
+        """
+        Drops the tombstoned slots: the live documents, in slot order, are
+        copied to the next generation of tables and their vectors to a new
+        index of the same type (trained ones keep their training), published
+        together as the next snapshot version. Returns the number of slots
+        dropped; with none, nothing is written.
+        """
+        with self._writing():
+            dropped = self._working.ntotal - len(self._live)
+            if not dropped:
+                return 0
+            # logged records name the old slots: they must not outlive them
+            if self.wal.size:
+                self.snapshot()
+            view, old = self._view, self._tables
+            new = self._open_tables(old.generation + 1)
+            new.remove()  # left by a compaction that crashed before publishing
+            live = np.array(sorted(slot for slot, _ in self._live.values()), dtype='int64')
+            records = old.keys.records()
+            rows = old.attrs.rows(view.ntotal)
+            # slots written before attributes existed have none
+            rows = np.vstack([rows, np.zeros((view.ntotal - len(rows), rows.shape[1]), dtype="<i4")])
+            copy_raw = new.raw is not None and len(old.raw) >= view.ntotal
+            index = faiss.clone_index(self._working)
+            index.reset()
+            for start in range(0, len(live), batch_size):
+                slots = live[start:start + batch_size]
+                docs = old.docs.get(slots)
+                vectors = self._read_vectors(view, slots)
+                new.docs.append(docs)
+                new.keys.append(records["key"][slots], records["content"][slots])
+                new.attrs.append_rows(rows[slots], start, old.attrs.vocab)
+                if new.terms is not None:
+                    new.terms.append([doc["text"] for doc in docs], start)
+                if copy_raw:
+                    new.raw.append(vectors, start)
+                # vectors written before the switch to cosine are stored as given
+                index.add(normalized(vectors) if self.metric == "cosine" else vectors)
+            self._use_tables(new)
+            self._working = index
+            self.snapshot()
+            self._rebuild_live()
+            self._remove_tables(new.generation)
+            return dropped
+
+    def _remove_tables(self, current: int):
+        # like snapshot versions, the previous generation stays for readers
+        # that have just read the manifest
+        prefix = os.path.basename(self.docstore_path) + ".g"
+        directory = os.path.dirname(self.docstore_path) or "."
+        generations = {0} if current > 1 else set()
+        for name in os.listdir(directory):
+            number = name[len(prefix):].split(".")[0]
+            if name.startswith(prefix) and number.isdigit() and int(number) < current - 1:
+                generations.add(int(number))
+        for generation in generations:
+            self._open_tables(generation, every=True).remove()
+
+    def install(self, index: faiss.Index):
+        """
+        Replaces the index with one holding the same vectors (e.g. another
+        type) as a new version, recorded as written with this store's metric.
+        """
+        with self._writing():
+            if index.ntotal != self._working.ntotal:
+                raise ValueError(
+                    f"New index has {index.ntotal} vectors, the store has {self._working.ntotal}"
+                )
+            self._working = index
+            self._disk_metric = self.metric
+            self.snapshot()
+
+    def _nearest(self, view: _View, queries: np.ndarray, k: int,
+                 ef_search: Optional[int], nprobe: Optional[int],
+                 filters: Optional[Dict[str, str]],
+                 ids: Optional[List[str]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(distances, slots) of the k nearest live documents per query row; -1 pads."""
+        if self.metric == "cosine":
+            queries = normalized(queries)
+        if ids is not None:
+            selectors = self._selected(view, filters, ids)
+        else:
+            selectors = self._filtered(view, filters)[1] if filters else view.selectors
+        raw = view.tables.raw
+        rerank = self.rerank_factor > 1 and raw is not None and len(raw) >= view.ntotal
+        fetch = k * self.rerank_factor if rerank else k
+
+        all_distances, all_indices = [], []
+        for (start, index), selector in zip(view.segments, selectors):
+            sel = selector[0] if selector is not None else None
+            distances, indices = index.search(
+                queries, fetch, params=search_params(index, ef_search, nprobe, sel=sel)
+            )
+            all_distances.append(distances)
+            all_indices.append(np.where(indices >= 0, indices + start, -1))
+        distances, indices = np.hstack(all_distances), np.hstack(all_indices)
+        if len(all_indices) > 1:
+            order = np.argsort(distances, axis=1, kind="stable")[:, :fetch]
+            distances = np.take_along_axis(distances, order, axis=1)
+            indices = np.take_along_axis(indices, order, axis=1)
+        if rerank:
+            distances, indices = self._rerank(view, queries, indices, k)
+        return distances, indices
+
+    @staticmethod
+    def _documents(view: _View, slots: List[int]) -> Dict[int, Dict]:
+        # only the hits are read from the document store, in one pass for all rows
+        slots = sorted(set(slots))
+        return {slot: doc for slot, doc in zip(slots, view.tables.docs.get(slots))
+                if doc is not None}
+
+    @staticmethod
+    def _hit(slot: int, doc: Dict, **scores) -> Dict:
+        return dict({"id": doc.get("id", str(slot)), "text": doc["text"],
+                     "metadata": doc.get("meta", {})}, **scores)
+
+    def search_batch(self, queries: np.ndarray, k: int,
+                     ef_search: Optional[int] = None,
+                     nprobe: Optional[int] = None,
+                     filters: Optional[Dict[str, str]] = None,
+                     ids: Optional[List[str]] = None,
+                     min_similarity: Optional[float] = None) -> List[List[Dict]]:
+        """
+        Top-k live documents for each row of an (n, d) query matrix, as
+        {"id", "text", "distance", "metadata"}, nearest first; with the cosine
+        metric also "similarity", and min_similarity drops the hits below it,
+        so a row can come back short or empty. One index.search call per
+        segment for all rows; filters ({field: value}, see vector_keys.METADATA_FIELDS)
+        and ids (caller ids to choose from, e.g. the result of a database
+        query) are applied inside it.
+        """
+        if min_similarity is not None and self.metric != "cosine":
+            raise ValueError("min_similarity needs FAISS_METRIC=cosine")
+        queries = np.ascontiguousarray(queries, dtype='float32').reshape(-1, self.d)
+        view = self._current_view()
+        if not view.ntotal or ids is not None and not len(ids):
+            return [[] for _ in range(len(queries))]
+        distances, indices = self._nearest(view, queries, k, ef_search, nprobe, filters, ids)
+        if min_similarity is not None:
+            indices = np.where(distances <= max_distance(min_similarity), indices, -1)
+        docs = self._documents(view, [int(i) for i in indices[indices >= 0]])
+        return [[self._hit(slot, docs[slot], **self._scores(float(dist)))
+                 for slot, dist in zip(row_indices.tolist(), row_distances) if slot in docs]
+                for row_indices, row_distances in zip(indices, distances)]
+
+    def _scores(self, distance: float) -> Dict[str, float]:
+        if self.metric == "cosine":
+            return {"distance": distance, "similarity": similarity(distance)}
+        return {"distance": distance}
+
+    def hybrid_search_batch(self, queries: np.ndarray, texts: List[str], k: int,
+                            ef_search: Optional[int] = None,
+                            nprobe: Optional[int] = None,
+                            filters: Optional[Dict[str, str]] = None,
+                            rerank: bool = False) -> List[List[Dict]]:
+        """
+        Top-k live documents for each (embedding, query text) pair: the
+        HYBRID_CANDIDATES nearest vectors and best BM25 matches, fused by
+        reciprocal rank. Hits carry "score" (higher is better) and "distance"
+        (None for lexical-only hits). rerank adds bm25.match_bonus, scaled to
+        a first place in one more list, to the top k * HYBRID_RERANK_DEPTH.
+        """
+        if self.terms is None:
+            raise RuntimeError("Hybrid search needs FAISS_LEXICAL_INDEX=1")
+        queries = np.ascontiguousarray(queries, dtype='float32').reshape(-1, self.d)
+        view = self._current_view()
+        if not view.ntotal:
+            return [[] for _ in range(len(queries))]
+        depth = max(k, HYBRID_CANDIDATES)
+        distances, indices = self._nearest(view, queries, depth, ef_search, nprobe, filters)
+        allowed = self._filtered(view, filters)[0]
+        # BM25 statistics count the live documents, whatever the filters
+        live = self._filtered(view, None)[0]
+        lexical = self._lexical_segments(view)
+
+        rows = []
+        for text, row_distances, row_indices in zip(texts, distances, indices):
+            # slot -> [fused score, distance]
+            fused: Dict[int, List] = {}
+            for rank, (slot, dist) in enumerate(zip(row_indices.tolist(), row_distances.tolist())):
+                if slot >= 0:
+                    fused[slot] = [1 / (RRF_K + rank + 1), dist]
+            _, slots = bm25.search(lexical, text, allowed, depth, live)
+            for rank, slot in enumerate(slots.tolist()):
+                fused.setdefault(slot, [0.0, None])[0] += 1 / (RRF_K + rank + 1)
+            keep = k * HYBRID_RERANK_DEPTH if rerank else k
+            rows.append(sorted(fused.items(), key=lambda item: -item[1][0])[:keep])
+
+        docs = self._documents(view, [slot for row in rows for slot, _ in row])
+        results = []
+        for text, row in zip(texts, rows):
+            row = [(slot, score, dist) for slot, (score, dist) in row if slot in docs]
+            if rerank:
+                weights = bm25.idf(lexical, text, live)
+                row = sorted(((slot, score + bm25.match_bonus(text, docs[slot]["text"], weights)
+                               / (RRF_K + 1), dist) for slot, score, dist in row),
+                             key=lambda hit: -hit[1])[:k]
+            results.append([self._hit(slot, docs[slot], score=score, distance=dist)
+                            for slot, score, dist in row])
+        return results
+
+    def scan(self, cursor: Optional[int] = None,
+             limit: int = 1000) -> Tuple[List[Dict], np.ndarray, Optional[int]]:
+        """
+        Live documents of the next limit slots as {"id", "text", "metadata"},
+        their vectors, and the cursor to continue from (None after the last).
+        Lets documents move to another store without being embedded again.
+        """
+        view = self._current_view()
+        start = cursor or 0
+        end = min(start + limit, view.ntotal)
+        slots = np.arange(start, end, dtype='int64')
+        docs = self._documents(view, slots[~np.isin(slots, view.deleted)].tolist())
+        slots = np.array(sorted(docs), dtype='int64')
+        hits = [self._hit(slot, docs[slot]) for slot in slots.tolist()]
+        return hits, self._read_vectors(view, slots), end if end < view.ntotal else None
+
+    def vectors(self, ids: List[str]) -> Tuple[List[str], np.ndarray]:
+        """
+        Stored vectors of the live documents among ids, as (their ids,
+        vectors); ids not in the store are left out.
+        """
+        view = self._current_view()
+        keys = view.tables.keys.records()["key"][:view.ntotal]
+        wanted = {hash64(str(i)): str(i) for i in ids}
+        live = np.isin(keys, np.fromiter(wanted, dtype='<u8', count=len(wanted)))
+        live[view.deleted[view.deleted < len(keys)]] = False
+        slots = np.flatnonzero(live)
+        vectors = self._read_vectors(view, slots)
+        if self.metric == "cosine":
+            # vectors written before the switch to cosine are stored as given
+            vectors = normalized(vectors)
+        return [wanted[int(key)] for key in keys[slots]], vectors
+
+    def _read_vectors(self, view: _View, slots: np.ndarray) -> np.ndarray:
+        if not len(slots):
+            return np.zeros((0, self.d), dtype='float32')
+        raw = view.tables.raw
+        if raw is not None and len(raw) > slots.max():
+            return raw.get(slots)
+        try:
+            return self.index.reconstruct_batch(slots)
+        except RuntimeError as e:
+            raise RuntimeError(f"Vectors of {self.index_path} cannot be read back; "
+                               f"enable FAISS_RAW_VECTORS and run build_faiss_index") from e
+
+    def _rerank(self, view: _View, queries: np.ndarray, indices: np.ndarray, k: int):
+        """Exact L2 distances for the candidates from the raw vectors; keeps the k nearest."""
+        distances = np.full((len(queries), k), np.inf, dtype='float32')
+        reranked = np.full((len(queries), k), -1, dtype='int64')
+        for row, (query, candidates) in enumerate(zip(queries, indices)):
+            candidates = candidates[candidates >= 0]
+            if not len(candidates):
+                continue
+            vectors = view.tables.raw.get(candidates)
+            if self.metric == "cosine":
+                # vectors written before the switch to cosine are stored as given
+                vectors = normalized(vectors)
+            exact = ((vectors - query) ** 2).sum(axis=1)
+            order = np.argsort(exact, kind="stable")[:k]
+            distances[row, :len(order)] = exact[order]
+            reranked[row, :len(order)] = candidates[order]
+        return distances, reranked
+
+    def search(self, query: np.ndarray, k: int,
+               ef_search: Optional[int] = None,
+               nprobe: Optional[int] = None,
+               filters: Optional[Dict[str, str]] = None,
+               ids: Optional[List[str]] = None,
+               min_similarity: Optional[float] = None) -> List[Dict]:
+        """Top-k live documents for a single query."""
+        return self.search_batch(query, k, ef_search=ef_search, nprobe=nprobe,
+                                 filters=filters, ids=ids, min_similarity=min_similarity)[0]
+
+
+class PartitionedVectorStore:
+    """
+    One VectorStore per value of PARTITION_FIELD (letter type) under root;
+    documents without it go to the default store.
+
+    A query filtered by letter type searches only that partition, so it costs
+    the same as an unfiltered query over an index of the partition's size.
+    Other filters become id selectors inside the partition. Unpartitioned
+    queries search every partition and merge hits by distance.
+    """
+
+    def __init__(self, root: str = PARTITIONS_DIR, default: Optional[VectorStore] = None,
+                 index_type: str = INDEX_TYPE, d: int = dim, use_mmap: bool = USE_MMAP,
+                 metric: Optional[str] = METRIC):
+        self.root = root
+        self.index_type = index_type
+        self.d = d
+        self.use_mmap = use_mmap
+        self.metric = metric
+        self.default = default or VectorStore(index_type=index_type, d=d, use_mmap=use_mmap,
+                                              metric=metric)
+        self._stores: Dict[str, VectorStore] = {}
+        self._lock = threading.Lock()
+
+    def partition(self, value: Optional[str]) -> VectorStore:
+        if not value:
+            return self.default
+        value = str(value)
+        if not re.fullmatch(r"[\w-]+", value):
+            raise ValueError(f"Invalid partition name {value!r}")
+        with self._lock:
+            if value not in self._stores:
+                path = os.path.join(self.root, value)
+                os.makedirs(path, exist_ok=True)
+                self._stores[value] = VectorStore(
+                    os.path.join(path, "index.bin"), os.path.join(path, "docs"),
+                    self.index_type, self.d, self.use_mmap, metric=self.metric,
+                )
+            return self._stores[value]
+
+    def partitions(self) -> List[VectorStore]:
+        names = sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []
+        return [self.default] + [self.partition(name) for name in names]
+
+    def _group(self, metadata: List[Dict[str, str]]) -> Dict[str, List[int]]:
+        groups: Dict[str, List[int]] = {}
+        for i, meta in enumerate(metadata):
+            groups.setdefault(meta.get(PARTITION_FIELD) or "", []).append(i)
+        return groups
+
+    def changed(self, ids: List[str], texts: List[str],
+                metadata: Optional[List[Dict[str, str]]] = None) -> List[int]:
+        metadata = metadata or [{}] * len(ids)
+        positions = []
+        for value, group in self._group(metadata).items():
+            local = self.partition(value).changed(
+                [ids[i] for i in group], [texts[i] for i in group], [metadata[i] for i in group]
+            )
+            positions.extend(group[i] for i in local)
+        return sorted(positions)
+
+    def upsert(self, ids: List[str], vectors: np.ndarray, texts: List[str],
+               metadata: Optional[List[Dict[str, str]]] = None) -> int:
+        """
+        A document's partition is part of its identity: moving it to another
+        letter type needs delete() + upsert(), otherwise both copies stay.
+        """
+        metadata = metadata or [{}] * len(ids)
+        written = 0
+        for value, group in self._group(metadata).items():
+            written += self.partition(value).upsert(
+                [ids[i] for i in group], vectors[group],
+                [texts[i] for i in group], [metadata[i] for i in group]
+            )
+        return written
+
+    def delete(self, ids: List[str]) -> int:
+        return sum(store.delete(ids) for store in self.partitions())
+
+    def scan(self, cursor: Optional[List] = None,
+             limit: int = 1000) -> Tuple[List[Dict], np.ndarray, Optional[List]]:
+        """
+        VectorStore.scan over the partitions in name order, the default first;
+        cursor is [partition, cursor within it]. A batch never spans two
+        partitions, so it can be empty before the end.
+        """
+        name, inner = cursor or ["", None]
+        docs, vectors, inner = self.partition(name).scan(inner, limit)
+        if inner is not None:
+            return docs, vectors, [name, inner]
+        names = sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []
+        later = [n for n in names if n > name]
+        return docs, vectors, [later[0], None] if later else None
+
+    def search_batch(self, queries: np.ndarray, k: int,
+                     ef_search: Optional[int] = None,
+                     nprobe: Optional[int] = None,
+                     filters: Optional[Dict[str, str]] = None,
+                     ids: Optional[List[str]] = None,
+                     min_similarity: Optional[float] = None) -> List[List[Dict]]:
+        filters = dict(filters or {})
+        value = filters.pop(PARTITION_FIELD, None)
+        stores = [self.partition(value)] if value else self.partitions()
+        results = None
+        for store in stores:
+            hits = store.search_batch(queries, k, ef_search, nprobe, filters or None, ids,
+                                      min_similarity)
+            if results is None:
+                results = hits
+            else:
+                results = [sorted(a + b, key=lambda h: h["distance"])[:k]
+                           for a, b in zip(results, hits)]
+        if results is None:
+            results = [[] for _ in range(len(np.asarray(queries).reshape(-1, self.d)))]
+        return results
+
+    def hybrid_search_batch(self, queries: np.ndarray, texts: List[str], k: int,
+                            ef_search: Optional[int] = None,
+                            nprobe: Optional[int] = None,
+                            filters: Optional[Dict[str, str]] = None,
+                            rerank: bool = False) -> List[List[Dict]]:
+        """Fused scores are per partition ranks, so hits from all partitions merge by score."""
+        filters = dict(filters or {})
+        value = filters.pop(PARTITION_FIELD, None)
+        stores = [self.partition(value)] if value else self.partitions()
+        results = [[] for _ in range(len(texts))]
+        for store in stores:
+            hits = store.hybrid_search_batch(queries, texts, k, ef_search, nprobe,
+                                             filters or None, rerank)
+            results = [sorted(a + b, key=lambda h: -h["score"])[:k]
+                       for a, b in zip(results, hits)]
+        return results
+
+
+# Default store; nothing is read from disk until the first search or upsert
+store = VectorStore()
+# Per letter type partitions, with the default store for untyped documents
+partitioned_store = PartitionedVectorStore(default=store)
+# Client of the per-host vector server, if one is configured
+server_client = VectorClient(SERVER_SOCKET) if SERVER_SOCKET else None
+# Coordinator of the shard servers, if configured
+sharded_store = (ShardedVectorStore([VectorClient(path) for path in SHARD_SOCKETS])
+                 if SHARD_SOCKETS else None)
+
+
+# Where module-level functions read and write: the shards, the shared server or the local store
+def backend():
+    return sharded_store or server_client or partitioned_store
+
+
+# Shared by all workers on the host; files are created on first use
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, dim, EMBEDDING_CACHE_SIZE)
+
+
+# Embed texts via OpenAI embeddings, asking the API only for texts not in the cache;
+# throttle (e.g. RateBudget.acquire) is called before every request
+def embed_texts(texts: List[str], model: str = EMBEDDING_MODEL,
+                throttle: Optional[Callable[[], None]] = None) -> np.ndarray:
+    vectors, found = embedding_cache.get(model, texts)
+    missing = {}
+    for i in np.flatnonzero(~found):
+        missing.setdefault(texts[i], []).append(i)
+
+    unique = list(missing)
+    for start in range(0, len(unique), EMBEDDING_BATCH_SIZE):
+        batch = unique[start:start + EMBEDDING_BATCH_SIZE]
+        if throttle is not None:
+            throttle()
+        resp = openai.embeddings.create(model=model, input=batch)
+        batch_vectors = np.array([d.embedding for d in resp.data], dtype='float32')
+        embedding_cache.put(model, batch, batch_vectors)
+        for text, vector in zip(batch, batch_vectors):
+            vectors[missing[text]] = vector
+
+    # requests that would have been made without the cache, minus those made
+    calls_saved = -(-len(texts) // EMBEDDING_BATCH_SIZE) - -(-len(unique) // EMBEDDING_BATCH_SIZE)
+    incr_counter("embedding_cache_hits", len(texts) - len(unique))
+    incr_counter("embedding_cache_misses", len(unique))
+    incr_counter("embedding_api_calls_saved", calls_saved)
+    return vectors
+
+
+# Merges concurrent query embeddings of this process (threads); with a vector
+# server, the server's batcher does it for all workers on the host
+embedding_batcher = EmbeddingBatcher(embed_texts, EMBEDDING_MICROBATCH_SIZE,
+                                     EMBEDDING_MICROBATCH_WAIT_MS / 1000)
+
+
+# Embed query texts, batched together with concurrent queries; adds at most
+# EMBEDDING_MICROBATCH_WAIT_MS. Bulk loads should call embed_texts directly
+def embed_queries(texts: List[str]) -> np.ndarray:
+    if server_client is not None:
+        return server_client.embed(texts)
+    return embedding_batcher.embed_many(texts)
+
 
-# Embed text via OpenAI embeddings
 def embed_text(text: str) -> List[float]:
-    resp = openai.Embeddings.create(
-        model="text-embedding-ada-002",
-        input=[text]
-    )
-    return resp['data'][0]['embedding']
-
-# Upsert documents into FAISS index
-def upsert_documents(docs: List[Tuple[str, str]]):
-    texts = [t for _, t in docs]
-    resp = openai.Embeddings.create(
-        model="text-embedding-ada-002",
-        input=texts
-    )
-    vectors = np.array([d['embedding'] for d in resp['data']], dtype='float32')
-
-    index.add(vectors)
-    id_to_text.extend(texts)
-
-    faiss.write_index(index, INDEX_PATH)
-    with open(META_PATH, "wb") as f:
-        pickle.dump(id_to_text, f)
+    return embed_queries([text])[0].tolist()
 
-# Retrieve top-k similar docs
-def get_top_k_docs(user_emb: List[float], k: int = 3) -> List[str]:
+# Upsert (id, text) or (id, text, metadata) documents into FAISS index (or into
+# store, another index with the same interface); unchanged documents are not
+# re-embedded. Metadata keys: vector_keys.METADATA_FIELDS
+def upsert_documents(docs: List[Tuple], store=None) -> int:
+    store = store or backend()
+    ids = [doc[0] for doc in docs]
+    texts = [doc[1] for doc in docs]
+    metadata = [doc[2] if len(doc) > 2 else {} for doc in docs]
+    positions = store.changed(ids, texts, metadata)
+    if not positions:
+        return 0
+    ids = [ids[i] for i in positions]
+    texts = [texts[i] for i in positions]
+    metadata = [metadata[i] for i in positions]
+    return store.upsert(ids, embed_texts(texts), texts, metadata)
+
+# Remove documents by id
+def delete_documents(ids: List[str], store=None) -> int:
+    return (store or backend()).delete(ids)
+
+# Retrieve top-k similar docs for each row of an (n, d) array in one index scan;
+# filters: {field: value} over vector_keys.METADATA_FIELDS, e.g. {"letter_type": "ucas"}
+def search_documents_batch(embeddings: np.ndarray, k: int = 3,
+                           ef_search: Optional[int] = None,
+                           nprobe: Optional[int] = None,
+                           filters: Optional[Dict[str, str]] = None,
+                           min_similarity: Optional[float] = None) -> List[List[Dict]]:
+    return backend().search_batch(embeddings, k, ef_search=ef_search,
+                                  nprobe=nprobe, filters=filters,
+                                  min_similarity=min_similarity)
+
+# Retrieve top-k similar docs with their ids, L2 distances (and cosine
+# similarities) and metadata; min_similarity drops less similar ones
+def search_documents(user_emb: List[float], k: int = 3,
+                     ef_search: Optional[int] = None,
+                     nprobe: Optional[int] = None,
+                     filters: Optional[Dict[str, str]] = None,
+                     min_similarity: Optional[float] = None) -> List[Dict]:
     query_vec = np.array(user_emb, dtype='float32').reshape(1, -1)
-    _, indices = index.search(query_vec, k)
-    results = []
-    for idx in indices[0]:
-        if idx < len(id_to_text):
-            results.append(id_to_text[idx])
-    return results
\ No newline at end of file
+    return search_documents_batch(query_vec, k, ef_search, nprobe, filters, min_similarity)[0]
+
+# Retrieve top-k similar docs
+def get_top_k_docs(user_emb: List[float], k: int = 3,
+                   ef_search: Optional[int] = None,
+                   nprobe: Optional[int] = None,
+                   filters: Optional[Dict[str, str]] = None) -> List[str]:
+    return [doc["text"] for doc in search_documents(user_emb, k, ef_search, nprobe, filters)]
+
+# Batch variant of get_top_k_docs: texts of the top-k docs for each query
+def get_top_k_docs_batch(embeddings: np.ndarray, k: int = 3,
+                         ef_search: Optional[int] = None,
+                         nprobe: Optional[int] = None,
+                         filters: Optional[Dict[str, str]] = None) -> List[List[str]]:
+    return [[doc["text"] for doc in hits]
+            for hits in search_documents_batch(embeddings, k, ef_search, nprobe, filters)]
+
+# Hybrid retrieval for query texts: nearest vectors and BM25 matches fused by
+# reciprocal rank, so exact program or university names are not missed.
+# embeddings default to embed_queries(queries); rerank favours documents that
+# contain every query term or the query as a phrase
+def search_documents_hybrid_batch(queries: List[str], embeddings: Optional[np.ndarray] = None,
+                                  k: int = 3, ef_search: Optional[int] = None,
+                                  nprobe: Optional[int] = None,
+                                  filters: Optional[Dict[str, str]] = None,
+                                  rerank: bool = False) -> List[List[Dict]]:
+    if embeddings is None:
+        embeddings = embed_queries(queries)
+    return backend().hybrid_search_batch(embeddings, queries, k, ef_search=ef_search,
+                                         nprobe=nprobe, filters=filters, rerank=rerank)
+
+# Hybrid variant of search_documents; hits carry "score" instead of ranking by distance
+def search_documents_hybrid(query: str, user_emb: Optional[List[float]] = None, k: int = 3,
+                            ef_search: Optional[int] = None,
+                            nprobe: Optional[int] = None,
+                            filters: Optional[Dict[str, str]] = None,
+                            rerank: bool = False) -> List[Dict]:
+    embeddings = None if user_emb is None else np.array(user_emb, dtype='float32').reshape(1, -1)
+    return search_documents_hybrid_batch([query], embeddings, k, ef_search, nprobe,
+                                         filters, rerank)[0]
+
+# Hybrid variant of get_top_k_docs
+def get_top_k_docs_hybrid(query: str, user_emb: Optional[List[float]] = None, k: int = 3,
+                          ef_search: Optional[int] = None,
+                          nprobe: Optional[int] = None,
+                          filters: Optional[Dict[str, str]] = None,
+                          rerank: bool = False) -> List[str]:
+    return [doc["text"] for doc in search_documents_hybrid(query, user_emb, k, ef_search,
+                                                           nprobe, filters, rerank)]
@@ -0,0 +1,86 @@
+import os
+import struct
+import zlib
+from typing import Iterator, Tuple
+
+import numpy as np
+
+# record: payload length, crc32(payload) | payload: first id, count, float32 vectors
+_HEADER = struct.Struct("<II")
+_PAYLOAD_HEADER = struct.Struct("<QI")
+
+
+class WriteAheadLog:
+    """
+    Append-only log of vector batches added since the last index snapshot.
+
+    Every record carries the id of its first vector, so replay can skip what
+    a newer snapshot already contains. A torn or corrupt record ends the log:
+    everything after it was never acknowledged to the caller.
+    """
+
+    def __init__(self, path: str, d: int):
+        self.path = path
+        self.d = d
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def state(self) -> Tuple[int, int]:
+        """(inode, size); the inode changes when reset() replaces the log."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return 0, 0
+        return st.st_ino, st.st_size
+
+    def append(self, first_id: int, vectors: np.ndarray) -> int:
+        vectors = np.ascontiguousarray(vectors, dtype="<f4")
+        payload = _PAYLOAD_HEADER.pack(first_id, len(vectors)) + vectors.tobytes()
+        record = _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with open(self.path, "ab") as f:
+            f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+        return len(record)
+
+    def replay(self, start: int = 0) -> Iterator[Tuple[int, np.ndarray, int]]:
+        """
+        Yields (first id, vectors, offset past the record) for every intact
+        record from byte offset start (a record boundary) on.
+        """
+        if not os.path.exists(self.path):
+            return
+        row_bytes = self.d * 4
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            offset = start
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    return
+                length, crc = _HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    return
+                first_id, count = _PAYLOAD_HEADER.unpack_from(payload)
+                if length != _PAYLOAD_HEADER.size + count * row_bytes:
+                    return
+                vectors = np.frombuffer(payload, dtype="<f4", offset=_PAYLOAD_HEADER.size)
+                offset += _HEADER.size + length
+                yield first_id, vectors.reshape(count, self.d), offset
+
+    def truncate(self, offset: int):
+        # drop a torn tail so new records are not appended after garbage
+        if self.size > offset:
+            with open(self.path, "ab") as f:
+                f.truncate(offset)
+                os.fsync(f.fileno())
+
+    def reset(self):
+        # atomic: a crash leaves either the old log (skipped on replay) or an empty one
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
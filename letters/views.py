@@ -1,18 +1,24 @@
 import logging
-import time
-import boto3
+import hmac
 import json
 import openai
 
 from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from .models import Letter, LetterVersion, VersionMessage, DraftLetter, DraftAnswer, DraftSection
+from .models import Letter, LetterVersion, DraftLetter, DraftAnswer, DraftSection
 from .serializers import LetterSerializer, LetterVersionSerializer,DraftLetterSerializer, DraftAnswerSerializer, DraftSectionSerializer
-from .s3_utils import upload_letter_text,  upload_draft_section
+from .s3_utils import upload_letter_text,  upload_draft_section, read_letter_text
+from .analysis import AnalysisError, analyse_version, call_openai, get_assistant_id, wait_for_run
+from .generation import iter_generated_sections
+from .retrieval import embed_version_later
+from .ratelimit import openai_budget
+from .timing import PhaseTimer, observe, render_metrics
 # Устанавливаем API-ключ
 openai.api_key = settings.OPENAI_API_KEY
 
@@ -44,7 +50,7 @@ class LetterViewSet(viewsets.ModelViewSet):
 
         # Список версий
         if request.method == 'GET':
-            qs = letter.versions.order_by('version_num')
+            qs = letter.versions.order_by('version_num').defer('embedding')
             serializer = LetterVersionSerializer(qs, many=True)
             return Response(serializer.data)
 
@@ -70,6 +76,8 @@ class LetterViewSet(viewsets.ModelViewSet):
             version_num=next_num,
             s3_key=s3_key
         )
+        # вектор для analyse считается в фоне, ответ его не ждёт
+        embed_version_later(version, text, throttle=openai_budget().consume)
 
         serializer = LetterVersionSerializer(version)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -80,7 +88,7 @@ class LetterViewSet(viewsets.ModelViewSet):
         POST /api/letters/{id}/analyse/
         Использует Assistants API:
           1) создаёт новый thread
-          2) добавляет в него всю историю + текущее письмо
+          2) добавляет в него всю историю, примеры из векторного индекса + текущее письмо
           3) запускает run у вашего assistant_id
           4) ждёт завершения и возвращает JSON-ответ
         Ожидает в тело: { "version_num": <номер версии> }
@@ -94,7 +102,7 @@ class LetterViewSet(viewsets.ModelViewSet):
 
         data = request.data
         version_num = data.get("version_num")
-        s3 = boto3.client("s3", region_name=settings.AWS_REGION)
+        timer = PhaseTimer()
 
         # если version_num не передан — формируем текст из входных полей
         if not version_num:
@@ -127,17 +135,20 @@ class LetterViewSet(viewsets.ModelViewSet):
             # создаём новую версию в S3 и БД
             last = letter.versions.order_by("-version_num").first()
             next_num = (last.version_num + 1) if last else 1
-            s3_key = upload_letter_text(
-                user_id=str(request.user.id),
-                letter_id=str(letter.id),
-                version_num=next_num,
-                text=letter_text
-            )
-            version = LetterVersion.objects.create(
-                letter=letter,
-                version_num=next_num,
-                s3_key=s3_key
-            )
+            with timer.span("s3_write"):
+                s3_key = upload_letter_text(
+                    user_id=str(request.user.id),
+                    letter_id=str(letter.id),
+                    version_num=next_num,
+                    text=letter_text
+                )
+            with timer.span("db"):
+                version = LetterVersion.objects.create(
+                    letter=letter,
+                    version_num=next_num,
+                    s3_key=s3_key
+                )
+            embed_version_later(version, letter_text, throttle=openai_budget().consume)
 
         else:
             # старая логика: получаем существующую версию и читаем её из S3
@@ -146,124 +157,32 @@ class LetterViewSet(viewsets.ModelViewSet):
             except LetterVersion.DoesNotExist:
                 return Response({"detail": "Version not found"},
                                 status=status.HTTP_404_NOT_FOUND)
-            obj = s3.get_object(
-                Bucket=settings.AWS_S3_BUCKET,
-                Key=version.s3_key
-            )
-            letter_text = obj["Body"].read().decode("utf-8")
-
-        # история прошлых сообщений
-        prev_messages = [
-            {"role": msg.role, "content": msg.content}
-            for msg in version.messages.all()
-        ]
+            with timer.span("s3_read"):
+                letter_text = read_letter_text(version.s3_key)
 
-        # создаём новый thread
-        try:
-            thread = openai.beta.threads.create()
-        except Exception as e:
-            logging.exception("Failed to create thread")
-            return Response(
-                {"detail": "OpenAI thread creation failed", "error": str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-
-        # добавляем все сообщения в thread
-        for m in prev_messages + [{"role": "user", "content": letter_text}]:
-            try:
-                openai.beta.threads.messages.create(
-                    thread_id=thread.id,
-                    role=m["role"],
-                    content=m["content"]
-                )
-            except Exception as e:
-                logging.exception("Failed to add message to thread")
-                return Response(
-                    {"detail": "Thread messaging failed", "error": str(e)},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-
-        # сохраняем user-сообщение в БД
-        VersionMessage.objects.create(
-            version=version, role="user", content=letter_text
-        )
-
-        # выбираем assistant_id по типу письма
-        assistant_map = {
-            "common_app": settings.ASSISTANT_COMMON_APP_ID,
-            "ucas":       settings.ASSISTANT_UCAS_ID,
-            "motivation": settings.ASSISTANT_MOTIVATION_ID,
-        }
-        assistant_id = assistant_map.get(letter.type)
+        assistant_id = get_assistant_id(letter.type)
         logging.info(f"Using assistant_id: {assistant_id} for letter type: {letter.type}")
 
         if not assistant_id:
             return Response({"detail": f"Unknown letter type {letter.type}"},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        # запускаем run
         try:
-            run = openai.beta.threads.runs.create(
-                thread_id=thread.id,
-                assistant_id=assistant_id
-            )
-        except Exception as e:
-            logging.exception("Failed to start run")
-            return Response(
-                {"detail": "Run creation failed", "error": str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-
-        # polling до статуса READY
-        while run.status in ("queued", "in_progress"):
-            time.sleep(1)
-            try:
-                run = openai.beta.threads.runs.retrieve(
-                    thread_id=thread.id, run_id=run.id
-                )
-            except Exception as e:
-                logging.exception("Failed to poll run status")
-                return Response(
-                    {"detail": "Run polling failed", "error": str(e)},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-
-        # получаем список сообщений thread’а
-        try:
-            msgs = openai.beta.threads.messages.list(thread_id=thread.id)
-        except Exception as e:
-            logging.exception("Failed to list thread messages")
-            return Response(
-                {"detail": "Listing thread messages failed", "error": str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-
-        if not msgs.data:
-            return Response(
-                {"detail": "No assistant response"},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-
-        # извлекаем текст первого сообщения ассистента
-        assistant_reply = msgs.data[0].content[0].text.value
-
-        # парсим JSON
-        try:
-            data = json.loads(assistant_reply)
-        except json.JSONDecodeError:
-            logging.error("Invalid JSON from assistant: %s", assistant_reply)
-            return Response(
-                {"detail": "Non-JSON from OpenAI", "raw": assistant_reply},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-
-        # сохраняем ответ ассистента
-        VersionMessage.objects.create(
-            version=version, role="assistant", content=assistant_reply
-        )
+            data = analyse_version(version, letter_text, assistant_id,
+                                   throttle=openai_budget().consume, timer=timer)
+        except AnalysisError as e:
+            # неудачные запросы тоже в гистограммах: иначе медленные падения не видны
+            timer.finish()
+            observe("analyse", timer)
+            return Response(e.as_response_data(),
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        timer.finish()
+        observe("analyse", timer)
 
         # возвращаем распарсенный JSON
-        return Response(data, status=status.HTTP_200_OK)
+        return Response(data, status=status.HTTP_200_OK,
+                        headers={"Server-Timing": timer.server_timing()})
 
 
 
@@ -327,46 +246,139 @@ class DraftLetterViewSet(viewsets.ModelViewSet):
         if not assistant_id:
             return Response({"detail": "Unknown draft type"}, status=400)
 
+        timer = PhaseTimer()
+        try:
+            self._generate_structure(draft, qa, assistant_id, timer)
+        except AnalysisError as e:
+            return Response(e.as_response_data(), status=500)
+        finally:
+            # неудачные запросы тоже в гистограммах: иначе медленные падения не видны
+            timer.finish()
+            observe("generate_structure", timer)
+
+        serializer = DraftSectionSerializer(draft.sections, many=True)
+        return Response(serializer.data, status=200,
+                        headers={"Server-Timing": timer.server_timing()})
+
+    @staticmethod
+    def _generate_structure(draft, qa, assistant_id, timer):
+        """
+        Thread с ответами на вопросы → разделы черновика от ассистента.
+        Ошибки OpenAI и ответа ассистента — AnalysisError.
+        """
+        throttle = openai_budget().consume
+
         # создаём thread и заливаем сообщения
-        thread = openai.beta.threads.create()
-        for qa_item in qa:
-            openai.beta.threads.messages.create(
-                thread_id=thread.id,
-                role="user",
-                content=json.dumps(qa_item)
-            )
+        with timer.span("thread_create"):
+            thread = call_openai("OpenAI thread creation failed", throttle,
+                                 openai.beta.threads.create)
+        with timer.span("message_post"):
+            for qa_item in qa:
+                call_openai(
+                    "Thread messaging failed", throttle,
+                    openai.beta.threads.messages.create,
+                    thread_id=thread.id,
+                    role="user",
+                    content=json.dumps(qa_item)
+                )
 
         # запускаем run
-        run = openai.beta.threads.runs.create(thread_id=thread.id, assistant_id=assistant_id)
-        while run.status in ("queued", "in_progress"):
-            time.sleep(1)
-            run = openai.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
-
-        msgs = openai.beta.threads.messages.list(thread_id=thread.id)
+        with timer.span("run_queued"):
+            run = call_openai("Run creation failed", throttle, openai.beta.threads.runs.create,
+                              thread_id=thread.id, assistant_id=assistant_id)
+        run = wait_for_run(thread.id, run, timer)
+
+        with timer.span("message_list"):
+            msgs = call_openai("Listing thread messages failed", throttle,
+                               openai.beta.threads.messages.list, thread_id=thread.id)
         if not msgs.data:
-            return Response({"detail": "No assistant response"}, status=500)
+            raise AnalysisError("No assistant response")
 
         reply = msgs.data[0].content[0].text.value
-        try:
-            payload = json.loads(reply)
-        except json.JSONDecodeError:
-            return Response({"detail": "Invalid JSON", "raw": reply}, status=500)
+        with timer.span("parse"):
+            try:
+                payload = json.loads(reply)
+            except json.JSONDecodeError:
+                raise AnalysisError("Invalid JSON", raw=reply)
 
         # очищаем старые секции и сохраняем новые
-        draft.sections.all().delete()
-        for idx, sec in enumerate(payload.get('sections', []), start=1):
-            DraftSection.objects.create(
-                draft_letter=draft,
-                section_key=sec['key'],
-                prompt_hint=sec['prompt_hint'],
-                tone_style=sec['tone_style'],
-                order=idx
-            )
-        draft.status = 'generated'
-        draft.save()
+        with timer.span("db"):
+            draft.sections.all().delete()
+            for idx, sec in enumerate(payload.get('sections', []), start=1):
+                DraftSection.objects.create(
+                    draft_letter=draft,
+                    section_key=sec['key'],
+                    prompt_hint=sec['prompt_hint'],
+                    tone_style=sec['tone_style'],
+                    order=idx
+                )
+            draft.status = 'generated'
+            draft.timings = timer.finish()
+            draft.save()
 
-        serializer = DraftSectionSerializer(draft.sections, many=True)
-        return Response(serializer.data, status=200)
+    @action(detail=True, methods=['post'], url_path='generate_sections')
+    def generate_sections(self, request, pk=None):
+        """
+        POST /api/draft_letters/{id}/generate_sections/
+        Разворачивает каждую DraftSection в текст: по вызову модели на раздел,
+        параллельно. Ответ — NDJSON-поток, строка на раздел по мере готовности,
+        последней строкой итог. Каждый раздел сохраняется в БД сразу, как готов,
+        поэтому обрыв соединения посреди потока не теряет уже готовые разделы.
+        """
+        draft = self.get_object()
+
+        if not getattr(request.user, 'has_subscription', False):
+            return Response({"locked": True}, status=status.HTTP_402_PAYMENT_REQUIRED)
+
+        sections = list(draft.sections.order_by('order'))
+        if not sections:
+            return Response({"detail": "Сначала сгенерируйте структуру"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        context = {
+            "user_id": str(request.user.id),
+            "draft_id": str(draft.id),
+            "letter_type": draft.get_type_display(),
+            "program": draft.program,
+            "answers": [
+                {"key": a.question_key, "answer": a.answer_text}
+                for a in draft.answers.order_by('order')
+            ],
+        }
+        section_data = [
+            {
+                "id": str(sec.id),
+                "section_key": sec.section_key,
+                "prompt_hint": sec.prompt_hint,
+                "tone_style": sec.tone_style,
+            }
+            for sec in sections
+        ]
+
+        def stream():
+            generated = 0
+            for sec, text, error in iter_generated_sections(
+                section_data, context, settings.DRAFT_SECTION_MAX_WORKERS
+            ):
+                line = {"id": sec["id"], "section_key": sec["section_key"]}
+                if error is None:
+                    # до yield: клиент может отключиться на любой строке
+                    DraftSection.objects.filter(id=sec["id"]).update(
+                        user_text=text, updated_at=timezone.now()
+                    )
+                    generated += 1
+                    line["user_text"] = text
+                else:
+                    line["error"] = str(error)
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+
+            yield json.dumps({
+                "done": True,
+                "generated": generated,
+                "failed": len(sections) - generated,
+            }) + "\n"
+
+        return StreamingHttpResponse(stream(), content_type="application/x-ndjson")
 
     @action(detail=True, methods=['patch'], url_path='sections/(?P<section_id>[^/.]+)')
     def update_section_text(self, request, pk=None, section_id=None):
@@ -381,4 +393,16 @@ class DraftLetterViewSet(viewsets.ModelViewSet):
             section_key=section.section_key,
             text=section.user_text
         )
-        return Response(DraftSectionSerializer(section).data)
\ No newline at end of file
+        return Response(DraftSectionSerializer(section).data)
+
+
+def metrics(request):
+    """
+    GET /api/metrics/ — гистограммы фаз analyse / generate_structure
+    в формате Prometheus. Нужен заголовок X-Metrics-Token, равный METRICS_TOKEN;
+    пока токен не задан, эндпоинт закрыт.
+    """
+    token = settings.METRICS_TOKEN
+    if not token or not hmac.compare_digest(request.headers.get("X-Metrics-Token", ""), token):
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4")
@@ -7,6 +7,7 @@ from .models import (
     UniversityFavorite,
     ProgramFavorite,
     ScholarshipFavorite,
+    ProgramRecommendation,
 )
 
 @admin.register(University)
@@ -50,3 +51,9 @@ class ScholarshipFavoriteAdmin(admin.ModelAdmin):
 from django.contrib import admin
 
 # Register your models here.
+
+
+@admin.register(ProgramRecommendation)
+class ProgramRecommendationAdmin(admin.ModelAdmin):
+    list_display = ('user', 'computed_at')
+    autocomplete_fields = ('user',)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class UniversitiesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "universities"
+
+    def ready(self):
+        # синхронизация индекса программ и сброс рекомендаций при изменении избранного
+        from . import signals  # noqa: F401
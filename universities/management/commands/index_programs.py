@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from universities import program_index
+from universities.models import Program
+
+
+class Command(BaseCommand):
+    help = (
+        "Эмбеддит описания всех программ в индекс для /programs/semantic/ и "
+        "удаляет из него программы, которых больше нет в БД. Неизменённые "
+        "программы пропускаются, поэтому команду можно запускать повторно. "
+        "С сервером векторного поиска (FAISS_SERVER_SOCKET) пишет через него. "
+        "Дальше индекс обновляется при сохранении Program — через сервер или, "
+        "без него, самим воркером; команда нужна для первого заполнения и "
+        "после loaddata."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=256,
+                            help="Программ в одном запросе к embeddings API")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        store = program_index.server_client or program_index.writable_store()
+        programs = Program.objects.select_related("university").order_by("id")
+        started = time.monotonic()
+        total = written = 0
+        batch = []
+        for program in programs.iterator(chunk_size=batch_size):
+            batch.append(program)
+            if len(batch) == batch_size:
+                written += program_index.index_programs(batch, store)
+                total += len(batch)
+                batch = []
+                self.stdout.write(f"programs={total} written={written}")
+        if batch:
+            written += program_index.index_programs(batch, store)
+            total += len(batch)
+        removed = program_index.prune_programs(store)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово: {total} программ, записано {written}, удалено {removed} "
+            f"за {time.monotonic() - started:.1f} с"
+        ))
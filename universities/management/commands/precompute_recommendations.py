@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from universities import recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает рекомендации программ (/programs/recommended/) всем "
+        "пользователям с избранным. Запускать по cron раз в ночь, после "
+        "index_programs: так в рекомендации попадают новые программы. "
+        "Между запусками рекомендации пересчитываются при изменении избранного."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="Пользователей в одном матричном расчёте")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        users = recommendations.precompute_all(
+            options["batch_size"],
+            report=lambda done: self.stdout.write(f"users={done}"),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово: {users} пользователей за {time.monotonic() - started:.1f} с"
+        ))
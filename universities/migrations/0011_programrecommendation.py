@@ -0,0 +1,26 @@
+# Generated by Django 5.2.1 on 2026-10-19 13:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("universities", "0010_alter_programfavorite_options_and_more"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProgramRecommendation",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("items", models.JSONField(default=list, help_text="[{id, distance}] рекомендованных программ, ближайшие первыми")),
+                ("favorites", models.JSONField(default=list, help_text="id избранных программ, по которым посчитаны рекомендации")),
+                ("computed_at", models.DateTimeField(auto_now=True)),
+                ("user", models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name="program_recommendations", to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
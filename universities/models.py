@@ -204,3 +204,24 @@ class ScholarshipFavorite(models.Model):
     class Meta:
         unique_together = ("user", "scholarship")
         ordering = ["-pinned", "order"]
+
+
+# -----------------------
+# РЕКОМЕНДАЦИИ
+# -----------------------
+
+class ProgramRecommendation(models.Model):
+    user        = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="program_recommendations"
+    )
+    items       = models.JSONField(
+        default=list,
+        help_text="[{id, distance}] рекомендованных программ, ближайшие первыми"
+    )
+    favorites   = models.JSONField(
+        default=list,
+        help_text="id избранных программ, по которым посчитаны рекомендации"
+    )
+    computed_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,156 @@
+# universities/program_index.py
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import connection, transaction
+
+from letters import vector_utils
+from letters.vector_server import VectorClient
+from .models import Program
+
+PROGRAM_INDEX_PATH    = os.getenv("PROGRAM_INDEX_PATH", "./program_index.bin")
+PROGRAM_DOCSTORE_PATH = os.getenv("PROGRAM_DOCSTORE_PATH", "./program_docs")
+# Каталог программ небольшой — по умолчанию точный поиск
+PROGRAM_INDEX_TYPE    = os.getenv("PROGRAM_INDEX_TYPE", "flat")
+# Имя индекса на сервере векторного поиска (run_vector_server)
+STORE_NAME = "programs"
+
+# С сервером векторного поиска (run_vector_server) пишет только он. Без него
+# воркер, сохранивший Program, пишет сам через свой writable_store(): запись
+# идёт под flock на файле индекса, поэтому воркеры и index_programs не пишут
+# одновременно. Для поиска в остальное время индекс открыт только на чтение
+store = vector_utils.VectorStore(PROGRAM_INDEX_PATH, PROGRAM_DOCSTORE_PATH, PROGRAM_INDEX_TYPE,
+                                 read_only=True)
+server_client = (VectorClient(vector_utils.SERVER_SOCKET, store=STORE_NAME)
+                 if vector_utils.SERVER_SOCKET else None)
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+_writer: Optional[vector_utils.VectorStore] = None
+_writer_pid: Optional[int] = None
+
+
+def backend():
+    # поиск: через сервер, если он есть, иначе по файлам индекса — через writer
+    # этого процесса, если он уже открыт, чтобы сразу видеть свои записи
+    if server_client is not None:
+        return server_client
+    return _writer if _writer_pid == os.getpid() else store
+
+
+def writable_store() -> vector_utils.VectorStore:
+    """Индекс для записи из этого процесса — для run_vector_server и index_programs."""
+    return vector_utils.VectorStore(PROGRAM_INDEX_PATH, PROGRAM_DOCSTORE_PATH, PROGRAM_INDEX_TYPE)
+
+
+def _executor() -> ThreadPoolExecutor:
+    # свой пул в каждом воркере gunicorn: потоки не переживают fork
+    global _pool, _pool_pid
+    if _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool_pid != os.getpid():
+                _pool = ThreadPoolExecutor(1, thread_name_prefix="program-index")
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def _write_target():
+    """Куда пишут сигналы: сервер, а без него — writable_store() этого процесса."""
+    global _writer, _writer_pid
+    if server_client is not None:
+        return server_client
+    if _writer_pid != os.getpid():
+        with _pool_lock:
+            if _writer_pid != os.getpid():
+                _writer = writable_store()
+                _writer_pid = os.getpid()
+    return _writer
+
+
+def program_document(program) -> Tuple[str, str, Dict[str, str]]:
+    """
+    (id, текст, метаданные) программы для индекса: название, университет,
+    место, формат обучения и описание.
+    """
+    parts = [
+        f"{program.name}. {program.university.name}, {program.city}, {program.country}.",
+        f"{program.get_study_type_display()}, {program.get_study_format_display()}, {program.duration}.",
+        program.description,
+    ]
+    metadata = {"country": program.country, "university_id": str(program.university_id)}
+    return str(program.id), "\n".join(p for p in parts if p), metadata
+
+
+def index_programs(programs: Iterable, store=None) -> int:
+    """
+    Добавляет или обновляет программы в индексе store (по умолчанию — через
+    сервер или writer этого процесса); неизменённые не эмбеддятся повторно.
+    Возвращает число записанных.
+    """
+    docs = [program_document(program) for program in programs]
+    return vector_utils.upsert_documents(docs, store=store or _write_target()) if docs else 0
+
+
+def remove_programs(ids: Iterable, store=None) -> int:
+    return vector_utils.delete_documents([str(i) for i in ids], store=store or _write_target())
+
+
+def prune_programs(store) -> int:
+    """Удаляет из индекса программы, которых больше нет в БД; возвращает их число."""
+    ids, cursor = [], None
+    while True:
+        docs, _, cursor = store.scan(cursor, 5000)
+        ids.extend(int(doc["id"]) for doc in docs)
+        if cursor is None:
+            break
+    existing = set(Program.objects.filter(id__in=ids).values_list("id", flat=True))
+    missing = [i for i in ids if i not in existing]
+    return remove_programs(missing, store) if missing else 0
+
+
+def normalize_query(q: str) -> str:
+    # одинаковые по сути запросы попадают в один ключ кэша эмбеддингов
+    return " ".join(q.split())
+
+
+def search_programs(q: str, k: int, ids: Optional[List[int]] = None) -> List[Dict]:
+    """
+    k ближайших к запросу программ: [{"id", "distance"}], ближайшие первыми.
+    ids ограничивает выбор (например, программами, прошедшими ProgramFilter).
+    Эмбеддинг запроса берётся из общего кэша эмбеддингов, если такой запрос уже был.
+    """
+    vector = vector_utils.embed_queries([normalize_query(q)])
+    hits = backend().search_batch(vector, k, ids=None if ids is None else [str(i) for i in ids])[0]
+    return [{"id": int(hit["id"]), "distance": hit["distance"]} for hit in hits]
+
+
+def _safely(action, *args) -> None:
+    # сбой индекса или embeddings API не должен ломать сохранение в БД
+    try:
+        action(*args)
+    except Exception:
+        logging.exception("Program index update failed")
+    finally:
+        # у каждого потока своё соединение с БД
+        connection.close()
+
+
+def _reindex(lookup: Dict) -> int:
+    return index_programs(Program.objects.select_related("university").filter(**lookup))
+
+
+def update_later(lookup: Optional[Dict] = None, removed: Optional[List] = None) -> None:
+    """
+    После коммита переиндексирует программы Program.objects.filter(**lookup)
+    и удаляет removed — в фоновом потоке, чтобы сохранение не ждало
+    embeddings API. Пишет сервер векторного поиска, а без него — этот процесс.
+    """
+    if lookup is not None:
+        transaction.on_commit(lambda: _executor().submit(_safely, _reindex, lookup))
+    if removed:
+        transaction.on_commit(lambda: _executor().submit(_safely, remove_programs, removed))
@@ -0,0 +1,140 @@
+# universities/recommendations.py
+
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from . import program_index
+from .models import ProgramFavorite, ProgramRecommendation
+
+
+def preference_vectors(vectors: np.ndarray, rows: np.ndarray, n_users: int) -> np.ndarray:
+    """
+    Вектор предпочтений каждого пользователя — нормированное среднее
+    векторов его избранных программ (rows[i] — пользователь vectors[i]).
+    У пользователя без векторов — нулевой.
+    """
+    prefs = np.zeros((n_users, vectors.shape[1]), dtype="float32")
+    if len(rows):
+        order = np.argsort(rows, kind="stable")
+        users, starts = np.unique(rows[order], return_index=True)
+        prefs[users] = np.add.reduceat(vectors[order], starts, axis=0)
+    norms = np.linalg.norm(prefs, axis=1, keepdims=True)
+    return np.divide(prefs, norms, out=prefs, where=norms > 0)
+
+
+def nearest(prefs: np.ndarray, vectors: np.ndarray, norms: np.ndarray,
+            exclude: Tuple[np.ndarray, np.ndarray], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    k ближайших к каждой строке prefs строк vectors (norms — их квадраты
+    норм) и расстояния до них — квадрат L2, как в индексе программ.
+    exclude — пары (строка prefs, строка vectors), которые не предлагать;
+    их место занимают следующие, а где кандидатов не хватило — inf.
+    """
+    distances = norms[None, :] - 2 * prefs @ vectors.T
+    distances += (prefs * prefs).sum(axis=1, keepdims=True)
+    distances[exclude] = np.inf
+    k = min(k, vectors.shape[0])
+    if k == 0:
+        return np.zeros((len(prefs), 0), dtype="int64"), np.zeros((len(prefs), 0), dtype="float32")
+    top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    top_distances = np.take_along_axis(distances, top, axis=1)
+    order = np.argsort(top_distances, axis=1)
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_distances, order, axis=1)
+
+
+def program_vectors(batch_size: int = 5000) -> Tuple[np.ndarray, np.ndarray]:
+    """id и векторы всех программ индекса, по возрастанию id."""
+    ids, chunks, cursor = [], [], None
+    while True:
+        docs, vectors, cursor = program_index.backend().scan(cursor, batch_size)
+        ids.extend(int(doc["id"]) for doc in docs)
+        chunks.append(vectors)
+        if cursor is None:
+            break
+    ids = np.array(ids, dtype="int64")
+    order = np.argsort(ids)
+    return ids[order], np.vstack(chunks)[order]
+
+
+def precompute_all(batch_size: int = 1000, k: Optional[int] = None,
+                   report: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Пересчитывает рекомендации всех пользователей с избранными программами
+    разом: векторы программ читаются из индекса один раз, расстояния
+    считаются матрицей на batch_size пользователей. Возвращает число
+    пользователей.
+    """
+    k = k or settings.PROGRAM_RECOMMENDATIONS_K
+    ids, vectors = program_vectors()
+    norms = (vectors * vectors).sum(axis=1)
+    pairs = np.array(ProgramFavorite.objects.order_by("user_id", "program_id")
+                     .values_list("user_id", "program_id"), dtype="int64").reshape(-1, 2)
+    users, rows = np.unique(pairs[:, 0], return_inverse=True)
+    # строки избранных программ в vectors; неиндексированные пропускаются
+    positions = np.searchsorted(ids, pairs[:, 1])
+    indexed = positions < len(ids)
+    indexed[indexed] = ids[positions[indexed]] == pairs[indexed, 1]
+    bounds = np.searchsorted(rows, np.arange(len(users) + 1))
+
+    for start in range(0, len(users), batch_size):
+        stop = min(start + batch_size, len(users))
+        chunk = slice(bounds[start], bounds[stop])
+        mask = indexed[chunk]
+        chunk_rows = rows[chunk][mask] - start
+        chunk_positions = positions[chunk][mask]
+        prefs = preference_vectors(vectors[chunk_positions], chunk_rows, stop - start)
+        top, distances = nearest(prefs, vectors, norms, (chunk_rows, chunk_positions), k)
+        counts = np.bincount(chunk_rows, minlength=stop - start)
+
+        recommendations = []
+        for i in range(stop - start):
+            items = [{"id": int(ids[j]), "distance": float(d)}
+                     for j, d in zip(top[i], distances[i]) if counts[i] and np.isfinite(d)]
+            favorites = pairs[bounds[start + i]:bounds[start + i + 1], 1].tolist()
+            recommendations.append(ProgramRecommendation(
+                user_id=int(users[start + i]), items=items, favorites=favorites,
+            ))
+        ProgramRecommendation.objects.bulk_create(
+            recommendations, update_conflicts=True, unique_fields=["user"],
+            update_fields=["items", "favorites", "computed_at"],
+        )
+        if report is not None:
+            report(stop)
+    return len(users)
+
+
+def compute(favorites: Sequence[int], k: int) -> List[Dict]:
+    """
+    Рекомендации по списку избранного через поиск в индексе. Векторы
+    избранных читаются из индекса — без обращения к embeddings API;
+    программы, которых в индексе нет, не учитываются.
+    """
+    _, vectors = program_index.backend().vectors([str(i) for i in favorites])
+    if not len(vectors):
+        return []
+    prefs = preference_vectors(vectors, np.zeros(len(vectors), dtype="int64"), 1)
+    hits = program_index.backend().search_batch(prefs, k + len(favorites))[0]
+    favorite_ids = {str(i) for i in favorites}
+    return [{"id": int(hit["id"]), "distance": hit["distance"]}
+            for hit in hits if hit["id"] not in favorite_ids][:k]
+
+
+def recommendations_for(user) -> List[Dict]:
+    """
+    [{"id", "distance"}] программ, похожих на избранные пользователем,
+    ближайшие первыми. Берётся из ProgramRecommendation (ночной пересчёт
+    precompute_recommendations); если её нет или избранное с тех пор
+    изменилось — считается сейчас и сохраняется.
+    """
+    favorites = list(ProgramFavorite.objects.filter(user=user)
+                     .order_by("program_id").values_list("program_id", flat=True))
+    stored = ProgramRecommendation.objects.filter(user=user).first()
+    if stored is not None and stored.favorites == favorites:
+        return stored.items
+    items = compute(favorites, settings.PROGRAM_RECOMMENDATIONS_K) if favorites else []
+    ProgramRecommendation.objects.update_or_create(
+        user=user, defaults={"items": items, "favorites": favorites},
+    )
+    return items
@@ -0,0 +1,36 @@
+# universities/signals.py
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import program_index
+from .models import Program, ProgramFavorite, ProgramRecommendation, University
+
+
+@receiver(post_save, sender=Program)
+def index_saved_program(sender, instance, raw=False, **kwargs):
+    # loaddata (raw) — индекс потом перестраивается командой index_programs
+    if raw:
+        return
+    program_index.update_later({"pk": instance.pk})
+
+
+@receiver(post_delete, sender=Program)
+def remove_deleted_program(sender, instance, **kwargs):
+    program_index.update_later(removed=[instance.pk])
+
+
+@receiver(post_save, sender=University)
+def reindex_university_programs(sender, instance, raw=False, **kwargs):
+    # название университета входит в текст его программ; неизменённые пропустятся
+    if raw:
+        return
+    program_index.update_later({"university_id": instance.pk})
+
+
+@receiver(post_save, sender=ProgramFavorite)
+@receiver(post_delete, sender=ProgramFavorite)
+def invalidate_recommendations(sender, instance, created=True, raw=False, **kwargs):
+    # порядок, закрепление и статус на рекомендации не влияют
+    if created:
+        ProgramRecommendation.objects.filter(user_id=instance.user_id).delete()
@@ -1,3 +1,163 @@
-from django.test import TestCase
+import os
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.test import SimpleTestCase, TransactionTestCase
+
+from letters import vector_utils
+from letters.vector_utils import VectorStore
+from . import program_index
+from .models import Program, University
+from .recommendations import nearest, preference_vectors, program_vectors
+
+D = 8
+
+
+def random_vectors(n, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, D)).astype("float32")
+
+
+class PreferenceVectorTests(SimpleTestCase):
+
+    def test_normalized_mean_per_user(self):
+        vectors = random_vectors(5)
+        rows = np.array([2, 0, 2, 2, 0])
+        prefs = preference_vectors(vectors, rows, 4)
+
+        for user, members in ((0, [1, 4]), (2, [0, 2, 3])):
+            expected = vectors[members].mean(axis=0)
+            np.testing.assert_allclose(prefs[user], expected / np.linalg.norm(expected), rtol=1e-5)
+        # без избранного — нулевой вектор, а не NaN
+        np.testing.assert_array_equal(prefs[[1, 3]], 0)
+
+    def test_no_favorites(self):
+        prefs = preference_vectors(np.zeros((0, D), dtype="float32"), np.zeros(0, dtype="int64"), 2)
+        np.testing.assert_array_equal(prefs, np.zeros((2, D)))
+
+
+class NearestTests(SimpleTestCase):
+
+    def setUp(self):
+        self.vectors = random_vectors(20)
+        self.norms = (self.vectors * self.vectors).sum(axis=1)
+        self.prefs = random_vectors(3, seed=1)
+
+    def brute_force(self, row, k, excluded=()):
+        distances = ((self.vectors - self.prefs[row]) ** 2).sum(axis=1)
+        distances[list(excluded)] = np.inf
+        order = np.argsort(distances)[:k]
+        return order, distances[order]
+
+    def test_matches_exact_squared_l2(self):
+        no_exclusions = (np.zeros(0, dtype="int64"), np.zeros(0, dtype="int64"))
+        indices, distances = nearest(self.prefs, self.vectors, self.norms, no_exclusions, 5)
+        for row in range(3):
+            expected, expected_distances = self.brute_force(row, 5)
+            np.testing.assert_array_equal(indices[row], expected)
+            np.testing.assert_allclose(distances[row], expected_distances, rtol=1e-4, atol=1e-4)
+
+    def test_excluded_pairs_are_skipped(self):
+        best = self.brute_force(0, 2)[0]
+        exclude = (np.array([0, 0]), best)
+        indices, _ = nearest(self.prefs, self.vectors, self.norms, exclude, 5)
+        np.testing.assert_array_equal(indices[0], self.brute_force(0, 5, excluded=best)[0])
+        self.assertFalse(set(best) & set(indices[0].tolist()))
+        # у других пользователей исключение не действует
+        np.testing.assert_array_equal(indices[1], self.brute_force(1, 5)[0])
+
+    def test_k_larger_than_catalog(self):
+        exclude = (np.array([0]), np.array([3]))
+        indices, distances = nearest(self.prefs, self.vectors[:4], self.norms[:4], exclude, 10)
+        self.assertEqual(indices.shape, (3, 4))
+        self.assertEqual(indices[0, -1], 3)
+        self.assertEqual(distances[0, -1], np.inf)
+
+
+class ProgramIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.paths = (os.path.join(tmp.name, "programs.bin"), os.path.join(tmp.name, "programs_docs"))
+        self.store = VectorStore(*self.paths, "flat", D, metric="l2")
+        patcher = mock.patch.object(program_index, "backend", return_value=self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_program_vectors_sorted_by_id(self):
+        vectors = random_vectors(12)
+        ids = [str(i) for i in (7, 3, 11, 5, 1, 9, 2, 8, 4, 10, 6, 12)]
+        self.store.upsert(ids, vectors, ids)
+        self.store.delete(["5"])
+
+        found_ids, found = program_vectors(batch_size=5)
+        expected = sorted(int(i) for i in ids if i != "5")
+        self.assertEqual(found_ids.tolist(), expected)
+        for program_id, vector in zip(found_ids, found):
+            np.testing.assert_allclose(vector, vectors[ids.index(str(program_id))])
+
+    def test_read_only_store_refuses_writes(self):
+        reader = VectorStore(*self.paths, "flat", D, metric="l2", read_only=True)
+        with self.assertRaisesRegex(RuntimeError, "read-only"):
+            reader.upsert(["1"], random_vectors(1), ["1"])
+
+
+VOCABULARY = ["physics", "history", "chemistry"]
+
+
+def fake_embeddings(texts):
+    """Эмбеддинг без embeddings API: по измерению на каждое слово VOCABULARY в тексте."""
+    vectors = np.zeros((len(texts), D), dtype="float32")
+    for row, text in enumerate(texts):
+        for column, word in enumerate(VOCABULARY):
+            vectors[row, column] = word in text.lower()
+    return vectors
+
+
+class ProgramSignalTests(TransactionTestCase):
+    """Без сервера векторного поиска сохранение Program само обновляет индекс."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        paths = (os.path.join(tmp.name, "programs.bin"), os.path.join(tmp.name, "programs_docs"))
+        patches = [
+            mock.patch.object(program_index, "server_client", None),
+            mock.patch.object(program_index, "store",
+                              VectorStore(*paths, "flat", D, metric="l2", read_only=True)),
+            mock.patch.object(program_index, "writable_store",
+                              lambda: VectorStore(*paths, "flat", D, metric="l2")),
+            mock.patch.object(program_index, "_writer_pid", None),
+            mock.patch.object(vector_utils, "embed_texts", fake_embeddings),
+            mock.patch.object(vector_utils, "embed_queries", fake_embeddings),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.university = University.objects.create(name="Oxford", country="UK", city="Oxford",
+                                                    study_format="campus")
+
+    def create_program(self, name):
+        return Program.objects.create(university=self.university, name=name, study_type="full-time",
+                                      study_format="campus", city="Oxford", country="UK",
+                                      tuition_fee=30000, duration="1 year")
+
+    def search(self, q):
+        # пул индексации однопоточный: пустая задача выполнится после всех поставленных раньше
+        program_index._executor().submit(lambda: None).result()
+        return [hit["id"] for hit in program_index.search_programs(q, 5) if hit["distance"] < 0.5]
+
+    def test_save_and_delete_reach_the_search(self):
+        physics = self.create_program("Physics MSc")
+        history = self.create_program("History MA")
+        self.assertEqual(self.search("physics"), [physics.id])
+        self.assertEqual(self.search("history"), [history.id])
+
+        history.name = "Chemistry MSc"
+        history.save()
+        self.assertEqual(self.search("chemistry"), [history.id])
+        self.assertEqual(self.search("history"), [])
+
+        physics.delete()
+        self.assertEqual(self.search("physics"), [])
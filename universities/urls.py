@@ -59,6 +59,18 @@ urlpatterns = [
         ProgramViewSet.as_view({'get': 'autocomplete'}),
         name='program-autocomplete'
     ),
+    # Поиск программ по смыслу описания (с теми же фильтрами, что и список)
+    path(
+        'programs/semantic/',
+        ProgramViewSet.as_view({'get': 'semantic'}),
+        name='program-semantic'
+    ),
+    # Рекомендации по избранным программам пользователя
+    path(
+        'programs/recommended/',
+        ProgramViewSet.as_view({'get': 'recommended'}),
+        name='program-recommended'
+    ),
 
 
     # ======================
@@ -1,5 +1,8 @@
 # universities/views.py
 
+import logging
+
+from django.conf import settings
 from django.db.models import Count, Min
 from rest_framework import viewsets, mixins, permissions, status
 from rest_framework.decorators import action
@@ -23,6 +26,7 @@ from .serializers import (
     ScholarshipFavoriteSerializer
 )
 from .filters import UniversityFilter, ProgramFilter, ScholarshipFilter
+from . import program_index, recommendations
 
 class IsOwner(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
@@ -69,6 +73,8 @@ class ProgramViewSet(viewsets.ReadOnlyModelViewSet):
     retrieve: GET /programs/{pk}/    → детальная информация по программе
 
     autocomplete: GET /programs/autocomplete/?q=<строка>
+    semantic:     GET /programs/semantic/?q=<описание>&limit=<n> (+ фильтры ProgramFilter)
+    recommended:  GET /programs/recommended/?limit=<n> → похожие на избранные программы
     """
     queryset = Program.objects.select_related("university").all()
 
@@ -96,6 +102,86 @@ class ProgramViewSet(viewsets.ReadOnlyModelViewSet):
         ]
         return Response({"results": data}, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=["get"])
+    def semantic(self, request):
+        """
+        Программы, ближайшие к запросу по смыслу описания («data science с
+        упором на климат»), среди прошедших фильтры ProgramFilter
+        (стоимость, дедлайн, экзамены...). Фильтры применяются внутри
+        векторного поиска, поэтому результатов не становится меньше limit,
+        пока подходящие программы есть.
+        """
+        q = request.query_params.get("q", "").strip()
+        if not q:
+            return Response({"results": []})
+        try:
+            limit = min(max(int(request.query_params.get("limit", 20)), 1), 100)
+        except ValueError:
+            return Response({"detail": "limit должен быть числом"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        filterset = ProgramFilter(request.query_params, queryset=self.get_queryset(), request=request)
+        if not filterset.is_valid():
+            return Response(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
+        # без фильтров ищем по всему индексу, не выгружая id из БД
+        ids = None
+        if any(value not in (None, "") for value in filterset.form.cleaned_data.values()):
+            ids = list(filterset.qs.values_list("id", flat=True))
+
+        try:
+            hits = program_index.search_programs(q, limit, ids)
+        except Exception:
+            logging.exception("Semantic program search failed")
+            return Response({"detail": "Семантический поиск временно недоступен"},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        programs = self.get_queryset().prefetch_related("scholarships").in_bulk(
+            [hit["id"] for hit in hits]
+        )
+        results = []
+        for hit in hits:
+            program = programs.get(hit["id"])
+            if program is None:
+                continue  # удалена, индекс обновится после коммита
+            data = ProgramMiniSerializer(program).data
+            data["distance"] = hit["distance"]
+            results.append(data)
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["get"], permission_classes=[permissions.IsAuthenticated])
+    def recommended(self, request):
+        """
+        Программы, похожие по описанию на избранные пользователем (кроме
+        самих избранных). Рекомендации пересчитываются ночью
+        (precompute_recommendations) и сразу после изменения избранного.
+        """
+        try:
+            limit = min(max(int(request.query_params.get("limit", 20)), 1),
+                        settings.PROGRAM_RECOMMENDATIONS_K)
+        except ValueError:
+            return Response({"detail": "limit должен быть числом"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            hits = recommendations.recommendations_for(request.user)[:limit]
+        except Exception:
+            logging.exception("Program recommendations failed")
+            return Response({"detail": "Рекомендации временно недоступны"},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        programs = self.get_queryset().prefetch_related("scholarships").in_bulk(
+            [hit["id"] for hit in hits]
+        )
+        results = []
+        for hit in hits:
+            program = programs.get(hit["id"])
+            if program is None:
+                continue  # удалена после расчёта рекомендаций
+            data = ProgramMiniSerializer(program).data
+            data["distance"] = hit["distance"]
+            results.append(data)
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
 
 # ============================
 #     ScholarshipViewSet